@@ -0,0 +1,149 @@
+"""
+This module contains a local stand-in for the OpenWeather API, serving
+recorded payloads with a configurable latency.
+"""
+import copy
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+PAYLOADS_DIR = Path(__file__).parent / 'payloads'
+
+# Recorded payload served per endpoint, matched on the end of the request path
+ENDPOINT_PAYLOADS = {
+    '2.5/weather': 'current_weather.json',
+    '3.0/onecall/day_summary': 'day_summary.json',
+    '3.0/onecall/timemachine': 'timemachine.json',
+    '2.5/air_pollution/history': 'air_pollution_history.json',
+    '2.5/air_pollution': 'air_pollution.json',
+}
+
+
+def locate(payload: Dict, lat: float, lon: float):
+    """
+    Moves a payload to the requested coordinates, so that the
+    extractors match it to the right city.
+
+    :param payload: The payload to update in place.
+    :param lat: The requested latitude.
+    :param lon: The requested longitude.
+    """
+    if 'coord' in payload:
+        payload['coord'] = {'lat': lat, 'lon': lon}
+    else:
+        payload['lat'], payload['lon'] = lat, lon
+
+
+class FakeOpenWeatherServer:
+    """ Threaded HTTP server answering OpenWeather requests with recorded payloads """
+    def __init__(self, latency: float = 0.0, host: str = '127.0.0.1', port: int = 0,
+                 payloads_dir: Path = PAYLOADS_DIR):
+        """
+        :param latency: The time in seconds spent before answering each request.
+        :param host: The interface to listen on.
+        :param port: The port to listen on, 0 for any free port.
+        :param payloads_dir: The directory holding the recorded payloads.
+        """
+        self.latency = latency
+        self.payloads = {endpoint: json.loads((payloads_dir / name).read_text(encoding='utf-8'))
+                         for endpoint, name in ENDPOINT_PAYLOADS.items()}
+        # (path, lat, lon, wall-clock time the request was received)
+        self.requests: List[Tuple[str, float, float, float]] = []
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep the connections alive, as the real API does, and send each
+            # response in one write so that Nagle's algorithm does not delay it
+            protocol_version = 'HTTP/1.1'
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.request_queue_size = 128
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def payload(self, path: str, params: Dict[str, str]) -> Optional[Dict]:
+        """
+        Builds the response of a request from the recorded payload of its endpoint.
+
+        :param path: The path requested.
+        :param params: The query parameters.
+        :return: The payload, or None if the endpoint is unknown.
+        """
+        endpoint = next((endpoint for endpoint in ENDPOINT_PAYLOADS
+                         if path.endswith(endpoint)), None)
+        if endpoint is None:
+            return None
+        payload = copy.deepcopy(self.payloads[endpoint])
+        locate(payload, float(params.get('lat', 0)), float(params.get('lon', 0)))
+        if endpoint.endswith('history'):
+            # One hourly entry between start and end, as the real endpoint does
+            entry = payload['list'][0]
+            payload['list'] = [{**entry, 'dt': dt}
+                               for dt in range(int(params['start']), int(params['end']), 3600)]
+        return payload
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        received_at = time.time()
+        parts = urlsplit(request.path)
+        params = dict(parse_qsl(parts.query))
+
+        if parts.path == '/_requests':
+            # Hands over the request log to the benchmark
+            with self._lock:
+                payload, self.requests = self.requests, []
+        else:
+            payload = self.payload(parts.path, params)
+            if payload is not None and 'lat' in params:
+                with self._lock:
+                    self.requests.append((parts.path, float(params['lat']),
+                                          float(params['lon']), received_at))
+            if self.latency:
+                time.sleep(self.latency)
+
+        body = json.dumps(payload if payload is not None else
+                          {'cod': 404, 'message': 'Internal error'}).encode('utf-8')
+        request.send_response(200 if payload is not None else 404)
+        request.send_header('Content-Type', 'application/json; charset=utf-8')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self) -> str:
+        """
+        Starts serving in a background thread.
+
+        :return: The base URL of the server.
+        """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,281 @@
+"""
+This module runs the OpenWeather pipelines end to end against local
+stand-ins: a fake OpenWeather server, an in-memory datalake and a SQLite
+data warehouse. Each scenario runs in its own process so that its peak
+memory can be measured, and the results are saved as JSON to compare runs.
+
+Usage:
+    python -m benchmarks.run_benchmarks --cities 5 50 500 5000 --latency 0.05
+    python -m benchmarks.run_benchmarks --extractors air_pollution_history \
+        --baseline benchmarks/results/<previous run>.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+ROOT_PATH = Path(__file__).parents[1]
+RESULTS_DIR = Path(__file__).parent / 'results'
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+
+EXTRACTORS = ['current_weather', 'daily_weather', 'timestamp_weather',
+              'current_air_pollution', 'air_pollution_history']
+
+# DataPipeline arguments per mode
+MODES = {
+    'by_record': {},
+    'batched': {'batch_size': 1000},
+    'streaming': {'batch_size': 1000, 'streaming': True},
+    'streaming_columnar': {'batch_size': 1000, 'streaming': True, 'columnar': True},
+}
+
+# Start of the time ranges requested from the historical endpoints
+HISTORY_START = int(datetime(2024, 1, 1).timestamp())
+
+
+def build_cities(count: int, seed: int = 0) -> List[Dict]:
+    """
+    Draws distinct city coordinates over Australia.
+
+    :param count: The number of cities.
+    :param seed: The random seed, so that every run requests the same cities.
+    :return: The city documents, with id, lat and lon keys.
+    """
+    random = np.random.RandomState(seed)
+    latitudes = np.round(random.uniform(-43.0, -11.0, count), 4)
+    longitudes = np.round(random.uniform(113.0, 153.0, count), 4)
+    # Nudge duplicates apart, the city table needs unique coordinates
+    latitudes = latitudes + np.arange(count) * 1e-7
+    return [{'id': i + 1, 'lat': float(lat), 'lon': float(lon)}
+            for i, (lat, lon) in enumerate(zip(latitudes, longitudes))]
+
+
+def build_extractor(name: str, cities: List[Dict], history_days: int):
+    """
+    Builds the OpenWeather manager of a scenario.
+
+    :param name: The name of the extractor, one of EXTRACTORS.
+    :param cities: The cities to request.
+    :param history_days: The number of days requested from the air pollution history.
+    :return: The OpenWeatherAPI instance.
+    """
+    from utils.ELTL import OpenWeatherCurrentWeather, OpenWeatherDailyWeather, \
+        OpenWeatherTimestampWeather, OpenWeatherCurrentAirPollution, \
+        OpenWeatherDailyAirPollution
+
+    if name == 'current_weather':
+        return OpenWeatherCurrentWeather(cities=cities)
+    if name == 'daily_weather':
+        return OpenWeatherDailyWeather('2024-01-01', cities=cities)
+    if name == 'timestamp_weather':
+        return OpenWeatherTimestampWeather(HISTORY_START + 9 * 3600, cities=cities)
+    if name == 'current_air_pollution':
+        return OpenWeatherCurrentAirPollution(cities=cities)
+    if name == 'air_pollution_history':
+        return OpenWeatherDailyAirPollution(HISTORY_START, HISTORY_START + history_days * 86400,
+                                            cities=cities)
+    raise ValueError(f"Unknown extractor: {name}")
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    :return: The peak resident memory of the current process in MB,
+        or None where it cannot be measured.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_scenario(scenario: Dict) -> Dict:
+    """
+    Runs one scenario in the current process. The OpenWeather managers
+    are pointed at the stand-ins, so it must run in a fresh process.
+
+    :param scenario: The extractor, mode, cities and history_days of the scenario.
+    :return: The measures of the run.
+    """
+    import requests
+
+    from benchmarks.stand_ins import InMemoryDatalake, SQLiteWarehouse
+    from data_pipeline.pipeline_manager import DataPipeline
+    from database.models import City
+    from utils.ELTL import OpenWeatherAPI
+
+    cities = build_cities(scenario['cities'])
+    city_ids = {(city['lat'], city['lon']): city['id'] for city in cities}
+
+    with tempfile.TemporaryDirectory() as directory:
+        warehouse = SQLiteWarehouse(Path(directory) / 'warehouse.db')
+        warehouse.add_records(City, [{'id': city['id'], 'name': f"city-{city['id']}",
+                                      'country': 'AU', 'latitude': city['lat'],
+                                      'longitude': city['lon']} for city in cities])
+        warehouse.commits = []
+        datalake = InMemoryDatalake()
+        OpenWeatherAPI.datalake_manager = datalake
+        OpenWeatherAPI.data_warehouse_manager = warehouse
+
+        manager = build_extractor(scenario['extractor'], cities, scenario['history_days'])
+        pipeline = DataPipeline(manager, **MODES[scenario['mode']])
+        # Drop the requests left over by a previous scenario
+        requests.get(f"{OpenWeatherAPI.base_url}_requests")
+        start = time.perf_counter()
+        pipeline.run()
+        elapsed = time.perf_counter() - start
+
+        served = requests.get(f"{OpenWeatherAPI.base_url}_requests").json()
+        requested_at = {city_ids[(lat, lon)]: received_at for _, lat, lon, received_at in served}
+        latencies = np.array([committed_at - requested_at[city_id]
+                              for city_ids_committed, committed_at in warehouse.commits
+                              for city_id in city_ids_committed])
+
+    return {
+        **scenario,
+        'requests': len(served),
+        'records': len(latencies),
+        'datalake_documents': datalake.count(),
+        'seconds': round(elapsed, 3),
+        'records_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'latency_p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 1)
+        if len(latencies) else None,
+        'latency_p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 1)
+        if len(latencies) else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_in_subprocess(scenario: Dict, base_url: str, timeout: float) -> Dict:
+    """
+    Runs one scenario in a fresh interpreter.
+
+    :param scenario: The scenario to run.
+    :param base_url: The URL of the fake OpenWeather server.
+    :param timeout: The maximum duration of the scenario in seconds.
+    :return: The measures of the run, or the error it failed with.
+    """
+    env = {**os.environ,
+           'OPENWEATHER_BASE_URL': base_url,
+           'OPENWEATHER_API_KEY': 'benchmark',
+           'OPENWEATHER_CACHE_ENABLED': 'false',
+           'PIPELINE_METRICS_FILE': '',
+           'HTTP_MAX_RETRIES': '0',
+           'MONGO_INITDB_DATABASE': os.getenv('MONGO_INITDB_DATABASE', 'benchmark')}
+    try:
+        process = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.run_benchmarks', '--scenario', json.dumps(scenario)],
+            cwd=ROOT_PATH, env=env, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {**scenario, 'error': f"Timed out after {timeout}s"}
+
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    error = process.stderr.strip().splitlines()
+    return {**scenario, 'error': error[-1] if error else f"Exit code {process.returncode}"}
+
+
+def scenarios(extractors: List[str], modes: List[str], city_counts: List[int],
+              history_days: int) -> List[Dict]:
+    """
+    Lists the scenarios to run. The columnar mode only applies to the
+    air pollution history, the only extractor with a columnar transform.
+
+    :return: The scenarios, one per extractor, mode and city count.
+    """
+    return [{'extractor': extractor, 'mode': mode, 'cities': count,
+             'history_days': history_days}
+            for extractor in extractors
+            for mode in modes
+            if mode != 'streaming_columnar' or extractor == 'air_pollution_history'
+            for count in city_counts]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_PATH,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result: Dict, baseline: Dict):
+    name = f"{result['extractor']:<22} {result['mode']:<19} {result['cities']:>5} cities"
+    if 'error' in result:
+        print(f"{name}  FAILED: {result['error']}")
+        return
+    line = (f"{name}  {result['records']:>8} records  {result['records_per_second']:>9} rec/s  "
+            f"p50 {result['latency_p50_ms']} ms  p99 {result['latency_p99_ms']} ms  "
+            f"peak RSS {result['peak_rss_mb']:.0f} MB")
+    previous = baseline.get((result['extractor'], result['mode'], result['cities']))
+    if previous and previous.get('records_per_second'):
+        line += f"  ({result['records_per_second'] / previous['records_per_second']:.2f}x baseline)"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the OpenWeather pipelines "
+                                                 "against local stand-ins")
+    parser.add_argument('--extractors', nargs='+', choices=EXTRACTORS, default=EXTRACTORS)
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--cities', nargs='+', type=int, default=[5, 50, 500, 5000])
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="Latency of the fake API in seconds")
+    parser.add_argument('--history-days', type=int, default=1,
+                        help="Days requested per city from the air pollution history")
+    parser.add_argument('--timeout', type=float, default=1800,
+                        help="Maximum duration of a scenario in seconds")
+    parser.add_argument('--output', type=Path,
+                        help="Results file, defaults to benchmarks/results/<timestamp>.json")
+    parser.add_argument('--baseline', type=Path,
+                        help="Previous results file to compare the throughput with")
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        # Child process running a single scenario
+        print(RESULT_PREFIX + json.dumps(run_scenario(json.loads(args.scenario))))
+        return
+
+    from benchmarks.fake_openweather import FakeOpenWeatherServer
+
+    baseline = {}
+    if args.baseline:
+        baseline = {(result['extractor'], result['mode'], result['cities']): result
+                    for result in json.loads(args.baseline.read_text())['results']}
+
+    started_at = datetime.now()
+    results = []
+    with FakeOpenWeatherServer(latency=args.latency) as server:
+        for scenario in scenarios(args.extractors, args.modes, args.cities, args.history_days):
+            result = run_in_subprocess(scenario, server.base_url, args.timeout)
+            print_result(result, baseline)
+            results.append(result)
+
+    output = args.output or RESULTS_DIR / f"{started_at:%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'latency': args.latency,
+        'results': results,
+    }, indent=2))
+    print(f"Results saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+This module contains local stand-ins for the datalake and the data
+warehouse, so that the pipelines can be benchmarked without MongoDB or Postgres.
+"""
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from bson import BSON, ObjectId
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.types import Date, DateTime, Time
+
+from database.models import Base
+from database.postgresql_functools import PostgresManager
+
+
+def _accept_strings(sqlite_type):
+    # Postgres parses dates and times sent as strings, SQLite's types only take objects
+    class TextType(sqlite_type):
+        def bind_processor(self, dialect):
+            process = super().bind_processor(dialect)
+            return lambda value: value if isinstance(value, str) else process(value)
+    return TextType
+
+
+class InMemoryDatalake:
+    """ MongoDBManager stand-in keeping BSON-encoded documents in memory """
+    def __init__(self):
+        self.collections: Dict[str, List[bytes]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def insert_document(self, collection_name, document):
+        document.setdefault('_id', ObjectId())
+        encoded = BSON.encode(document)
+        with self._lock:
+            self.collections[collection_name].append(encoded)
+        return document['_id']
+
+    def insert_documents(self, collection_name, documents, batch_size=1000):
+        encoded = []
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+            encoded.append(BSON.encode(document))
+        with self._lock:
+            self.collections[collection_name].extend(encoded)
+        return len(encoded)
+
+    def iter_documents(self, collection_name, query, projection=None, sort=None, limit=0,
+                       batch_size=1000):
+        with self._lock:
+            documents = list(self.collections[collection_name])
+        documents = (BSON(document).decode() for document in documents)
+        documents = [document for document in documents
+                     if all(document.get(key) == value for key, value in query.items())]
+        for key, direction in reversed(sort or []):
+            documents.sort(key=lambda document: document.get(key), reverse=direction < 0)
+        for document in documents[:limit or None]:
+            if projection:
+                # Top-level inclusion projections only, _id unless excluded
+                fields = {key for key, value in projection.items() if value}
+                document = {key: value for key, value in document.items()
+                            if key in fields or (key == '_id' and projection.get('_id', 1))}
+            yield document
+
+    def find_documents(self, collection_name, query, projection=None, sort=None, limit=0):
+        return list(self.iter_documents(collection_name, query, projection, sort, limit))
+
+    def find_document(self, collection_name, query):
+        documents = self.find_documents(collection_name, query)
+        return documents[0] if documents else None
+
+    def count(self) -> int:
+        with self._lock:
+            return sum(len(documents) for documents in self.collections.values())
+
+
+class SQLiteWarehouse(PostgresManager):
+    """
+    PostgresManager stand-in writing to a SQLite file, which records
+    when each row is committed to measure the end-to-end latency.
+    """
+    def __init__(self, path):
+        """
+        :param path: The SQLite database file.
+        """
+        engine = create_engine(f"sqlite:///{path}", connect_args={'timeout': 60})
+        engine.dialect.colspecs = {**engine.dialect.colspecs,
+                                   DateTime: _accept_strings(sqlite.DATETIME),
+                                   Date: _accept_strings(sqlite.DATE),
+                                   Time: _accept_strings(sqlite.TIME)}
+
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(connection, _):
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+
+        Base.metadata.create_all(engine)
+
+        super().__init__(engine=engine)
+        # (city ids of the rows committed, wall-clock time of the commit)
+        self.commits: List[Tuple[List[int], float]] = []
+        self._lock = threading.Lock()
+
+    def record_commit(self, city_ids: List[int]):
+        committed_at = time.time()
+        with self._lock:
+            self.commits.append((city_ids, committed_at))
+
+    def add_record(self, record):
+        super().add_record(record)
+        self.record_commit([record.city_id])
+
+    def add_records(self, model, rows, batch_size=1000, skip_existing=False):
+        rows = list(rows)
+        inserted = super().add_records(model, rows, batch_size, skip_existing)
+        self.record_commit([row['city_id'] for row in rows if 'city_id' in row])
+        return inserted
+
+    def copy_frame(self, model, frame, batch_size=1000):
+        # SQLite has no COPY, the rows are inserted instead
+        return self.add_frame(model, frame, batch_size)
+
+    def refresh_australian_meteorology_weather(self, partitions=None):
+        # The refresh relies on Postgres SQL (LATERAL joins, DISTINCT ON), SQLite lacks it
+        return 0
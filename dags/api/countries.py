@@ -1,9 +1,11 @@
 import requests
 
+from utils.http_functools import get_http_client
+
 
 def get_api_data(url):
     try:
-        response = requests.get(url)
+        response = get_http_client().get(url)
         # Vérifiez si la requête a réussi (code de statut 200)
         if response.status_code == 200:
             # Convertissez la réponse JSON en un dictionnaire Python
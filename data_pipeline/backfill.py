@@ -0,0 +1,130 @@
+"""
+This module contains a partitioned, resumable runner for historical backfills.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from data_pipeline.pipeline_manager import DataPipeline
+from utils.ELTL import OpenWeatherAPI, OpenWeatherByCities
+
+# A backfill job: a name identifying the endpoint, and a factory building
+# the OpenWeather manager for a subset of cities
+BackfillJob = Tuple[str, Callable[[List[Dict]], OpenWeatherByCities]]
+
+
+class BackfillRunner:
+    """ Runs historical OpenWeather extractions over a date range on a worker pool """
+    checkpoint_collection = 'backfill_checkpoint'
+
+    def __init__(self, dates: Sequence[datetime], jobs: Callable[[datetime], List[BackfillJob]],
+                 cities: Optional[List[Dict]] = None, partition_size: int = 30,
+                 max_workers: int = 4, batch_size: int = 1000):
+        """
+        :param dates: The dates to backfill.
+        :param jobs: A callable returning the jobs to run for a given date.
+        :param cities: The cities to request. Defaults to every city stored in the datalake.
+        :param partition_size: The number of consecutive dates processed by a worker at a time.
+        :param max_workers: The number of partitions processed at the same time.
+        :param batch_size: The batch size used to load the data warehouse.
+        """
+        self.dates = list(dates)
+        self.jobs = jobs
+        self.datalake_manager = OpenWeatherAPI.datalake_manager
+        self.cities = cities if cities is not None else \
+            self.datalake_manager.find_documents('city', {},
+                                                 projection={'_id': 0, 'lat': 1, 'lon': 1})
+        self.partition_size = partition_size
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.done: Set[str] = set()
+
+    @staticmethod
+    def checkpoint_id(job_name: str, date: str, city: Dict) -> str:
+        """
+        Builds the key of a (date, city, endpoint) checkpoint.
+
+        :param job_name: The name of the job.
+        :param date: The date, formatted as YYYY-MM-DD.
+        :param city: The city document.
+        :return: The checkpoint key.
+        """
+        return f"{job_name}|{date}|{city['lat']},{city['lon']}"
+
+    def partitions(self) -> List[List[datetime]]:
+        """
+        Splits the dates into partitions of consecutive dates.
+
+        :return: The list of partitions.
+        """
+        return [self.dates[i:i + self.partition_size]
+                for i in range(0, len(self.dates), self.partition_size)]
+
+    def record_checkpoints(self, job_name: str, date: str, cities: Iterable[Dict]):
+        """
+        Marks the job as completed for the given date and cities.
+
+        :param job_name: The name of the job.
+        :param date: The date, formatted as YYYY-MM-DD.
+        :param cities: The city documents loaded.
+        """
+        loaded_at = datetime.utcnow()
+        checkpoints = [{'_id': self.checkpoint_id(job_name, date, city), 'job': job_name,
+                        'date': date, 'lat': city['lat'], 'lon': city['lon'],
+                        'loaded_at': loaded_at}
+                       for city in cities]
+        self.datalake_manager.insert_documents(self.checkpoint_collection, checkpoints)
+        self.done.update(checkpoint['_id'] for checkpoint in checkpoints)
+
+    def run_partition(self, dates: List[datetime]) -> int:
+        """
+        Runs every job of every date of a partition, skipping the
+        cities whose checkpoint already exists. The checkpoints are written
+        once the run succeeds: if it fails after loading some rows, the
+        next run loads them again and the data warehouse skips them.
+
+        :param dates: The dates of the partition.
+        :return: The number of (date, city, endpoint) combinations loaded.
+        """
+        loaded = 0
+        for date in dates:
+            date_str = date.strftime('%Y-%m-%d')
+            for job_name, factory in self.jobs(date):
+                missing = [city for city in self.cities
+                           if self.checkpoint_id(job_name, date_str, city) not in self.done]
+                if not missing:
+                    continue
+                DataPipeline(factory(missing), batch_size=self.batch_size).run()
+                self.record_checkpoints(job_name, date_str, missing)
+                loaded += len(missing)
+        return loaded
+
+    def run(self) -> int:
+        """
+        Runs the backfill, resuming from the existing checkpoints.
+
+        :return: The number of (date, city, endpoint) combinations loaded.
+        :raises RuntimeError: If any partition failed, once the others are done.
+        """
+        self.done = {checkpoint['_id'] for checkpoint in
+                     self.datalake_manager.iter_documents(self.checkpoint_collection, {},
+                                                          projection={'_id': 1})}
+
+        loaded, failures = 0, []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.run_partition, partition): partition
+                       for partition in self.partitions()}
+            for future in as_completed(futures):
+                partition = futures[future]
+                try:
+                    loaded += future.result()
+                except Exception as e:
+                    print(f"Backfill of {partition[0]:%Y-%m-%d} to "
+                          f"{partition[-1]:%Y-%m-%d} failed: {e}")
+                    failures.append(partition)
+
+        print(f"Backfill loaded {loaded} (date, city, endpoint) combinations")
+        if failures:
+            raise RuntimeError(f"{len(failures)} backfill partitions failed, "
+                               f"run the backfill again to resume them")
+        return loaded
@@ -1,6 +1,44 @@
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from utils.metrics_functools import metrics
+
+# Marks the end of a stream between two stages
+_END = object()
+
+STAGES = ('extract', 'datalake_load', 'transform', 'warehouse_load', 'warehouse_refresh')
+
+
 class DataPipeline:
-    def __init__(self, openweather_manager):
+    def __init__(self, openweather_manager, batch_size=None, streaming=False,
+                 transform_workers=2, load_workers=2, queue_size=64, columnar=False):
+        """
+        :param openweather_manager: The OpenWeatherAPI instance to run.
+        :param batch_size: When set, transformed records are loaded to the
+            data warehouse in batches of this size instead of one by one.
+        :param streaming: Whether to run the stages concurrently, passing
+            the records through bounded queues instead of extracting everything first.
+        :param transform_workers: The number of threads loading the datalake
+            and transforming the records, in streaming mode.
+        :param load_workers: The number of threads loading the data warehouse,
+            in streaming mode.
+        :param queue_size: The maximum number of items waiting between two
+            stages, in streaming mode.
+        :param columnar: Whether to transform the records into DataFrames
+            with transform_data_frame, in batch and streaming modes.
+        """
         self.manager = openweather_manager
+        self.batch_size = batch_size
+        self.streaming = streaming
+        self.transform_workers = transform_workers
+        self.load_workers = load_workers
+        self.queue_size = queue_size
+        self.columnar = columnar
 
     def load_to_data_warehouse(self, data):
         if isinstance(data, list):
@@ -9,16 +47,275 @@ class DataPipeline:
         else:
             self.manager.load_to_data_warehouse(data)
 
+    def timed(self, stage, function, *args, records=None):
+        """
+        Runs a stage, recording its duration, record count and failures.
+
+        :param stage: The name of the stage.
+        :param function: The function running the stage.
+        :param records: The number of records processed. Defaults to the
+            length of the result, the result itself if it is a count, or 1.
+        :return: The result of the function.
+        """
+        labels = {'pipeline': type(self.manager).__name__, 'stage': stage}
+        try:
+            with metrics.timer('pipeline_stage_seconds', **labels):
+                result = function(*args)
+        except Exception:
+            metrics.increment('pipeline_stage_failures_total', **labels)
+            raise
+        if records is None:
+            if isinstance(result, (list, pd.DataFrame)):
+                records = len(result)
+            elif isinstance(result, int) and not isinstance(result, bool):
+                records = result
+            else:
+                records = 1
+        metrics.increment('pipeline_stage_records_total', records, **labels)
+        return result
+
+    def timed_iter(self, stage, iterator):
+        """
+        Iterates over a stage producing records one at a time, recording
+        the time spent waiting for each of them.
+
+        :param stage: The name of the stage.
+        :param iterator: The iterator running the stage.
+        :return: An iterator over the same records.
+        """
+        labels = {'pipeline': type(self.manager).__name__, 'stage': stage}
+        iterator = iter(iterator)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                # The end of the stream is neither a record nor a failure
+                return
+            except Exception:
+                metrics.observe('pipeline_stage_seconds', time.perf_counter() - start, **labels)
+                metrics.increment('pipeline_stage_failures_total', **labels)
+                raise
+            metrics.observe('pipeline_stage_seconds', time.perf_counter() - start, **labels)
+            metrics.increment('pipeline_stage_records_total', **labels)
+            yield item
+
+    def export_metrics(self, elapsed, since):
+        """
+        Prints a summary of the stages of the run to the task logs and
+        writes the metrics to the file set by PIPELINE_METRICS_FILE. A
+        '.prom' file gets the Prometheus text format, any other file JSON lines.
+
+        :param elapsed: The duration of the run in seconds.
+        :param since: The snapshot of the metrics taken when the run started,
+            as the registry also holds the previous runs of the process.
+        """
+        name = type(self.manager).__name__
+        metrics.observe('pipeline_run_seconds', elapsed, pipeline=name)
+        cache = getattr(self.manager, 'response_cache', None)
+        if cache is not None:
+            for key, value in cache.stats().items():
+                metrics.set_gauge(f'response_cache_{key}', value)
+
+        print(f"{name} run in {elapsed:.2f}s")
+        for stage in STAGES:
+            labels = {'pipeline': name, 'stage': stage}
+            histogram = metrics.histogram('pipeline_stage_seconds', **labels)
+            if histogram is None:
+                continue
+            histogram = histogram.since(since.histogram('pipeline_stage_seconds', **labels))
+            if not histogram.count:
+                continue
+            records = metrics.counter('pipeline_stage_records_total', **labels) - \
+                since.counter('pipeline_stage_records_total', **labels)
+            failures = metrics.counter('pipeline_stage_failures_total', **labels) - \
+                since.counter('pipeline_stage_failures_total', **labels)
+            print(f"  {stage}: {records:.0f} records, {histogram.sum:.2f}s, "
+                  f"p50 <= {histogram.quantile(0.5)}s, p99 <= {histogram.quantile(0.99)}s, "
+                  f"{failures:.0f} failures")
+
+        default_path = Path(__file__).parents[1] / 'metrics' / 'pipeline_metrics.prom'
+        path = os.getenv('PIPELINE_METRICS_FILE', str(default_path))
+        if path:
+            try:
+                metrics.export(path)
+            except Exception as e:
+                # The data is already loaded, the run must not fail on its metrics
+                print(f"Could not write the metrics to {path}: {e}")
+
+    def transform(self, data_dict):
+        """
+        Transforms a raw record into a chunk of rows to be loaded in batch.
+
+        :param data_dict: The raw record.
+        :return: A DataFrame in columnar mode, a list of dictionaries otherwise.
+        """
+        if self.columnar:
+            return self.manager.transform_data_frame(data_dict)
+        data_transform = self.manager.transform_data(data_dict)
+        return data_transform if isinstance(data_transform, list) else [data_transform]
+
+    @staticmethod
+    def concat(chunks):
+        """
+        Concatenates the chunks of rows returned by transform.
+
+        :param chunks: The chunks to concatenate.
+        :return: A single DataFrame or list of dictionaries.
+        """
+        if isinstance(chunks[0], pd.DataFrame):
+            return pd.concat(chunks, ignore_index=True)
+        return [row for chunk in chunks for row in chunk]
+
     def run(self):
+        start = time.perf_counter()
+        since = metrics.snapshot()
+        try:
+            try:
+                if self.streaming:
+                    self.run_streaming()
+                elif self.batch_size:
+                    self.run_batched()
+                else:
+                    self.run_by_record()
+            finally:
+                self.timed('datalake_load', self.manager.flush_datalake, records=0)
+            self.timed('warehouse_refresh', self.manager.refresh_data_warehouse)
+            self.manager.commit_watermarks()
+        finally:
+            self.export_metrics(time.perf_counter() - start, since)
+
+    def run_by_record(self):
         # Extract
-        data = self.manager.extract_data()
+        data = self.timed('extract', self.manager.extract_data)
 
         for data_dict in data:
             # Load
-            self.manager.load_to_datalake(data_dict)
+            self.timed('datalake_load', self.manager.load_to_datalake, data_dict)
 
             # Transform
-            data_transform = self.manager.transform_data(data_dict)
+            data_transform = self.timed('transform', self.manager.transform_data, data_dict)
 
             # Load
-            self.load_to_data_warehouse(data_transform)
+            self.timed('warehouse_load', self.load_to_data_warehouse, data_transform,
+                       records=len(data_transform) if isinstance(data_transform, list) else 1)
+
+    def load_batch(self, chunks, batch_size):
+        """
+        Loads the pending chunks of rows to the data warehouse at once.
+
+        :param chunks: The chunks of rows returned by transform.
+        :param batch_size: The number of rows inserted per transaction.
+        """
+        batch = self.concat(chunks)
+        self.timed('warehouse_load', self.manager.load_many_to_data_warehouse, batch,
+                   batch_size, records=len(batch))
+
+    def run_batched(self):
+        # Extract
+        data = self.timed('extract', self.manager.extract_data)
+
+        pending, pending_size = [], 0
+        for data_dict in data:
+            # Load
+            self.timed('datalake_load', self.manager.load_to_datalake, data_dict)
+
+            # Transform
+            data_transform = self.timed('transform', self.transform, data_dict)
+            pending.append(data_transform)
+            pending_size += len(data_transform)
+
+            # Load
+            if pending_size >= self.batch_size:
+                self.load_batch(pending, self.batch_size)
+                pending, pending_size = [], 0
+
+        if pending:
+            self.load_batch(pending, self.batch_size)
+
+    def run_streaming(self):
+        """
+        Runs extract, datalake load + transform and warehouse load as
+        concurrent stages connected by bounded queues, so that memory
+        stays flat and network, CPU and database work overlap.
+        The warehouse is always loaded in batches in this mode.
+        """
+        batch_size = self.batch_size or 1000
+        raw_queue = queue.Queue(maxsize=self.queue_size)
+        transformed_queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        errors = []
+
+        def put(items, item):
+            # Give up waiting for room if another stage failed
+            while not stop.is_set():
+                try:
+                    items.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def get(items):
+            while not stop.is_set():
+                try:
+                    return items.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _END
+
+        def stage(target):
+            def run_stage():
+                try:
+                    target()
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+            return threading.Thread(target=run_stage, daemon=True)
+
+        def extract():
+            for data_dict in self.timed_iter('extract', self.manager.iter_extract_data()):
+                if stop.is_set():
+                    return
+                put(raw_queue, data_dict)
+
+        def transform():
+            while True:
+                data_dict = get(raw_queue)
+                if data_dict is _END:
+                    return
+                self.timed('datalake_load', self.manager.load_to_datalake, data_dict)
+                put(transformed_queue, self.timed('transform', self.transform, data_dict))
+
+        def load():
+            pending, pending_size = [], 0
+            while True:
+                data_transform = get(transformed_queue)
+                if data_transform is _END:
+                    break
+                pending.append(data_transform)
+                pending_size += len(data_transform)
+                if pending_size >= batch_size:
+                    self.load_batch(pending, batch_size)
+                    pending, pending_size = [], 0
+            if pending and not stop.is_set():
+                self.load_batch(pending, batch_size)
+
+        extractor = stage(extract)
+        transformers = [stage(transform) for _ in range(self.transform_workers)]
+        loaders = [stage(load) for _ in range(self.load_workers)]
+        for thread in [extractor, *transformers, *loaders]:
+            thread.start()
+
+        # Close each stage once the one before it is done
+        extractor.join()
+        for _ in transformers:
+            put(raw_queue, _END)
+        for thread in transformers:
+            thread.join()
+        for _ in loaders:
+            put(transformed_queue, _END)
+        for thread in loaders:
+            thread.join()
+
+        if errors:
+            raise errors[0]
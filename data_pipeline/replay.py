@@ -0,0 +1,238 @@
+"""
+This module rebuilds the data warehouse from the raw payloads of the
+MongoDB datalake, without calling OpenWeather. Documents are transformed by
+the same OpenWeather managers as the pipelines, and the collections are
+split into insertion time ranges replayed by separate processes.
+
+Usage:
+    python -m data_pipeline.replay --collections weather daily_weather --workers 8
+"""
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import pandas as pd
+from bson import ObjectId
+from dotenv import load_dotenv
+
+from database.postgresql_loader import copy_dataframe
+from preparation.data_from_Laurent import DUMPS
+from utils.ELTL import OpenWeatherAPI, OpenWeatherCity, OpenWeatherCurrentWeather, \
+    OpenWeatherDailyAirPollution, OpenWeatherDailyWeather, OpenWeatherTimestampWeather
+from utils.metrics_functools import metrics
+
+# Collections replayed by default. The city collection is only replayed on
+# request, as it would give the cities new ids.
+REPLAY_COLLECTIONS = ['weather', 'daily_weather', 'air_pollution']
+
+
+class LaurentTimestampWeather(OpenWeatherTimestampWeather):
+    """
+    Transforms the timemachine documents with the row function of
+    data_from_Laurent, which loaded most of them. Its dates are shifted by a
+    fixed offset instead of the offset of the payload, so the transform of
+    the pipeline would give the rows already loaded a different date.
+    """
+    def transform_data(self, data: Dict) -> Dict:
+        return DUMPS['timestamp_weather'].to_row(data, self.get_city_id(data['lat'],
+                                                                        data['lon']))
+
+
+class ReplayPartition(NamedTuple):
+    """ Documents of a collection inserted in [start, end), all of them without bounds """
+    collection: str
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+
+def build_manager(collection: str, document: Dict) -> OpenWeatherAPI:
+    """
+    Builds the OpenWeather manager able to transform a raw document,
+    recognized from the collection and shape of the payload.
+
+    :param collection: The collection of the document.
+    :param document: The raw document.
+    :return: The OpenWeather manager, requesting no city.
+    :raises ValueError: If the document does not match any manager.
+    """
+    key = manager_key(collection, document)
+    if key == 'city':
+        return OpenWeatherCity()
+    if key == 'weather/current':
+        return OpenWeatherCurrentWeather(cities=[])
+    if key == 'weather/timestamp':
+        return LaurentTimestampWeather(document['data'][0]['dt'], cities=[])
+    if key == 'daily_weather':
+        return OpenWeatherDailyWeather(document['date'], cities=[])
+    if key == 'air_pollution':
+        # Current and history payloads share a shape, with one or more hours in 'list'
+        return OpenWeatherDailyAirPollution(0, 0, cities=[])
+    raise ValueError(f"No transform for the {collection} document {document.get('_id')}")
+
+
+def manager_key(collection: str, document: Dict) -> Optional[str]:
+    """
+    :return: The name of the manager build_manager returns for a document,
+        so that documents of the same shape share a manager, or None if
+        the document does not match any manager.
+    """
+    if collection == 'city':
+        return 'city'
+    if collection == 'weather' and 'coord' in document:
+        return 'weather/current'
+    if collection == 'weather' and 'data' in document:
+        return 'weather/timestamp'
+    # data_from_Laurent used to store the day summaries in the weather collection
+    if collection in ('weather', 'daily_weather') and 'temperature' in document:
+        return 'daily_weather'
+    if collection == 'air_pollution' and 'list' in document:
+        return 'air_pollution'
+    return None
+
+
+def replay_partition(partition: ReplayPartition, batch_size: int = 5000) -> int:
+    """
+    Transforms the documents of a partition and copies them to the data
+    warehouse in batches, skipping the rows already there, e.g. payloads
+    requested twice. Documents matching no manager are skipped and counted.
+    Runs in a worker process.
+
+    :param partition: The documents to replay.
+    :param batch_size: The number of rows inserted per transaction.
+    :return: The number of rows loaded.
+    """
+    query = {}
+    if partition.start is not None:
+        query = {'_id': {'$gte': ObjectId.from_datetime(partition.start),
+                         '$lt': ObjectId.from_datetime(partition.end)}}
+    managers: Dict[str, OpenWeatherAPI] = {}
+    pending: Dict[str, List[Dict]] = {}
+    loaded, skipped = 0, 0
+
+    def load(key):
+        nonlocal loaded
+        rows, pending[key] = pending[key], []
+        if not rows:
+            return
+        table = managers[key].table_name.__tablename__
+        loaded += copy_dataframe(OpenWeatherAPI.data_warehouse_manager.engine,
+                                 pd.DataFrame(rows), table, chunk_size=batch_size, staging=True)
+
+    documents = OpenWeatherAPI.datalake_manager.iter_documents(partition.collection, query,
+                                                               batch_size=batch_size)
+    for document in documents:
+        key = manager_key(partition.collection, document)
+        if key is None:
+            skipped += 1
+            metrics.increment('replay_documents_skipped_total', collection=partition.collection)
+            continue
+        if key not in managers:
+            managers[key] = build_manager(partition.collection, document)
+            pending[key] = []
+        rows = managers[key].transform_data(document)
+        pending[key].extend(rows if isinstance(rows, list) else [rows])
+        if len(pending[key]) >= batch_size:
+            load(key)
+    for key in managers:
+        load(key)
+    if skipped:
+        print(f"{skipped} {partition.collection} documents from {partition.start} "
+              f"to {partition.end} matched no transform and were skipped")
+    return loaded
+
+
+def insertion_range(collection: str) -> Optional[Sequence[datetime]]:
+    """
+    :return: The insertion times of the first and last documents of a
+        collection, read from their ObjectId, or None if it is empty.
+    """
+    datalake = OpenWeatherAPI.datalake_manager
+    bounds = []
+    for direction in (1, -1):
+        documents = datalake.find_documents(collection, {}, projection={'_id': 1},
+                                            sort=[('_id', direction)], limit=1)
+        if not documents:
+            return None
+        bounds.append(documents[0]['_id'].generation_time.replace(tzinfo=None))
+    return bounds
+
+
+def partitions(collections: Sequence[str], count: int) -> List[ReplayPartition]:
+    """
+    Splits each collection into time ranges of insertion.
+
+    :param collections: The collections to replay.
+    :param count: The number of time ranges per collection.
+    :return: The partitions, covering every document once.
+    """
+    result = []
+    for collection in collections:
+        bounds = insertion_range(collection)
+        if bounds is None:
+            continue
+        # ObjectIds have a precision of one second
+        start, end = bounds[0], bounds[1] + timedelta(seconds=1)
+        step = (end - start) / count
+        edges = [start + step * i for i in range(count)] + [end]
+        result.extend(ReplayPartition(collection, edges[i], edges[i + 1])
+                      for i in range(count) if edges[i] < edges[i + 1])
+    return result
+
+
+def replay(collections: Sequence[str] = REPLAY_COLLECTIONS, workers: int = 4,
+           partitions_per_worker: int = 4, batch_size: int = 5000) -> Dict[str, int]:
+    """
+    Rebuilds the data warehouse tables of the given collections from the
+    datalake. Rows already loaded are skipped, so an interrupted replay can
+    be run again. The city table has no such guard and must be empty.
+
+    :param collections: The collections to replay.
+    :param workers: The number of worker processes.
+    :param partitions_per_worker: The number of time ranges per collection
+        and worker, so that the workers stay busy until the end.
+    :param batch_size: The number of rows inserted per transaction.
+    :return: The number of rows loaded per collection.
+    :raises RuntimeError: If any partition failed, once the others are done.
+    """
+    loaded = {collection: 0 for collection in collections}
+    if 'city' in collections:
+        # The other collections are matched to the cities, load them first
+        loaded['city'] = replay_partition(ReplayPartition('city'), batch_size)
+        collections = [collection for collection in collections if collection != 'city']
+
+    failures = []
+    # Fresh interpreters, so that no database connection is shared with the workers
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {executor.submit(replay_partition, partition, batch_size): partition
+                   for partition in partitions(collections, workers * partitions_per_worker)}
+        for future in as_completed(futures):
+            partition = futures[future]
+            try:
+                loaded[partition.collection] += future.result()
+            except Exception as e:
+                print(f"Replay of {partition.collection} from {partition.start} "
+                      f"to {partition.end} failed: {e}")
+                failures.append(partition)
+
+    if {'weather', 'daily_weather'} & set(collections):
+        OpenWeatherAPI.data_warehouse_manager.refresh_australian_meteorology_weather()
+    for collection, rows in loaded.items():
+        print(f"{rows} rows replayed from {collection}")
+    if failures:
+        raise RuntimeError(f"{len(failures)} replay partitions failed")
+    return loaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuilds the data warehouse from the datalake")
+    parser.add_argument('--collections', nargs='+', default=REPLAY_COLLECTIONS,
+                        choices=REPLAY_COLLECTIONS + ['city'])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    load_dotenv()
+    replay(args.collections, workers=args.workers, batch_size=args.batch_size)
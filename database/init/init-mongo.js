@@ -9,4 +9,16 @@ db = db.getSiblingDB(process.env.MONGO_INITDB_DATABASE);
 db.createCollection("city");
 db.createCollection("weather");
 db.createCollection("daily_weather");
-db.createCollection("air_pollution");
\ No newline at end of file
+db.createCollection("air_pollution");
+
+// Indexes of the fields the pipelines query, kept in line with
+// DATALAKE_INDEXES in database/mongodb_functools.py
+db.city.createIndex({ lat: 1, lon: 1 }, { name: "lat_lon" });
+db.city.createIndex({ name: 1 }, { name: "name" });
+db.weather.createIndex({ "coord.lat": 1, "coord.lon": 1, dt: 1 }, { name: "coord_dt" });
+db.weather.createIndex({ lat: 1, lon: 1, "data.dt": 1 }, { name: "lat_lon_data_dt" });
+db.weather.createIndex({ dt: 1 }, { name: "dt" });
+db.daily_weather.createIndex({ lat: 1, lon: 1, date: 1 }, { name: "lat_lon_date" });
+db.daily_weather.createIndex({ date: 1 }, { name: "date" });
+db.air_pollution.createIndex({ "coord.lat": 1, "coord.lon": 1, "list.dt": 1 }, { name: "coord_list_dt" });
+db.air_pollution.createIndex({ "list.dt": 1 }, { name: "list_dt" });
@@ -79,57 +79,57 @@ psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$DB_NAME" <<-EOSQL
         city_id INTEGER NOT NULL,
         FOREIGN KEY (city_id) REFERENCES city(id)
     );
+
+    -- One row per city and date, so that bulk loads can skip duplicates
+    CREATE UNIQUE INDEX IF NOT EXISTS weather_city_id_date_key ON weather (city_id, date);
+    CREATE UNIQUE INDEX IF NOT EXISTS daily_weather_city_id_date_key ON daily_weather (city_id, date);
+    CREATE UNIQUE INDEX IF NOT EXISTS air_pollution_city_id_date_key ON air_pollution (city_id, date);
+
+    CREATE TABLE IF NOT EXISTS extraction_watermark (
+        city_id INTEGER NOT NULL,
+        endpoint VARCHAR(255) NOT NULL,
+        loaded_until TIMESTAMP NOT NULL,
+        PRIMARY KEY (city_id, endpoint),
+        FOREIGN KEY (city_id) REFERENCES city(id)
+    );
 EOSQL
 
-# Vérifier si la vue existe, et la créer si ce n'est pas le cas
+# Remplacer l'ancienne vue par une table matérialisée, mise à jour par
+# PostgresManager.refresh_australian_meteorology_weather après chaque chargement
 psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$DB_NAME" <<-EOSQL
-DO \$\$
-BEGIN
-   IF NOT EXISTS (SELECT 1 FROM pg_views WHERE viewname = 'australian_meteorology_weather') THEN
-      CREATE VIEW australian_meteorology_weather AS
-        SELECT
-            dw.id,
-            EXTRACT(YEAR FROM dw.date) || '-' || EXTRACT(MONTH FROM dw.date) || '-' || EXTRACT(DAY FROM dw.date) AS date,
-            c.name AS location,
-            dw.min_temp,
-            dw.max_temp,
-            dw.rainfall,
-            dw.evaporation,
-            dw.sunshine,
-            dw.wind_gust_dir,
-            dw.wind_gust_speed,
-            w9.temp AS temp_9am,
-            w9.humidity AS humidity_9am,
-            w9.cloud AS cloud_9am,
-            w9.wind_dir AS wind_dir_9am,
-            w9.wind_speed AS wind_speed_9am,
-            w9.pressure AS pressure_9am,
-            w3.temp AS temp_3pm,
-            w3.humidity AS humidity_3pm,
-            w3.cloud AS cloud_3pm,
-            w3.wind_dir AS wind_dir_3pm,
-            w3.wind_speed AS wind_speed_3pm,
-            w3.pressure AS pressure_3pm
-        FROM
-            daily_weather dw
-        JOIN
-            city c ON dw.city_id = c.id
-        LEFT JOIN
-            weather w9 ON dw.city_id = w9.city_id
-                              AND EXTRACT(HOUR FROM w9.date) = 9
-                              AND EXTRACT(YEAR FROM dw.date) = EXTRACT(YEAR FROM w9.date)
-                              AND EXTRACT(MONTH FROM dw.date) = EXTRACT(MONTH FROM w9.date)
-                              AND EXTRACT(DAY FROM dw.date) = EXTRACT(DAY FROM w9.date)
-        LEFT JOIN
-            weather w3 ON dw.city_id = w3.city_id
-                              AND EXTRACT(HOUR FROM w3.date) = 15
-                              AND EXTRACT(YEAR FROM dw.date) = EXTRACT(YEAR FROM w3.date)
-                              AND EXTRACT(MONTH FROM dw.date) = EXTRACT(MONTH FROM w3.date)
-                              AND EXTRACT(DAY FROM dw.date) = EXTRACT(DAY FROM w3.date)
-        ORDER BY
-            location, date;
-   END IF;
-END \$\$;
+    DROP VIEW IF EXISTS australian_meteorology_weather;
+
+    CREATE TABLE IF NOT EXISTS australian_meteorology_weather (
+        id INTEGER PRIMARY KEY,
+        date DATE NOT NULL,
+        city_id INTEGER NOT NULL,
+        location VARCHAR(255) NOT NULL,
+        min_temp FLOAT,
+        max_temp FLOAT,
+        rainfall FLOAT,
+        evaporation FLOAT,
+        sunshine FLOAT,
+        wind_gust_dir VARCHAR(255),
+        wind_gust_speed FLOAT,
+        temp_9am FLOAT,
+        humidity_9am FLOAT,
+        cloud_9am FLOAT,
+        wind_dir_9am VARCHAR(255),
+        wind_speed_9am FLOAT,
+        pressure_9am FLOAT,
+        temp_3pm FLOAT,
+        humidity_3pm FLOAT,
+        cloud_3pm FLOAT,
+        wind_dir_3pm VARCHAR(255),
+        wind_speed_3pm FLOAT,
+        pressure_3pm FLOAT,
+        FOREIGN KEY (city_id) REFERENCES city(id)
+    );
+
+    CREATE UNIQUE INDEX IF NOT EXISTS australian_meteorology_weather_city_id_date_key
+        ON australian_meteorology_weather (city_id, date);
+    CREATE INDEX IF NOT EXISTS australian_meteorology_weather_location_date_idx
+        ON australian_meteorology_weather (location, date);
 EOSQL
 
-echo "Tables and view created successfully."
\ No newline at end of file
+echo "Tables created successfully."
@@ -1,7 +1,7 @@
 import os
 
 from sqlalchemy import (create_engine, ForeignKey, Column, Integer, String,
-                        Float, Date, Time, DateTime, func)
+                        Float, Date, Time, DateTime, func, Index, UniqueConstraint)
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 Base = declarative_base()
@@ -12,9 +12,11 @@ load_dotenv()
 class Weather(Base):
     """ Weather table """
     __tablename__ = 'weather'
+    # One row per city and date, so that bulk loads can skip duplicates
+    __table_args__ = (UniqueConstraint('city_id', 'date', name='weather_city_id_date_key'),)
 
     id = Column(Integer, primary_key=True)
-    date = Column(DateTime, nullable=False, unique=True)
+    date = Column(DateTime, nullable=False)
     temp = Column(Float)
     sunrise = Column(Time)
     sunset = Column(Time)
@@ -42,9 +44,11 @@ class Weather(Base):
 class DailyWeather(Base):
     """ Daily Weather table """
     __tablename__ = 'daily_weather'
+    # One row per city and date, so that bulk loads can skip duplicates
+    __table_args__ = (UniqueConstraint('city_id', 'date', name='daily_weather_city_id_date_key'),)
 
     id = Column(Integer, primary_key=True)
-    date = Column(Date, nullable=False, unique=True)
+    date = Column(Date, nullable=False)
     min_temp = Column(Float)
     max_temp = Column(Float)
     rainfall = Column(Float)
@@ -67,9 +71,11 @@ class DailyWeather(Base):
 class AirPollution(Base):
     """ Air Pollution table"""
     __tablename__ = 'air_pollution'
+    # One row per city and date, so that bulk loads can skip duplicates
+    __table_args__ = (UniqueConstraint('city_id', 'date', name='air_pollution_city_id_date_key'),)
 
     id = Column(Integer, primary_key=True)
-    date = Column(DateTime, nullable=False, unique=True)
+    date = Column(DateTime, nullable=False)
     air_quality_index = Column(Integer)
     co_concentration = Column(Float)
     no_concentration = Column(Float)
@@ -96,11 +102,19 @@ class AirPollution(Base):
 
 
 class AustralianMeteorologyWeather(Base):
-    """ Australian Meteorology Weather view """
+    """
+    Australian Meteorology Weather table, materialized from daily_weather and
+    weather by PostgresManager.refresh_australian_meteorology_weather
+    """
     __tablename__ = 'australian_meteorology_weather'
+    __table_args__ = (UniqueConstraint('city_id', 'date',
+                                       name='australian_meteorology_weather_city_id_date_key'),
+                      Index('australian_meteorology_weather_location_date_idx',
+                            'location', 'date'))
 
     id = Column(Integer, primary_key=True)
     date = Column(Date, nullable=False)
+    city_id = Column(Integer, ForeignKey('city.id'), nullable=False)
     location = Column(String, nullable=False)
     min_temp = Column(Float)
     max_temp = Column(Float)
@@ -161,3 +175,17 @@ class City(Base):
                 f"Country={self.country},"
                 f"Latitude={self.latitude},"
                 f"Longitude={self.longitude})>")
+
+
+class ExtractionWatermark(Base):
+    """ Latest data loaded per city and OpenWeather endpoint """
+    __tablename__ = 'extraction_watermark'
+
+    city_id = Column(Integer, ForeignKey('city.id'), primary_key=True)
+    endpoint = Column(String, primary_key=True)
+    loaded_until = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return (f"<ExtractionWatermark(City_id={self.city_id},"
+                f"Endpoint={self.endpoint},"
+                f"LoadedUntil={self.loaded_until})>")
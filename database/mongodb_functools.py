@@ -2,7 +2,33 @@
 
 
 import os
-from pymongo import MongoClient
+import threading
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pymongo import ASCENDING, IndexModel, MongoClient
+from pymongo.errors import BulkWriteError
+
+from utils.metrics_functools import metrics
+
+# Indexes of the fields the pipelines query, per collection. Current weather
+# and air pollution documents hold their coordinates under "coord", the
+# One Call documents at the top level.
+DATALAKE_INDEXES: Dict[str, List[IndexModel]] = {
+    'city': [IndexModel([('lat', ASCENDING), ('lon', ASCENDING)], name='lat_lon'),
+             IndexModel([('name', ASCENDING)], name='name')],
+    'weather': [IndexModel([('coord.lat', ASCENDING), ('coord.lon', ASCENDING),
+                            ('dt', ASCENDING)], name='coord_dt'),
+                IndexModel([('lat', ASCENDING), ('lon', ASCENDING),
+                            ('data.dt', ASCENDING)], name='lat_lon_data_dt'),
+                IndexModel([('dt', ASCENDING)], name='dt')],
+    'daily_weather': [IndexModel([('lat', ASCENDING), ('lon', ASCENDING),
+                                  ('date', ASCENDING)], name='lat_lon_date'),
+                      IndexModel([('date', ASCENDING)], name='date')],
+    'air_pollution': [IndexModel([('coord.lat', ASCENDING), ('coord.lon', ASCENDING),
+                                  ('list.dt', ASCENDING)], name='coord_list_dt'),
+                      IndexModel([('list.dt', ASCENDING)], name='list_dt')],
+}
 
 
 class MongoDBManager:
@@ -31,17 +57,73 @@ class MongoDBManager:
         document_id = collection.insert_one(document).inserted_id
         return document_id
 
+    def insert_documents(self, collection_name, documents, batch_size=1000):
+        """ Insert many documents into a collection, skipping duplicates """
+        collection = self.db[collection_name]
+        documents = iter(documents)
+        inserted = 0
+        while True:
+            batch = list(islice(documents, batch_size))
+            if not batch:
+                return inserted
+            try:
+                with metrics.timer('db_write_seconds', backend='mongo', table=collection_name):
+                    batch_inserted = len(collection.insert_many(batch, ordered=False).inserted_ids)
+            except BulkWriteError as e:
+                batch_inserted = e.details['nInserted']
+                errors = e.details['writeErrors']
+                duplicates = [error for error in errors if error['code'] == 11000]
+                if len(duplicates) < len(errors):
+                    raise
+                metrics.increment('db_duplicates_skipped_total', len(duplicates),
+                                  backend='mongo', table=collection_name)
+                print(f"{len(duplicates)} duplicate documents skipped in {collection_name}")
+            metrics.increment('db_rows_written_total', batch_inserted,
+                              backend='mongo', table=collection_name)
+            inserted += batch_inserted
+
     def find_document(self, collection_name, query):
         """ Find a document in a collection """
         collection = self.db[collection_name]
         document_found = collection.find_one(query)
         return document_found
 
-    def find_documents(self, collection_name, query):
+    def find_documents(self, collection_name, query, projection=None, sort=None, limit=0):
         """ Find multiple documents in a collection """
-        collection = self.db[collection_name]
-        documents_found = list(collection.find(query))
-        return documents_found
+        return list(self.iter_documents(collection_name, query, projection, sort, limit))
+
+    def iter_documents(self, collection_name, query, projection=None,
+                       sort: Optional[List[Tuple[str, int]]] = None, limit=0,
+                       batch_size=1000) -> Iterator[Dict]:
+        """
+        Iterates over the documents of a collection matching a query,
+        fetching them from the server one batch at a time.
+
+        :param collection_name: The name of the collection.
+        :param query: The filter the documents must match.
+        :param projection: The fields to return, e.g. {'_id': 0, 'lat': 1, 'lon': 1}.
+            Defaults to the whole documents.
+        :param sort: The (field, direction) pairs to sort the documents by.
+        :param limit: The maximum number of documents, 0 for no limit.
+        :param batch_size: The number of documents per round trip to the server.
+        :return: An iterator over the documents.
+        """
+        cursor = self.db[collection_name].find(query, projection, limit=limit,
+                                               batch_size=batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+        with cursor:
+            yield from cursor
+
+    def ensure_indexes(self, indexes: Optional[Dict[str, List[IndexModel]]] = None):
+        """
+        Creates the indexes of the datalake that do not exist yet.
+
+        :param indexes: The indexes per collection, DATALAKE_INDEXES by default.
+        """
+        for collection_name, models in (indexes or DATALAKE_INDEXES).items():
+            names = self.db[collection_name].create_indexes(models)
+            print(f"Indexes of {collection_name}: {', '.join(names)}")
 
     def update_document(self, collection_name, query, new_values):
         """ Update a document in a collection """
@@ -65,5 +147,24 @@ class MongoDBManager:
         return delete_result
 
 
+_manager: Optional[MongoDBManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_mongo_manager() -> MongoDBManager:
+    """
+    Returns the process-wide MongoDBManager, creating it on first use.
+    The client keeps its own pool of connections, shared by every thread.
+
+    :return: The shared MongoDBManager.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = MongoDBManager()
+        return _manager
+
+
 if __name__ == "__main__":
-    mongo_manager = MongoDBManager()
+    mongo_manager = get_mongo_manager()
+    mongo_manager.ensure_indexes()
@@ -1,11 +1,25 @@
 """ Data warehouse """
 
 import os
-from database.models import Weather, DailyWeather, AirPollution, City, AustralianMeteorologyWeather
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 
+from database.models import Weather, DailyWeather, AirPollution, City, \
+    AustralianMeteorologyWeather, ExtractionWatermark
+
+import pandas as pd
 from sqlalchemy import (create_engine, ForeignKey, Column, Integer, String,
-                        Float, Date, Time, DateTime, func)
+                        Float, Date, Time, DateTime, func, select, text)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
+
+from database.postgresql_loader import copy_dataframe
+from utils.metrics_functools import metrics
 
 Base = declarative_base()
 from dotenv import load_dotenv
@@ -14,54 +28,290 @@ from pymongo import MongoClient
 # Load environment variables from .env
 load_dotenv()
 
+# Tables the australian_meteorology_weather table is computed from
+MATERIALIZED_SOURCES = ('weather', 'daily_weather')
+
+# Rows of australian_meteorology_weather for the (city_id, date) pairs of
+# the "affected" relation. The joins compare the raw dates to ranges, so that
+# they are served by the (city_id, date) indexes of the source tables.
+_METEOROLOGY_COLUMNS = ['id', 'date', 'city_id', 'location', 'min_temp', 'max_temp',
+                        'rainfall', 'evaporation', 'sunshine', 'wind_gust_dir',
+                        'wind_gust_speed', 'temp_9am', 'humidity_9am', 'cloud_9am',
+                        'wind_dir_9am', 'wind_speed_9am', 'pressure_9am', 'temp_3pm',
+                        'humidity_3pm', 'cloud_3pm', 'wind_dir_3pm', 'wind_speed_3pm',
+                        'pressure_3pm']
+_METEOROLOGY_SELECT = """
+    SELECT DISTINCT ON (dw.city_id, a.date)
+        dw.id, a.date, dw.city_id, c.name,
+        dw.min_temp, dw.max_temp, dw.rainfall, dw.evaporation, dw.sunshine,
+        dw.wind_gust_dir, dw.wind_gust_speed,
+        w9.temp, w9.humidity, w9.cloud, w9.wind_dir, w9.wind_speed, w9.pressure,
+        w3.temp, w3.humidity, w3.cloud, w3.wind_dir, w3.wind_speed, w3.pressure
+    FROM affected a
+    JOIN daily_weather dw
+        ON dw.city_id = a.city_id AND dw.date >= a.date AND dw.date < a.date + 1
+    JOIN city c ON c.id = dw.city_id
+    LEFT JOIN LATERAL (
+        SELECT * FROM weather w
+        WHERE w.city_id = dw.city_id
+            AND w.date >= a.date + INTERVAL '9 hours' AND w.date < a.date + INTERVAL '10 hours'
+        ORDER BY w.date LIMIT 1
+    ) w9 ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT * FROM weather w
+        WHERE w.city_id = dw.city_id
+            AND w.date >= a.date + INTERVAL '15 hours' AND w.date < a.date + INTERVAL '16 hours'
+        ORDER BY w.date LIMIT 1
+    ) w3 ON TRUE
+    ORDER BY dw.city_id, a.date, dw.date
+"""
+# Concurrent refreshes of the same rows, e.g. from several loader processes,
+# update them instead of failing on the unique constraint
+_METEOROLOGY_UPSERT = "ON CONFLICT (city_id, date) DO UPDATE SET " + ', '.join(
+    f"{column} = EXCLUDED.{column}" for column in _METEOROLOGY_COLUMNS
+    if column not in ('id', 'city_id', 'date'))
+_AFFECTED_PARTITIONS = ("SELECT * FROM unnest(CAST(:city_ids AS INTEGER[]), "
+                        "CAST(:dates AS DATE[])) AS affected (city_id, date)")
+_ALL_PARTITIONS = "SELECT DISTINCT city_id, CAST(date AS DATE) AS date FROM daily_weather"
+
+
+def weather_partitions(data: Union[List[Dict], pd.DataFrame]) -> Set[Tuple[int, date]]:
+    """
+    Lists the australian_meteorology_weather rows affected by weather or
+    daily_weather rows.
+
+    :param data: The rows loaded, as dictionaries or a DataFrame with
+        city_id and date columns.
+    :return: The (city_id, day) pairs of the rows.
+    """
+    frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame(list(data))
+    if frame.empty:
+        return set()
+    days = pd.to_datetime(frame['date']).dt.date
+    return set(zip(frame['city_id'].astype(int), days))
+
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(url: str) -> Engine:
+    """
+    Returns the process-wide engine of a database, creating it on first use.
+    Connections are pooled and checked with a ping when taken from the pool,
+    so that a restarted database does not break the long-running tasks.
+
+    :param url: The database URL.
+    :return: The shared Engine.
+    """
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = _engines[url] = create_engine(
+                url,
+                poolclass=QueuePool,
+                pool_size=int(os.getenv('PG_POOL_SIZE', '5')),
+                max_overflow=int(os.getenv('PG_MAX_OVERFLOW', '10')),
+                pool_recycle=int(os.getenv('PG_POOL_RECYCLE', '1800')),
+                pool_pre_ping=True,
+            )
+        return engine
+
+
 class PostgresManager:
     """ Postgres Manager class """
-    def __init__(self):
+    def __init__(self, engine: Optional[Engine] = None):
+        """
+        :param engine: The engine to use. Defaults to the shared engine of
+            the database set by the environment variables.
+        """
         self.user = os.getenv('POSTGRES_USER')
         self.password = os.getenv('POSTGRES_PASSWORD')
         self.host = os.getenv('PG_HOST', 'localhost')
         self.port = os.getenv('PG_PORT', '54995')
         self.dbname = os.getenv('DB_NAME')
 
-        self.engine = create_engine(
+        self.engine = engine if engine is not None else get_engine(
             f"postgresql://{self.user}:{self.password}@{self.host}:{self.port}/{self.dbname}"
         )
-        self.session = sessionmaker(bind=self.engine)()
+        # Objects stay readable once their session is closed
+        self.session_factory = sessionmaker(bind=self.engine, expire_on_commit=False)
 
-        # Tester la connexion
+    @contextmanager
+    def session_scope(self):
+        """ Session for a unit of work, committed on success and rolled back on error """
+        session = self.session_factory()
         try:
-            with self.engine.connect() as connection:
-                print("Connexion réussie")
-                result = connection.execute("SELECT version();")
-                for row in result:
-                    print(f"PostgreSQL version: {row[0]}")
-        except Exception as e:
-            print(f"Erreur de connexion : {e}")
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
 
     def add_record(self, record):
         """ Add a record to a table """
-        self.session.add(record)
-        self.session.commit()
+        table = record.__tablename__
+        with metrics.timer('db_write_seconds', backend='postgres', table=table):
+            with self.session_scope() as session:
+                session.add(record)
+        metrics.increment('db_rows_written_total', backend='postgres', table=table)
+
+    def insert_statement(self, table, skip_existing=False):
+        """ INSERT statement of a table, skipping the rows that conflict with existing ones """
+        if not skip_existing:
+            return table.insert()
+        # ON CONFLICT DO NOTHING is dialect-specific, SQLite backs the tests and benchmarks
+        dialect = sqlite if self.engine.dialect.name == 'sqlite' else postgresql
+        return dialect.insert(table).on_conflict_do_nothing()
+
+    def add_records(self, model, rows, batch_size=1000, skip_existing=False):
+        """
+        Add many records to a table, committing once per batch of rows. With
+        skip_existing, the rows breaking a unique constraint are skipped, so
+        that loading the same rows twice is harmless.
+        """
+        table = model.__table__
+        insert = self.insert_statement(table, skip_existing)
+        rows = iter(rows)
+        inserted = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return inserted
+            # The Core insert would silently drop keys without a column, add_record rejects them
+            unknown = sorted(set().union(*batch) - set(table.columns.keys()))
+            if unknown:
+                raise TypeError(f"{unknown[0]!r} is an invalid keyword argument "
+                                f"for {model.__name__}")
+            with metrics.timer('db_write_seconds', backend='postgres', table=table.name):
+                with self.engine.begin() as connection:
+                    result = connection.execute(insert, batch)
+            written = result.rowcount if skip_existing else len(batch)
+            metrics.increment('db_rows_written_total', written,
+                              backend='postgres', table=table.name)
+            inserted += written
+
+    def add_frame(self, model, frame, batch_size=1000):
+        """ Add the rows of a DataFrame to a table, committing once per batch of rows """
+        columns = list(frame.columns)
+        # Missing values are stored as NULL rather than NaN
+        frame = frame.astype(object).where(frame.notna(), None)
+        rows = (dict(zip(columns, values))
+                for values in frame.itertuples(index=False, name=None))
+        return self.add_records(model, rows, batch_size)
+
+    def copy_frame(self, model, frame, batch_size=1000):
+        """ Copy the rows of a DataFrame to a table with COPY, skipping the rows already there """
+        return copy_dataframe(self.engine, frame, model.__tablename__, chunk_size=batch_size,
+                              staging=True)
 
     def fetch_record(self, model, query):
         """ Fetch a record from a table """
-        return self.session.query(model).filter_by(**query).first()
+        with self.session_scope() as session:
+            return session.query(model).filter_by(**query).first()
 
     def fetch_all_records(self, model):
         """ Fetch all records from a table """
-        return self.session.query(model).all()
+        with self.session_scope() as session:
+            return session.query(model).all()
+
+    def fetch_city_ids(self):
+        """ Fetch the ID of every city by name, in a single query """
+        with self.engine.connect() as connection:
+            return dict(connection.execute(select(City.name, City.id)).fetchall())
+
+    def refresh_australian_meteorology_weather(
+            self, partitions: Optional[Iterable[Tuple[int, date]]] = None) -> int:
+        """
+        Recomputes the rows of australian_meteorology_weather from weather
+        and daily_weather, in a single transaction. The rows are upserted,
+        so that concurrent refreshes of the same partitions do not conflict.
+
+        :param partitions: The (city_id, day) pairs to recompute, e.g. from
+            weather_partitions. Defaults to the whole table, which is emptied first.
+        :return: The number of rows written.
+        """
+        columns = ', '.join(_METEOROLOGY_COLUMNS)
+        statements = []
+        if partitions is None:
+            statements.append(text("DELETE FROM australian_meteorology_weather"))
+            affected, params = _ALL_PARTITIONS, {}
+        else:
+            # Sorted, so that concurrent refreshes lock the rows in the same order
+            partitions = sorted(set(partitions))
+            if not partitions:
+                return 0
+            affected = _AFFECTED_PARTITIONS
+            params = {'city_ids': [city_id for city_id, _ in partitions],
+                      'dates': [day for _, day in partitions]}
+        statements.append(text(f"WITH affected AS ({affected}) "
+                               f"INSERT INTO australian_meteorology_weather ({columns})"
+                               f"{_METEOROLOGY_SELECT}{_METEOROLOGY_UPSERT}"))
+
+        table = 'australian_meteorology_weather'
+        with metrics.timer('db_write_seconds', backend='postgres', table=table):
+            with self.engine.begin() as connection:
+                for statement in statements:
+                    inserted = connection.execute(statement, params).rowcount
+        metrics.increment('db_rows_written_total', inserted, backend='postgres', table=table)
+        return inserted
 
     def delete_record(self, record):
         """ Delete a record from the database """
-        self.session.delete(record)
-        self.session.commit()
+        with self.session_scope() as session:
+            session.delete(record)
 
     def fetch_city_record_by_coord(self, lat, lon):
         """ Fetch the nearest record from table City based on latitude and longitude """
-        return (self.session.query(City)
-                .order_by(func.abs(City.latitude - lat), func.abs(City.longitude - lon))
-                .first())
+        with self.session_scope() as session:
+            return (session.query(City)
+                    .order_by(func.abs(City.latitude - lat), func.abs(City.longitude - lon))
+                    .first())
+
+    def fetch_watermarks(self, endpoint):
+        """ Fetch the latest loaded date per city for an endpoint """
+        with self.session_scope() as session:
+            records = session.query(ExtractionWatermark).filter_by(endpoint=endpoint).all()
+        return {record.city_id: record.loaded_until for record in records}
+
+    def update_watermarks(self, endpoint, watermarks):
+        """ Move forward the latest loaded date per city for an endpoint """
+        table = ExtractionWatermark.__table__
+        with self.engine.begin() as connection:
+            existing = dict(connection.execute(
+                select(table.c.city_id, table.c.loaded_until)
+                .where(table.c.endpoint == endpoint)
+                .where(table.c.city_id.in_(list(watermarks)))
+            ).fetchall())
+            for city_id, loaded_until in watermarks.items():
+                if city_id not in existing:
+                    connection.execute(table.insert().values(
+                        city_id=city_id, endpoint=endpoint, loaded_until=loaded_until))
+                elif loaded_until > existing[city_id]:
+                    connection.execute(table.update()
+                                       .where(table.c.endpoint == endpoint)
+                                       .where(table.c.city_id == city_id)
+                                       .values(loaded_until=loaded_until))
+
+
+_manager: Optional[PostgresManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_postgres_manager() -> PostgresManager:
+    """
+    Returns the process-wide PostgresManager, creating it on first use.
+
+    :return: The shared PostgresManager.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = PostgresManager()
+        return _manager
 
 
 if __name__ == "__main__":
-    db = PostgresManager()
+    db = get_postgres_manager()
@@ -0,0 +1,88 @@
+"""
+This module contains a bulk loader streaming DataFrames into the data
+warehouse with COPY FROM STDIN, much faster than row-wise INSERTs.
+"""
+import io
+import time
+from typing import Iterable, Iterator, List, Union
+
+import pandas as pd
+from sqlalchemy.engine import Engine
+
+from utils.metrics_functools import metrics
+
+
+def _chunks(frames: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+            chunk_size: int) -> Iterator[pd.DataFrame]:
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    for frame in frames:
+        for start in range(0, len(frame), chunk_size):
+            yield frame.iloc[start:start + chunk_size]
+
+
+def _to_csv(frame: pd.DataFrame) -> io.StringIO:
+    # Missing values are written as unquoted empty fields, which COPY reads as NULL
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False, na_rep='', date_format='%Y-%m-%d %H:%M:%S')
+    buffer.seek(0)
+    return buffer
+
+
+def copy_dataframe(engine: Engine, frames: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+                   table: str, chunk_size: int = 50000, staging: bool = False) -> int:
+    """
+    Streams DataFrame rows into a table through COPY FROM STDIN, committing
+    once per chunk. With staging, each chunk is copied to a temporary table
+    and inserted with ON CONFLICT DO NOTHING, so that loading the same rows
+    twice is harmless as long as the table has a unique constraint.
+
+    :param engine: The engine of the data warehouse, e.g. PostgresManager.engine.
+    :param frames: A DataFrame, or an iterable of DataFrames with the same
+        columns, named after the columns of the table.
+    :param table: The name of the table.
+    :param chunk_size: The number of rows copied per transaction.
+    :param staging: Whether to skip the rows conflicting with existing ones.
+    :return: The number of rows inserted.
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    start = time.perf_counter()
+    inserted = 0
+
+    connection = engine.raw_connection()
+    try:
+        for chunk in _chunks(frames, chunk_size):
+            if chunk.empty:
+                continue
+            columns: List[str] = [quote(column) for column in chunk.columns]
+            column_list = ', '.join(columns)
+            copy_options = "WITH (FORMAT csv, NULL '')"
+            with metrics.timer('db_write_seconds', backend='postgres', table=table), \
+                    connection.cursor() as cursor:
+                if staging:
+                    cursor.execute(f"CREATE TEMP TABLE copy_staging ON COMMIT DROP AS "
+                                   f"SELECT {column_list} FROM {quote(table)} WITH NO DATA")
+                    cursor.copy_expert(f"COPY copy_staging ({column_list}) FROM STDIN "
+                                       f"{copy_options}", _to_csv(chunk))
+                    cursor.execute(f"INSERT INTO {quote(table)} ({column_list}) "
+                                   f"SELECT {column_list} FROM copy_staging "
+                                   f"ON CONFLICT DO NOTHING")
+                    chunk_inserted = cursor.rowcount
+                else:
+                    cursor.copy_expert(f"COPY {quote(table)} ({column_list}) FROM STDIN "
+                                       f"{copy_options}", _to_csv(chunk))
+                    chunk_inserted = len(chunk)
+                connection.commit()
+            metrics.increment('db_rows_written_total', chunk_inserted,
+                              backend='postgres', table=table)
+            inserted += chunk_inserted
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    elapsed = time.perf_counter() - start
+    rate = inserted / elapsed if elapsed else float('inf')
+    print(f"{inserted} rows loaded into {table} in {elapsed:.1f}s ({rate:.0f} rows/s)")
+    return inserted
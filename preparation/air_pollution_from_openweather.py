@@ -17,8 +17,10 @@ def date_to_timestamp(date_str):
 
 if __name__ == '__main__':
     start_date = '2020-01-01'
-    end_date = '2024-01-01'
+    end_date = datetime.now().strftime("%Y-%m-%d")
 
     daily_air_pollution_manager = DataPipeline(OpenWeatherDailyAirPollution(
-        start=date_to_timestamp(start_date), end=date_to_timestamp(end_date)))
+        start=date_to_timestamp(start_date), end=date_to_timestamp(end_date),
+        incremental=True),
+        batch_size=5000, streaming=True)
     daily_air_pollution_manager.run()
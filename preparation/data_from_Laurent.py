@@ -1,72 +1,140 @@
-import json
+import argparse
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Tuple
 
+import pandas as pd
 from dotenv import load_dotenv
 
-from database.mongodb_functools import MongoDBManager
-from database.postgresql_functools import PostgresManager, Weather, DailyWeather
+from database.mongodb_functools import get_mongo_manager
+from database.postgresql_functools import get_postgres_manager, weather_partitions, City
+from database.postgresql_loader import copy_dataframe
+from utils.geo_functools import CityIndex
+from utils.jsonl_functools import iter_batches, split_offsets
 from utils.openweather_functools import deg_to_cardinal, build_date_timestamp
 
 
-def load_daily_weather(path, postgres, mongo):
-    with open(os.path.join(path, 'data', 'json', 'dataDailyAggregation.json'), 'r') as f:
-        for line in f:
-            data = json.loads(line)
-
-            mongo.insert_document('weather', data)
-
-            city_id = postgres.fetch_city_record_by_coord(
-                data['lat'],
-                data['lon']).id
-
-            weather = {'date': data['date'],
-                       'min_temp': data['temperature']['min'],
-                       'max_temp': data['temperature']['max'],
-                       'rainfall': data['precipitation']['total'],
-                       'wind_gust_dir': deg_to_cardinal(data['wind']['max']['direction']),
-                       'wind_gust_speed': data['wind']['max']['speed'],
-                       'city_id': city_id
-                       }
-            postgres.add_record(DailyWeather(**weather))
-
-
-def load_timestamp_weather(path, postgres, mongo):
-    with open(os.path.join(path, 'data', 'json', 'dataWeatherTimeStamp.json'), 'r') as f:
-        for line in f:
-            data = json.loads(line)
-
-            mongo.insert_document('weather', data)
-
-            city_id = postgres.fetch_city_record_by_coord(
-                data['lat'],
-                data['lon']).id
-
-            weather = {'date': build_date_timestamp(timestamp=data['data'][0]['dt'],
-                                                    timezone=3600,  # workaround
-                                                    mode='datetime'),
-                       'temp': data['data'][0]['temp'],
-                       'sunrise': build_date_timestamp(timestamp=data['data'][0]['sunrise'],
-                                                       timezone=data['timezone_offset'],
-                                                       mode='hours'),
-                       'sunset': build_date_timestamp(timestamp=data['data'][0]['sunset'],
-                                                      timezone=data['timezone_offset'],
-                                                      mode='hours'),
-                       'wind_dir': deg_to_cardinal(data['data'][0]['wind_deg']),
-                       'wind_speed': data['data'][0]['wind_speed'],
-                       'cloud': data['data'][0]['clouds'],
-                       'humidity': data['data'][0]['humidity'],
-                       'pressure': data['data'][0]['pressure'],
-                       'city_id': city_id
-                       }
-            postgres.add_record(Weather(**weather))
+def daily_weather_row(data: Dict, city_id: int) -> Dict:
+    return {'date': data['date'],
+            'min_temp': data['temperature']['min'],
+            'max_temp': data['temperature']['max'],
+            'rainfall': data['precipitation']['total'],
+            'wind_gust_dir': deg_to_cardinal(data['wind']['max']['direction']),
+            'wind_gust_speed': data['wind']['max']['speed'],
+            'city_id': city_id
+            }
+
+
+def timestamp_weather_row(data: Dict, city_id: int) -> Dict:
+    return {'date': build_date_timestamp(timestamp=data['data'][0]['dt'],
+                                         timezone=3600,  # workaround
+                                         mode='datetime'),
+            'temp': data['data'][0]['temp'],
+            'sunrise': build_date_timestamp(timestamp=data['data'][0]['sunrise'],
+                                            timezone=data['timezone_offset'],
+                                            mode='hours'),
+            'sunset': build_date_timestamp(timestamp=data['data'][0]['sunset'],
+                                           timezone=data['timezone_offset'],
+                                           mode='hours'),
+            'wind_dir': deg_to_cardinal(data['data'][0]['wind_deg']),
+            'wind_speed': data['data'][0]['wind_speed'],
+            'cloud': data['data'][0]['clouds'],
+            'humidity': data['data'][0]['humidity'],
+            'pressure': data['data'][0]['pressure'],
+            'city_id': city_id
+            }
+
+
+class Dump(NamedTuple):
+    """ A JSON lines export of an OpenWeather endpoint """
+    filename: str
+    collection: str
+    table: str
+    to_row: Callable[[Dict, int], Dict]
+
+
+DUMPS = {
+    'daily_weather': Dump('dataDailyAggregation.json', 'daily_weather', 'daily_weather',
+                          daily_weather_row),
+    'timestamp_weather': Dump('dataWeatherTimeStamp.json', 'weather', 'weather',
+                              timestamp_weather_row),
+}
+
+
+def load_dump_range(name: str, path: str, start: int, end: int,
+                    batch_size: int = 10000) -> Tuple[int, int]:
+    """
+    Loads the lines of a dump starting in a byte range to the datalake and
+    the data warehouse, one batch of documents at a time. Runs in a worker
+    process, with its own connections and city index.
+
+    :param name: The name of the dump, a key of DUMPS.
+    :param path: The root directory of the project.
+    :param start: The offset of the first line.
+    :param end: The offset where the range ends.
+    :param batch_size: The number of documents parsed and written at once.
+    :return: The number of documents and rows loaded.
+    """
+    dump = DUMPS[name]
+    mongo = get_mongo_manager()
+    postgres = get_postgres_manager()
+    city_index = CityIndex(lambda: postgres.fetch_all_records(City))
+    filename = os.path.join(path, 'data', 'json', dump.filename)
+
+    documents_count, rows_count = 0, 0
+    for documents in iter_batches(filename, start, end, batch_size):
+        # One vectorized lookup per batch instead of one per document
+        city_ids = city_index.nearest_many([document['lat'] for document in documents],
+                                           [document['lon'] for document in documents])
+        rows = pd.DataFrame([dump.to_row(document, int(city_id))
+                             for document, city_id in zip(documents, city_ids)])
+        documents_count += mongo.insert_documents(dump.collection, documents, batch_size)
+        rows_count += copy_dataframe(postgres.engine, rows, dump.table, chunk_size=batch_size,
+                                     staging=True)
+        postgres.refresh_australian_meteorology_weather(weather_partitions(rows))
+    return documents_count, rows_count
+
+
+def load_dump(name: str, path: str, workers: int = 4,
+              batch_size: int = 10000) -> Tuple[int, int]:
+    """
+    Loads a dump, split into byte ranges loaded by separate processes.
+
+    :param name: The name of the dump, a key of DUMPS.
+    :param path: The root directory of the project.
+    :param workers: The number of worker processes, 1 to load in this process.
+    :param batch_size: The number of documents parsed and written at once.
+    :return: The number of documents and rows loaded.
+    """
+    filename = os.path.join(path, 'data', 'json', DUMPS[name].filename)
+    ranges = split_offsets(filename, workers)
+    if workers <= 1:
+        results: List[Tuple[int, int]] = [load_dump_range(name, path, start, end, batch_size)
+                                          for start, end in ranges]
+    else:
+        # Fresh interpreters, so that no database connection is shared with the workers
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [executor.submit(load_dump_range, name, str(path), start, end, batch_size)
+                       for start, end in ranges]
+            results = [future.result() for future in futures]
+
+    documents_count = sum(documents for documents, _ in results)
+    rows_count = sum(rows for _, rows in results)
+    print(f"{name}: {documents_count} documents and {rows_count} rows loaded")
+    return documents_count, rows_count
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Loads the OpenWeather JSON lines exports")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
     dir_path = Path(__file__).parents[1]
     load_dotenv()
-    mongo_manager = MongoDBManager()
-    postgres_manager = PostgresManager()
 
-    load_daily_weather(dir_path, postgres_manager, mongo_manager)
-    load_timestamp_weather(dir_path, postgres_manager, mongo_manager)
+    load_dump('daily_weather', dir_path, args.workers, args.batch_size)
+    load_dump('timestamp_weather', dir_path, args.workers, args.batch_size)
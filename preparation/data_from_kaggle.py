@@ -1,43 +1,93 @@
 import os
 from pathlib import Path
 
-import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 
-from database.postgresql_functools import PostgresManager
+from database.postgresql_functools import get_postgres_manager, weather_partitions
+from database.postgresql_loader import copy_dataframe
 from utils.df_to_kaggle_format import transform_to_kaggle_format
 from utils.json_functools import load_from_json
 
 
+# Columns of weatherAUS.csv kept, and their names in the data warehouse
+KAGGLE_COLUMNS = {'Date': 'date',
+                  'Location': 'location',
+                  'MinTemp': 'min_temp',
+                  'MaxTemp': 'max_temp',
+                  'Rainfall': 'rainfall',
+                  'Evaporation': 'evaporation',
+                  'Sunshine': 'sunshine',
+                  'WindGustDir': 'wind_gust_dir',
+                  'WindGustSpeed': 'wind_gust_speed',
+                  'WindDir9am': 'wind_dir_9am',
+                  'WindDir3pm': 'wind_dir_3pm',
+                  'WindSpeed9am': 'wind_speed_9am',
+                  'WindSpeed3pm': 'wind_speed_3pm',
+                  'Humidity9am': 'humidity_9am',
+                  'Humidity3pm': 'humidity_3pm',
+                  'Pressure9am': 'pressure_9am',
+                  'Pressure3pm': 'pressure_3pm',
+                  'Cloud9am': 'cloud_9am',
+                  'Cloud3pm': 'cloud_3pm',
+                  'Temp9am': 'temp_9am',
+                  'Temp3pm': 'temp_3pm'}
+
+# Compact dtypes: a few distinct labels per text column, measures fit in float32
+KAGGLE_DTYPES = {column: 'float32' for column in KAGGLE_COLUMNS
+                 if column not in ('Date', 'Location', 'WindGustDir', 'WindDir9am', 'WindDir3pm')}
+KAGGLE_DTYPES.update({'Date': str, 'Location': 'category', 'WindGustDir': 'category',
+                      'WindDir9am': 'category', 'WindDir3pm': 'category'})
+
+
+def iter_kaggle(locations, path, chunksize=100000):
+    """
+    Reads weatherAUS.csv in chunks, keeping only the rows of the given
+    locations, so that memory stays bounded whatever the size of the file.
+
+    :param locations: The Kaggle names of the locations to keep.
+    :param path: The root directory of the project.
+    :param chunksize: The number of lines of the file read at once.
+    :return: An iterator over DataFrames with the data warehouse column names.
+    """
+    chunks = pd.read_csv(os.path.join(path, 'data', 'csv', 'weatherAUS.csv'),
+                         usecols=list(KAGGLE_COLUMNS), dtype=KAGGLE_DTYPES,
+                         na_values=['NA'], chunksize=chunksize)
+    for chunk in chunks:
+        chunk = chunk.loc[chunk['Location'].isin(locations)]
+        if chunk.empty:
+            continue
+        location = chunk['Location'].cat.remove_unused_categories() \
+            .cat.rename_categories({'Brisbane': 'Brisbane City'})
+        yield chunk.assign(Location=location).rename(columns=KAGGLE_COLUMNS)
+
+
 def load_kaggle(locations, path):
-    df = pd.read_csv(os.path.join(path, 'data', 'csv', 'weatherAUS.csv')) \
-        .drop(columns=['RainToday', 'RainTomorrow']) \
-        .rename(columns={'Date': 'date',
-                         'Location': 'location',
-                         'MinTemp': 'min_temp',
-                         'MaxTemp': 'max_temp',
-                         'Rainfall': 'rainfall',
-                         'Evaporation': 'evaporation',
-                         'Sunshine': 'sunshine',
-                         'WindGustDir': 'wind_gust_dir',
-                         'WindGustSpeed': 'wind_gust_speed',
-                         'WindDir9am': 'wind_dir_9am',
-                         'WindDir3pm': 'wind_dir_3pm',
-                         'WindSpeed9am': 'wind_speed_9am',
-                         'WindSpeed3pm': 'wind_speed_3pm',
-                         'Humidity9am': 'humidity_9am',
-                         'Humidity3pm': 'humidity_3pm',
-                         'Pressure9am': 'pressure_9am',
-                         'Pressure3pm': 'pressure_3pm',
-                         'Cloud9am': 'cloud_9am',
-                         'Cloud3pm': 'cloud_3pm',
-                         'Temp9am': 'temp_9am',
-                         'Temp3pm': 'temp_3pm'}) \
-        .loc[lambda x: x['location'].isin(locations)] \
-        .replace('Brisbane', 'Brisbane City') \
-        .replace('NA', np.nan)
-    return df
+    return pd.concat(iter_kaggle(locations, path), ignore_index=True)
+
+
+def ingest_kaggle(locations, path, postgres_manager, chunksize=100000):
+    """
+    Streams weatherAUS.csv to the data warehouse chunk by chunk, without
+    ever holding the whole file in memory, and refreshes the
+    australian_meteorology_weather rows of each chunk.
+
+    :param locations: The Kaggle names of the locations to keep.
+    :param path: The root directory of the project.
+    :param postgres_manager: The PostgresManager of the data warehouse.
+    :param chunksize: The number of lines of the file read at once.
+    :return: The number of daily_weather and weather rows inserted.
+    """
+    daily_count, weather_count = 0, 0
+    for chunk in iter_kaggle(locations, path, chunksize):
+        daily_weather, weather_9am, weather_3pm = \
+            transform_to_kaggle_format(chunk, postgres_manager)
+        daily_count += copy_dataframe(postgres_manager.engine, daily_weather,
+                                      'daily_weather', staging=True)
+        weather_count += copy_dataframe(postgres_manager.engine, [weather_9am, weather_3pm],
+                                        'weather', staging=True)
+        postgres_manager.refresh_australian_meteorology_weather(weather_partitions(daily_weather))
+    return daily_count, weather_count
 
 
 if __name__ == '__main__':
@@ -50,14 +100,7 @@ if __name__ == '__main__':
     locations_to_keep.remove('Brisbane City')
     locations_to_keep.append('Brisbane')
 
-    postgres_manager = PostgresManager()
-
-    kaggle_weather_df = load_kaggle(locations_to_keep, dir_path)
-
-    daily_weather, weather_9am, weather_3pm = (
-        transform_to_kaggle_format(kaggle_weather_df, postgres_manager))
+    postgres_manager = get_postgres_manager()
 
-    # Store the weather data to data warehouse
-    daily_weather.to_sql('daily_weather', postgres_manager.engine, if_exists='append', index=False)
-    weather_9am.to_sql('weather', postgres_manager.engine, if_exists='append', index=False)
-    weather_3pm.to_sql('weather', postgres_manager.engine, if_exists='append', index=False)
+    # Store the weather data to data warehouse, one chunk of the file at a time
+    ingest_kaggle(locations_to_keep, dir_path, postgres_manager)
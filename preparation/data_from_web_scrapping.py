@@ -2,18 +2,29 @@
 This script is used to scrape the Australian Bureau of Meteorology website
 """
 
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from pathlib import Path
 import numpy as np
 from dotenv import load_dotenv
 from itertools import product
 import re
 from typing import Optional, Tuple
 import requests
-from datetime import datetime
+from datetime import datetime, date as date_type, timedelta
 from typing import List
 import pandas as pd
 from bs4 import BeautifulSoup
-from database.postgresql_functools import PostgresManager
+from lxml import html as lxml_html
+from database.postgresql_functools import get_postgres_manager, weather_partitions
+from database.postgresql_loader import copy_dataframe
 from utils.df_to_kaggle_format import transform_to_kaggle_format
+from utils.cache_functools import PageCache
+from utils.http_functools import HostThrottle, get_http_client
+from utils.metrics_functools import metrics
 
 
 def generate_urls(dates: List[str], locations: List[str]) -> List[str]:
@@ -45,7 +56,7 @@ def fetch_page_content(url: str) -> Optional[BeautifulSoup]:
         or None if the request fails.
     """
     try:
-        response = requests.get(url, timeout=10)
+        response = get_http_client().get(url)
         response.raise_for_status()  # Raise an exception for bad responses
         # Parse and return the HTML content
         bs = BeautifulSoup(response.content, 'lxml')
@@ -56,6 +67,83 @@ def fetch_page_content(url: str) -> Optional[BeautifulSoup]:
         return None
 
 
+def month_is_final(month: str, today: Optional[date_type] = None, grace_days: int = 2) -> bool:
+    """
+    Tells whether the observations of a month can no longer change. Late
+    corrections are allowed for a few days after the end of the month.
+
+    :param month: The month, formatted as YYYYMM.
+    :param today: The current date. Defaults to today.
+    :param grace_days: The number of days after the end of the month
+        during which the page may still change.
+    :return: True if the page of the month is final.
+    """
+    today = today or date_type.today()
+    first_day = datetime.strptime(month, '%Y%m').date()
+    next_month = (first_day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return today >= next_month + timedelta(days=grace_days)
+
+
+def page_is_final(url: str) -> bool:
+    """
+    :param url: The URL of a monthly observations page.
+    :return: True if the month of the page is final, False if unknown.
+    """
+    match = re.search(r"/dwo/(\d{6})/", url)
+    return bool(match) and month_is_final(match.group(1))
+
+
+def fetch_page_bytes(url: str, throttle: Optional[HostThrottle] = None,
+                     cache: Optional[PageCache] = None, offline: bool = False) -> Optional[bytes]:
+    """
+    Fetches the raw HTML content from a given URL, leaving the parsing
+    to the caller so that it can run in another process. With a cache,
+    the pages of finished months are never requested again, and the
+    others are revalidated with a conditional request.
+
+    :param url: The URL from which to fetch the content.
+    :param throttle: An optional per-host politeness limit.
+    :param cache: An optional page cache.
+    :param offline: Whether to only read the pages from the cache.
+    :returns: The raw content of the page, the cached one if the request
+        fails, or None if the request fails and the page is not cached.
+    """
+    cached = cache.get(url) if cache is not None else None
+    if cached is not None and (offline or cached[1]['permanent']):
+        metrics.increment('page_cache_total', result='hit')
+        return cached[0]
+    if offline:
+        print(f"Page missing from the cache: {url}")
+        return None
+
+    headers = cache.validators(cached[1]) if cached is not None else {}
+    try:
+        with throttle(url) if throttle is not None else nullcontext():
+            response = get_http_client().get(url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            metrics.increment('page_cache_total', result='not_modified')
+            content, metadata = cached
+            if page_is_final(url):
+                cache.put(url, content, metadata['etag'], metadata['last_modified'],
+                          permanent=True)
+            return content
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if cached is not None:
+            # A transient error must not drop a page the cache still holds
+            print(f"Error fetching URL {url}: {e}, using the cached page")
+            metrics.increment('page_cache_total', result='stale')
+            return cached[0]
+        print(f"Error fetching URL {url}: {e}")
+        return None
+
+    metrics.increment('page_cache_total', result='miss')
+    if cache is not None:
+        cache.put(url, response.content, response.headers.get('ETag'),
+                  response.headers.get('Last-Modified'), permanent=page_is_final(url))
+    return response.content
+
+
 def extract_simplified_information(html: str) -> Tuple[Optional[str], Optional[str]]:
     """
     Extracts simplified location and date information from the HTML
@@ -76,6 +164,21 @@ def extract_simplified_information(html: str) -> Tuple[Optional[str], Optional[s
     return None, None  # Return a tuple of None if no match is found
 
 
+# Columns of the daily observations table, in page order
+WEATHER_COLUMNS = ['day', 'min_temp', 'max_temp', 'rainfall',
+                   'evaporation', 'sunshine', 'wind_gust_dir',
+                   'wind_gust_speed', 'wind_gust_time', 'temp_9am',
+                   'humidity_9am', 'cloud_9am', 'wind_dir_9am',
+                   'wind_speed_9am', 'pressure_9am', 'temp_3pm',
+                   'humidity_3pm', 'cloud_3pm', 'wind_dir_3pm',
+                   'wind_speed_3pm', 'pressure_3pm']
+
+NUMERIC_WEATHER_COLUMNS = ['min_temp', 'max_temp', 'rainfall', 'evaporation', 'sunshine',
+                           'wind_gust_speed', 'temp_9am', 'humidity_9am', 'cloud_9am',
+                           'wind_speed_9am', 'pressure_9am', 'temp_3pm', 'humidity_3pm',
+                           'cloud_3pm', 'wind_speed_3pm', 'pressure_3pm']
+
+
 def parse_html_content(soup: BeautifulSoup) -> pd.DataFrame:
     """
     Parses the HTML content with BeautifulSoup and extracts
@@ -110,15 +213,7 @@ def parse_html_content(soup: BeautifulSoup) -> pd.DataFrame:
     formatted_dates = [month_year_datetime.replace(day=int(day))
                        .strftime("%Y-%m-%d") for day in days]
 
-    # Define the columns for the DataFrame
-    columns = ['day', 'min_temp', 'max_temp', 'rainfall',
-               'evaporation', 'sunshine', 'wind_gust_dir',
-               'wind_gust_speed', 'wind_gust_time', 'temp_9am',
-               'humidity_9am', 'cloud_9am', 'wind_dir_9am',
-               'wind_speed_9am', 'pressure_9am', 'temp_3pm',
-               'humidity_3pm', 'cloud_3pm', 'wind_dir_3pm',
-               'wind_speed_3pm', 'pressure_3pm']
-    df = pd.DataFrame(data, columns=columns)
+    df = pd.DataFrame(data, columns=WEATHER_COLUMNS)
 
     # Drop unnecessary columns
     df.drop(['day', 'wind_gust_time'], axis=1, inplace=True)
@@ -129,27 +224,126 @@ def parse_html_content(soup: BeautifulSoup) -> pd.DataFrame:
     return df
 
 
-def aggregate_weather_data(urls: List[str]) -> pd.DataFrame:
+def parse_html_bytes(content: bytes, typed: bool = False) -> pd.DataFrame:
+    """
+    Parses the raw HTML content of a page with lxml XPath queries, without
+    building a BeautifulSoup tree. The output is the same as parse_html_content.
+
+    :param content: The raw HTML content.
+    :param typed: Whether to cast the columns with cast_weather_columns.
+    :return: DataFrame containing the extracted weather data.
+    """
+    tree = lxml_html.fromstring(content)
+
+    # Extract the page header to get location and date information
+    header = tree.xpath('//div[contains(concat(" ", normalize-space(@class), " "), " content ")]'
+                        '//h1')[0]
+    location, date = extract_simplified_information(
+        lxml_html.tostring(header, encoding='unicode'))
+
+    rows = tree.xpath('//table[contains(concat(" ", normalize-space(@class), " "), " data ")]'
+                      '/tbody/tr')
+    days, data = [], []
+    for row in rows:
+        days.extend(row.xpath('th/text()'))
+        values = []
+        for cell in row.xpath('td'):
+            text = cell.text_content()
+            if text == 'Calm':
+                # A calm wind spans the direction and speed columns
+                values.extend(('Calm', -1))
+            else:
+                values.append(np.nan if text == '\xa0' else text)
+        data.append(values)
+
+    # Short rows are padded with NaN, as in parse_html_content
+    month_year_datetime = datetime.strptime(date, "%B %Y")
+    df = pd.DataFrame(data, columns=WEATHER_COLUMNS).drop(columns=['day', 'wind_gust_time'])
+    df['date'] = [month_year_datetime.replace(day=int(day)).strftime("%Y-%m-%d")
+                  for day in days]
+    df['location'] = location
+    return cast_weather_columns(df) if typed else df
+
+
+def cast_weather_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts the measures of a parsed page to floats and its dates to
+    datetimes. Cells that are not numbers become NaN.
+
+    :param df: DataFrame returned by one of the parsers.
+    :return: The same DataFrame, with typed columns.
+    """
+    for column in NUMERIC_WEATHER_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce').astype(np.float64)
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def parse_page(content: bytes) -> pd.DataFrame:
+    """
+    Parses the raw HTML content of a page into a DataFrame with typed columns.
+
+    :param content: The raw HTML content.
+    :return: DataFrame containing the extracted weather data.
+    """
+    return parse_html_bytes(content, typed=True)
+
+
+def aggregate_weather_data(urls: List[str], max_workers: int = 8, max_per_host: int = 4,
+                           min_interval: float = 0.0, parse_workers: Optional[int] = None,
+                           cache: Optional[PageCache] = None,
+                           offline: bool = False) -> pd.DataFrame:
     """
     Aggregates weather data from multiple URLs into a single DataFrame.
+    The pages are fetched concurrently within a per-host politeness limit,
+    and parsed in a pool of processes as soon as they arrive.
 
     :param urls: List of URLs to fetch and parse weather data from.
-    :return: Aggregated DataFrame containing weather data from all specified URLs.
+    :param max_workers: The number of pages fetched at the same time.
+    :param max_per_host: The maximum number of requests in flight per host.
+    :param min_interval: The minimum delay in seconds between two requests to a host.
+    :param parse_workers: The number of parsing processes. Defaults to the
+        number of CPUs, 0 parses the pages in the current process.
+    :param cache: An optional page cache, see fetch_page_bytes.
+    :param offline: Whether to only read the pages from the cache.
+    :return: Aggregated DataFrame containing weather data from all specified URLs,
+        in the order of the URLs.
     """
-    aggregated_df = pd.DataFrame()
-    for url in urls:
-        soup = fetch_page_content(url)
-        if soup:
-            # Extract weather data into a DataFrame
-            df_temp = parse_html_content(soup)
-            aggregated_df = pd.concat([aggregated_df, df_temp],
-                                      ignore_index=True)
-    return aggregated_df
+    throttle = HostThrottle(max_per_host, min_interval)
+    # The parsers start while the fetcher threads run, forking them could deadlock
+    parser = ProcessPoolExecutor(parse_workers, mp_context=multiprocessing.get_context('spawn')) \
+        if parse_workers != 0 else ThreadPoolExecutor(max_workers=1)
+    with ThreadPoolExecutor(max_workers=max_workers) as fetcher, parser:
+        fetches = {fetcher.submit(fetch_page_bytes, url, throttle, cache, offline): index
+                   for index, url in enumerate(urls)}
+        parses = {}
+        for future in as_completed(fetches):
+            content = future.result()
+            if content is not None:
+                parses[fetches[future]] = parser.submit(parse_page, content)
+
+        frames = []
+        for index in sorted(parses):
+            try:
+                frames.append(parses[index].result())
+            except Exception as e:
+                raise RuntimeError(f"Could not parse the page {urls[index]}") from e
+
+    # Concatenate once, rather than copying the growing frame after every page
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Scrapes the daily weather observations "
+                                                 "of the Bureau of Meteorology")
+    parser.add_argument('--offline', action='store_true',
+                        help="Only parse the pages already in the cache")
+    args = parser.parse_args()
+
     load_dotenv()
-    postgres = PostgresManager()
+    postgres = get_postgres_manager()
 
     # Define the dates to scrape: <year><month>
     dates_to_scrape = ['202304', '202305', '202306', '202307', '202308', '202309',
@@ -167,13 +361,16 @@ if __name__ == '__main__':
     pages_to_scrape = generate_urls(dates_to_scrape, list(locations_to_scrape.values()))
 
     # Aggregate the weather data
-    weather_scrapped = aggregate_weather_data(pages_to_scrape) \
+    default_cache_directory = Path(__file__).parents[1] / '.cache' / 'bom'
+    page_cache = PageCache(os.getenv('BOM_CACHE_DIR', str(default_cache_directory)))
+    weather_scrapped = aggregate_weather_data(pages_to_scrape, cache=page_cache,
+                                              offline=args.offline) \
         .replace({'Melbourne (Olympic Park)': 'Melbourne',
                   'Brisbane': 'Brisbane City'})
 
     daily_weather, weather_9am, weather_3pm = transform_to_kaggle_format(weather_scrapped, postgres)
 
     # Store the weather data to data warehouse
-    daily_weather.to_sql('daily_weather', postgres.engine, if_exists='append', index=False)
-    weather_9am.to_sql('weather', postgres.engine, if_exists='append', index=False)
-    weather_3pm.to_sql('weather', postgres.engine, if_exists='append', index=False)
+    copy_dataframe(postgres.engine, daily_weather, 'daily_weather', staging=True)
+    copy_dataframe(postgres.engine, [weather_9am, weather_3pm], 'weather', staging=True)
+    postgres.refresh_australian_meteorology_weather(weather_partitions(daily_weather))
@@ -1,17 +1,158 @@
-from dotenv import load_dotenv
+import argparse
 import os
+import shutil
 from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
 import pandas as pd
-from database.postgresql_functools import PostgresManager
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from database.models import AustralianMeteorologyWeather
+from database.postgresql_functools import get_postgres_manager
+from utils.json_functools import load_from_json, store_to_json
+
+STUDY_COLUMNS = [column.name for column in AustralianMeteorologyWeather.__table__.columns
+                 if column.name not in ('id', 'city_id')]
+
+# Rows newer than the last date exported per location, in the order of the
+# (location, date) index so that the server streams them without sorting
+STUDY_QUERY = f"""
+    SELECT {', '.join(f'm.{column}' for column in STUDY_COLUMNS)}
+    FROM australian_meteorology_weather m
+    LEFT JOIN unnest(CAST(:locations AS TEXT[]), CAST(:dates AS DATE[])) AS exported (location, date)
+        ON exported.location = m.location
+    WHERE exported.date IS NULL OR m.date > exported.date
+    ORDER BY m.location, m.date
+"""
+
+# Layout of the Parquet copy of the study dataset. The partition columns are
+# not stored in the files, the other text columns are dictionary-encoded.
+PARQUET_PARTITIONS = ['location', 'year']
+PARQUET_CATEGORIES = ['wind_gust_dir', 'wind_dir_9am', 'wind_dir_3pm',
+                      'rain_today', 'rain_tomorrow']
+
+
+def read_weather_study(engine, watermarks: Dict[str, str],
+                       chunksize: int = 50000) -> Iterator[pd.DataFrame]:
+    """
+    Streams the rows of australian_meteorology_weather through a
+    server-side cursor, so that only one chunk is held in memory at a time.
+
+    :param engine: The engine of the data warehouse.
+    :param watermarks: The last date already exported per location.
+    :param chunksize: The number of rows per chunk.
+    :return: An iterator over DataFrames ordered by location and date.
+    """
+    params = {'locations': list(watermarks), 'dates': list(watermarks.values())}
+    # Read with SQLAlchemy directly, as pandas 2 does not take the connections of SQLAlchemy 1.4
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(text(STUDY_QUERY),
+                                                                           params)
+        columns = list(result.keys())
+        while True:
+            rows = result.fetchmany(chunksize)
+            if not rows:
+                return
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+
+def add_rain_columns(chunk: pd.DataFrame, carry: Optional[pd.DataFrame] = None
+                     ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Adds the rain_today and rain_tomorrow columns to rows ordered by
+    location and date. A row needs the next one of its location, so the
+    last row of the chunk is carried over to the next chunk, and the last
+    row of each location is held back until its next day is loaded.
+
+    :param chunk: The rows to process.
+    :param carry: The rows carried over from the previous chunk.
+    :return: The rows ready to be exported, and the rows to carry over.
+    """
+    if carry is not None and not carry.empty:
+        chunk = pd.concat([carry, chunk], ignore_index=True)
+    rain_today = pd.Series(np.where(chunk['rainfall'] >= 1, 'yes', 'no'), index=chunk.index)
+    has_tomorrow = chunk['location'].eq(chunk['location'].shift(-1))
+    ready = chunk.assign(rain_today=rain_today,
+                         rain_tomorrow=rain_today.shift(-1).fillna('no'))[has_tomorrow]
+    return ready, chunk.iloc[-1:]
+
+
+def export_weather_study(engine, path, incremental: bool = False,
+                         chunksize: int = 50000, parquet_dir=None) -> int:
+    """
+    Exports australian_meteorology_weather to the study CSV file. The last
+    date exported per location is kept in a JSON file next to it, so that an
+    incremental export only reads and appends the newer rows.
+
+    :param engine: The engine of the data warehouse.
+    :param path: The CSV file.
+    :param incremental: Whether to append the new rows to the existing file
+        instead of rewriting it.
+    :param chunksize: The number of rows read at once.
+    :param parquet_dir: When set, the rows are also written to this
+        directory as a Parquet dataset partitioned by location and year.
+    :return: The number of rows written.
+    """
+    path = Path(path)
+    watermarks_path = path.with_name(path.name + '.json')
+    append = incremental and path.exists() and watermarks_path.exists() \
+        and (parquet_dir is None or Path(parquet_dir).exists())
+    watermarks = load_from_json(str(watermarks_path)) if append else {}
+    # A full export replaces the file only once it is complete
+    target = path if append else path.with_name(path.name + '.tmp')
+
+    if parquet_dir is not None:
+        from utils.parquet_functools import append_to_dataset, replace_dataset
+        parquet_dir = Path(parquet_dir)
+        parquet_target = parquet_dir if append else parquet_dir.with_name(parquet_dir.name + '.tmp')
+        if not append:
+            if parquet_target.exists():
+                shutil.rmtree(parquet_target)
+            parquet_target.mkdir(parents=True)
+
+    written, carry = 0, None
+    with open(target, 'a' if append else 'w', newline='', encoding='utf-8') as file:
+        if not append:
+            file.write(','.join(STUDY_COLUMNS + ['rain_today', 'rain_tomorrow']) + '\n')
+        for chunk in read_weather_study(engine, dict(watermarks), chunksize):
+            ready, carry = add_rain_columns(chunk, carry)
+            if ready.empty:
+                continue
+            ready.to_csv(file, header=False, index=False)
+            if parquet_dir is not None:
+                append_to_dataset(ready.assign(year=pd.to_datetime(ready['date']).dt.year),
+                                  parquet_target, PARQUET_PARTITIONS, PARQUET_CATEGORIES)
+            watermarks.update(ready.groupby('location')['date'].max().astype(str).to_dict())
+            written += len(ready)
+    if not append:
+        os.replace(target, path)
+        if parquet_dir is not None:
+            replace_dataset(parquet_target, parquet_dir)
+
+    tmp_path = watermarks_path.with_name(watermarks_path.name + '.tmp')
+    store_to_json(watermarks, str(tmp_path))
+    os.replace(tmp_path, watermarks_path)
+    print(f"{written} rows exported to {path}")
+    return written
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exports the weather study dataset")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only append the rows newer than the ones already exported")
+    parser.add_argument('--chunksize', type=int, default=50000)
+    parser.add_argument('--no-parquet', action='store_true',
+                        help="Only write the CSV file, not the Parquet dataset next to it")
+    args = parser.parse_args()
+
     load_dotenv()
-    postgres = PostgresManager()
+    postgres = get_postgres_manager()
     root_path = Path().resolve().parent
+    csv_path = os.path.join(root_path, 'data', 'csv', 'weather_study.csv')
+    parquet_path = os.path.join(root_path, 'data', 'parquet', 'weather_study')
 
-    df = pd.read_sql_table('australian_meteorology_weather', postgres.engine) \
-        .drop(columns=['id'])
-    df['rain_today'] = df['rainfall'].apply(lambda x: 'yes' if x >= 1 else 'no')
-    df['rain_tomorrow'] = df['rain_today'].shift(-1).apply(lambda x: 'yes' if x == 'yes' else 'no')
-    df.to_csv(os.path.join(root_path, 'data', 'csv', 'weather_study.csv'), index=False)
+    export_weather_study(postgres.engine, csv_path, incremental=args.incremental,
+                         chunksize=args.chunksize,
+                         parquet_dir=None if args.no_parquet else parquet_path)
@@ -5,7 +5,7 @@ sys.path.append('/app')
 import pandas as pd
 from datetime import datetime
 
-from data_pipeline.pipeline_manager import DataPipeline
+from data_pipeline.backfill import BackfillRunner
 from utils.ELTL import OpenWeatherTimestampWeather, OpenWeatherDailyWeather
 
 
@@ -19,23 +19,24 @@ def generate_timestamps(date):
     return timestamp_9am, timestamp_3pm
 
 
+def weather_jobs(date):
+    timestamp_9am, timestamp_3pm = generate_timestamps(date)
+
+    return [
+        ('day_summary', lambda cities: OpenWeatherDailyWeather(
+            date=date.strftime("%Y-%m-%d"), cities=cities)),
+        ('timemachine_9am', lambda cities: OpenWeatherTimestampWeather(
+            timestamp=timestamp_9am, cities=cities)),
+        ('timemachine_3pm', lambda cities: OpenWeatherTimestampWeather(
+            timestamp=timestamp_3pm, cities=cities)),
+    ]
+
+
 if __name__ == '__main__':
     start_date = '2017-01-01'
     end_date = '2024-01-01'
 
     dates = pd.date_range(start_date, end_date, freq='D')
 
-    for date in dates:
-        timestamp_9am, timestamp_3pm = generate_timestamps(date)
-
-        daily_Weather_manager = DataPipeline(OpenWeatherDailyWeather(
-            date=date.strftime("%Y-%m-%d")))
-        daily_Weather_manager.run()
-
-        timestamp_Weather_manager = DataPipeline(OpenWeatherTimestampWeather(
-            timestamp=timestamp_9am))
-        timestamp_Weather_manager.run()
-
-        timestamp_Weather_manager = DataPipeline(OpenWeatherTimestampWeather(
-            timestamp=timestamp_3pm))
-        timestamp_Weather_manager.run()
+    backfill_runner = BackfillRunner(dates, weather_jobs, partition_size=30, max_workers=4)
+    backfill_runner.run()
@@ -1,6 +1,11 @@
+import os
+
 import pytest
 from unittest.mock import MagicMock, patch
-from database.postgresql_functools import PostgresManager
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from database.postgresql_functools import PostgresManager, City
 
 
 @pytest.fixture
@@ -27,7 +32,41 @@ def mock_mongo_manager():
 
         # Mock des méthodes pour simuler l'insertion et la récupération des documents
         mock_instance.insert_document = MagicMock()
+        mock_instance.insert_documents = MagicMock()
         mock_instance.find_document = MagicMock()
         mock_instance.delete_document = MagicMock()
 
         yield mock_instance
+
+
+@pytest.fixture
+def sqlite_postgres_manager():
+    """Fixture pour un PostgresManager branché sur une base SQLite en mémoire."""
+    engine = create_engine("sqlite://", poolclass=StaticPool,
+                           connect_args={'check_same_thread': False})
+    City.metadata.create_all(engine)
+    yield PostgresManager(engine=engine)
+
+
+@pytest.fixture
+def postgres_manager():
+    """Fixture pour un PostgresManager branché sur la base Postgres vide de TEST_POSTGRES_URL."""
+    url = os.getenv('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL n'est pas définie")
+    engine = create_engine(url)
+    City.metadata.drop_all(engine)
+    City.metadata.create_all(engine)
+    yield PostgresManager(engine=engine)
+    City.metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def isolated_metrics(tmp_path, monkeypatch):
+    """Fixture qui remet les métriques à zéro et les écrit dans un dossier temporaire."""
+    from utils.metrics_functools import metrics
+    metrics.reset()
+    monkeypatch.setenv('PIPELINE_METRICS_FILE', str(tmp_path / 'pipeline_metrics.prom'))
+    yield metrics
+    metrics.reset()
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from data_pipeline.backfill import BackfillRunner
+from utils.ELTL import OpenWeatherAPI
+
+CITIES = [{'lat': -33.87, 'lon': 151.21}, {'lat': -37.81, 'lon': 144.96},
+          {'lat': -27.47, 'lon': 153.03}]
+DATES = [datetime(2024, 1, 1) + timedelta(days=i) for i in range(5)]
+JOBS = ('day_summary', 'timemachine')
+
+
+def jobs(date):
+    # Un extracteur factice par endpoint, qui garde la date et les villes demandées
+    return [(name, lambda cities, name=name: SimpleNamespace(job=name, date=f"{date:%Y-%m-%d}",
+                                                             cities=cities))
+            for name in JOBS]
+
+
+@pytest.fixture
+def datalake(mocker):
+    """Fixture pour un datalake en mémoire qui ne garde que les checkpoints."""
+    checkpoints = []
+    datalake = MagicMock()
+    datalake.insert_documents.side_effect = \
+        lambda collection, documents: checkpoints.extend(documents)
+    datalake.iter_documents.side_effect = \
+        lambda collection, query, projection=None: iter(list(checkpoints))
+    datalake.checkpoints = checkpoints
+    mocker.patch.object(OpenWeatherAPI, 'datalake_manager', datalake)
+    return datalake
+
+
+@pytest.fixture
+def pipelines(mocker):
+    """Fixture qui remplace DataPipeline et note les (endpoint, date, ville) demandés."""
+    pipelines = SimpleNamespace(requested=[], failing=set())
+
+    def data_pipeline(manager, batch_size):
+        def run():
+            pipelines.requested.extend((manager.job, manager.date, city['lat'])
+                                       for city in manager.cities)
+            if (manager.job, manager.date) in pipelines.failing:
+                raise ConnectionError("Web server response: 500")
+        return MagicMock(run=run)
+
+    mocker.patch('data_pipeline.backfill.DataPipeline', side_effect=data_pipeline)
+    return pipelines
+
+
+def checkpointed(datalake):
+    return sorted(checkpoint['_id'] for checkpoint in datalake.checkpoints)
+
+
+def test_backfill_partitions_consecutive_dates(datalake):
+    runner = BackfillRunner(DATES, jobs, cities=CITIES, partition_size=2)
+
+    assert runner.partitions() == [DATES[0:2], DATES[2:4], DATES[4:5]]
+
+
+def test_backfill_run_loads_every_combination(datalake, pipelines):
+    loaded = BackfillRunner(DATES, jobs, cities=CITIES, partition_size=2, max_workers=2).run()
+
+    assert loaded == len(DATES) * len(JOBS) * len(CITIES)
+    assert len(set(pipelines.requested)) == len(pipelines.requested) == loaded
+    assert len(checkpointed(datalake)) == loaded
+
+
+def test_backfill_failed_partition_writes_no_checkpoints(datalake, pipelines):
+    # Le 2024-01-03 échoue pour timemachine : la partition s'arrête là
+    pipelines.failing.add(('timemachine', '2024-01-03'))
+    runner = BackfillRunner(DATES, jobs, cities=CITIES, partition_size=2, max_workers=2)
+
+    with pytest.raises(RuntimeError, match="1 backfill partitions failed"):
+        runner.run()
+
+    dates = {checkpoint['date'] for checkpoint in datalake.checkpoints
+             if checkpoint['job'] == 'timemachine'}
+    assert dates == {'2024-01-01', '2024-01-02', '2024-01-05'}
+    assert not any(checkpoint['date'] == '2024-01-04' for checkpoint in datalake.checkpoints)
+
+
+def test_backfill_rerun_only_fetches_missing_combinations(datalake, pipelines):
+    # Une ville était déjà chargée avant le premier run
+    datalake.checkpoints.append({'_id': BackfillRunner.checkpoint_id('day_summary', '2024-01-04',
+                                                                     CITIES[0])})
+    pipelines.failing.add(('timemachine', '2024-01-03'))
+    with pytest.raises(RuntimeError):
+        BackfillRunner(DATES, jobs, cities=CITIES, partition_size=2, max_workers=2).run()
+    first_run = set(pipelines.requested)
+
+    pipelines.failing.clear()
+    pipelines.requested.clear()
+    loaded = BackfillRunner(DATES, jobs, cities=CITIES, partition_size=2, max_workers=2).run()
+
+    # Seules la combinaison en échec et la fin de sa partition sont redemandées
+    expected = {('timemachine', '2024-01-03', city['lat']) for city in CITIES} | \
+        {(job, '2024-01-04', city['lat']) for job in JOBS for city in CITIES} - \
+        {('day_summary', '2024-01-04', CITIES[0]['lat'])}
+    assert set(pipelines.requested) == expected
+    assert loaded == len(expected)
+    assert ('day_summary', '2024-01-04', CITIES[0]['lat']) not in first_run
+    assert len(checkpointed(datalake)) == len(DATES) * len(JOBS) * len(CITIES)
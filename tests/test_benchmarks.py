@@ -0,0 +1,50 @@
+import pytest
+import requests
+
+from benchmarks.fake_openweather import FakeOpenWeatherServer
+from benchmarks.run_benchmarks import build_cities, run_in_subprocess
+
+
+def test_fake_openweather_server_serves_requested_city():
+    with FakeOpenWeatherServer() as server:
+        response = requests.get(f"{server.base_url}data/2.5/air_pollution/history",
+                                params={'lat': -33.5, 'lon': 151.25,
+                                        'start': 0, 'end': 24 * 3600})
+        served = requests.get(f"{server.base_url}_requests").json()
+
+    data = response.json()
+    assert data['coord'] == {'lat': -33.5, 'lon': 151.25}
+    # Une entrée par heure entre start et end
+    assert [entry['dt'] for entry in data['list']] == list(range(0, 24 * 3600, 3600))
+    assert [request[1:3] for request in served] == [[-33.5, 151.25]]
+
+
+def test_build_cities_unique_coordinates():
+    cities = build_cities(1000)
+
+    assert len({city['lat'] for city in cities}) == 1000
+    assert build_cities(1000) == cities
+
+
+def test_benchmark_scenario_end_to_end():
+    scenario = {'extractor': 'air_pollution_history', 'mode': 'streaming_columnar',
+                'cities': 5, 'history_days': 1}
+    with FakeOpenWeatherServer() as server:
+        result = run_in_subprocess(scenario, server.base_url, timeout=120)
+
+    assert 'error' not in result, result
+    assert result['requests'] == 5
+    assert result['records'] == 5 * 24
+    assert result['latency_p50_ms'] <= result['latency_p99_ms']
+    assert result['peak_rss_mb'] > 0
+
+
+@pytest.mark.parametrize('mode', ['by_record', 'batched'])
+def test_benchmark_daily_weather_modes(mode):
+    # Le résumé journalier se charge ligne à ligne comme en groupe
+    scenario = {'extractor': 'daily_weather', 'mode': mode, 'cities': 3, 'history_days': 1}
+    with FakeOpenWeatherServer() as server:
+        result = run_in_subprocess(scenario, server.base_url, timeout=120)
+
+    assert 'error' not in result, result
+    assert result['records'] == 3
@@ -0,0 +1,72 @@
+import os
+import time
+
+from utils.cache_functools import PageCache, ResponseCache
+
+HISTORY_URL = ("https://api.openweathermap.org/data/2.5/air_pollution/history?"
+               "appid=secret&lang=en&lat=-33.87&lon=151.21&start=1&end=2")
+
+
+def test_response_cache_ignores_api_key_and_param_order(tmp_path):
+    # La clé du cache ne dépend ni de la clé d'API ni de l'ordre des paramètres
+    cache = ResponseCache(tmp_path)
+    cache.put(HISTORY_URL, {'list': []})
+
+    other_url = ("https://api.openweathermap.org/data/2.5/air_pollution/history?"
+                 "end=2&start=1&lon=151.21&lat=-33.87&lang=en&appid=other")
+    assert cache.get(other_url) == {'list': []}
+    assert cache.stats()['hits'] == 1
+    assert "secret" not in cache.normalize_url(HISTORY_URL)
+
+
+def test_response_cache_ttl_per_endpoint(tmp_path, monkeypatch):
+    # L'historique n'expire jamais, la météo courante expire
+    cache = ResponseCache(tmp_path, ttls={'air_pollution/history': None, '2.5/weather': 60})
+    current_url = "https://api.openweathermap.org/data/2.5/weather?lat=1&lon=2"
+    cache.put(HISTORY_URL, {'list': []})
+    cache.put(current_url, {'main': {}})
+
+    later = time.time() + 3600
+    monkeypatch.setattr('utils.cache_functools.time.time', lambda: later)
+    assert cache.get(HISTORY_URL) == {'list': []}
+    assert cache.get(current_url) is None
+
+
+def test_response_cache_skips_unknown_endpoints(tmp_path):
+    cache = ResponseCache(tmp_path)
+    url = "https://api.openweathermap.org/data/3.0/onecall?lat=1&lon=2"
+    cache.put(url, {'current': {}})
+
+    assert cache.get(url) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    # Les entrées les moins récemment utilisées sont supprimées en premier
+    cache = ResponseCache(tmp_path, max_size=10 ** 9)
+    urls = [HISTORY_URL.replace("start=1", f"start={i}") for i in range(3)]
+    for i, url in enumerate(urls):
+        cache.put(url, {'list': ['x' * 200]})
+        os.utime(cache.path(url), (1000 + i, 1000 + i))
+    cache.get(urls[0])
+
+    cache.max_size = cache.size - 1
+    cache.evict()
+
+    assert cache.evictions == 1
+    assert not cache.path(urls[1]).exists()
+    assert cache.path(urls[0]).exists()
+
+
+def test_page_cache_round_trip(tmp_path):
+    cache = PageCache(tmp_path)
+    url = "https://reg.bom.gov.au/climate/dwo/202304/html/IDCJDW2124.202304.shtml"
+    assert cache.get(url) is None
+
+    cache.put(url, b"<html></html>", etag='"abc"', permanent=True)
+    content, metadata = cache.get(url)
+
+    assert content == b"<html></html>"
+    assert metadata['permanent']
+    # Seuls les validateurs connus sont envoyés
+    assert cache.validators(metadata) == {'If-None-Match': '"abc"'}
@@ -0,0 +1,67 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from database.models import City
+from preparation import data_from_kaggle
+from preparation.data_from_kaggle import KAGGLE_COLUMNS, ingest_kaggle, iter_kaggle
+
+ROWS = [('2023-04-01', 'Sydney', '16.2', 'NE', 'W'),
+        ('2023-04-01', 'Albury', '10.1', 'N', 'S'),
+        ('2023-04-01', 'Brisbane', '18.0', 'NA', 'E'),
+        ('2023-04-02', 'Sydney', 'NA', 'S', 'Calm'),
+        ('2023-04-02', 'Albury', '9.7', 'N', 'N')]
+
+
+@pytest.fixture
+def kaggle_dir(tmp_path):
+    """Fixture écrivant un extrait de weatherAUS.csv, avec les colonnes ignorées."""
+    columns = list(KAGGLE_COLUMNS) + ['RainToday', 'RainTomorrow']
+    lines = [','.join(columns)]
+    for date, location, min_temp, wind_gust_dir, wind_dir in ROWS:
+        values = {'Date': date, 'Location': location, 'MinTemp': min_temp,
+                  'WindGustDir': wind_gust_dir, 'WindDir9am': wind_dir, 'RainToday': 'No'}
+        lines.append(','.join(values.get(column, '1') for column in columns))
+    (tmp_path / 'data' / 'csv').mkdir(parents=True)
+    (tmp_path / 'data' / 'csv' / 'weatherAUS.csv').write_text('\n'.join(lines) + '\n')
+    return tmp_path
+
+
+def test_iter_kaggle_filters_each_chunk(kaggle_dir):
+    chunks = list(iter_kaggle(['Sydney', 'Brisbane'], kaggle_dir, chunksize=2))
+
+    # Le dernier bloc ne contient qu'une ligne d'Albury
+    assert [len(chunk) for chunk in chunks] == [1, 2]
+    assert chunks[0]['min_temp'].dtype == 'float32'
+    assert chunks[0]['wind_gust_dir'].dtype == 'category'
+    df = pd.concat(chunks, ignore_index=True)
+    assert list(df.columns) == list(KAGGLE_COLUMNS.values())
+    assert df['location'].astype(str).tolist() == ['Sydney', 'Brisbane City', 'Sydney']
+    assert df['min_temp'].isna().tolist() == [False, False, True]
+    assert df['wind_gust_dir'].isna().tolist() == [False, True, False]
+
+
+def test_ingest_kaggle_loads_each_chunk(kaggle_dir, sqlite_postgres_manager, mocker):
+    sqlite_postgres_manager.add_records(City, [
+        {'id': 1, 'name': 'Sydney', 'latitude': -33.87, 'longitude': 151.21},
+        {'id': 2, 'name': 'Brisbane City', 'latitude': -27.47, 'longitude': 153.03}])
+    copy_dataframe = mocker.patch.object(data_from_kaggle, 'copy_dataframe',
+                                         side_effect=lambda engine, frames, table, staging:
+                                         len(frames) if table == 'daily_weather'
+                                         else sum(map(len, frames)))
+
+    refresh = mocker.patch.object(sqlite_postgres_manager,
+                                  'refresh_australian_meteorology_weather')
+
+    counts = ingest_kaggle(['Sydney', 'Brisbane'], kaggle_dir, sqlite_postgres_manager,
+                           chunksize=2)
+
+    assert counts == (3, 6)
+    # Un chargement par bloc et par table
+    assert [call.args[2] for call in copy_dataframe.call_args_list] == \
+        ['daily_weather', 'weather', 'daily_weather', 'weather']
+    daily_weather = copy_dataframe.call_args_list[2].args[1]
+    assert daily_weather['city_id'].tolist() == [2, 1]
+    # Seules les lignes du bloc sont recalculées
+    assert refresh.call_args_list[1].args[0] == {(2, date(2023, 4, 1)), (1, date(2023, 4, 2))}
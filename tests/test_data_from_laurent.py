@@ -0,0 +1,68 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+
+from benchmarks.fake_openweather import PAYLOADS_DIR
+from database.models import City
+from preparation import data_from_Laurent
+from preparation.data_from_Laurent import load_dump
+
+
+@pytest.fixture
+def dump_dir(tmp_path):
+    """Fixture écrivant les deux exports JSON lines, une ligne par ville et par jour."""
+    (tmp_path / 'data' / 'json').mkdir(parents=True)
+    for name, payload_name in [('dataDailyAggregation.json', 'day_summary.json'),
+                               ('dataWeatherTimeStamp.json', 'timemachine.json')]:
+        payload = json.loads((PAYLOADS_DIR / payload_name).read_text(encoding='utf-8'))
+        lines = [json.dumps({**payload, 'lat': lat, 'lon': lon})
+                 for lat, lon in [(-33.9, 151.2), (-12.5, 130.8)] * 5]
+        (tmp_path / 'data' / 'json' / name).write_text('\n'.join(lines) + '\n')
+    return tmp_path
+
+
+@pytest.fixture
+def stores(sqlite_postgres_manager, mocker):
+    """Fixture branchant le chargeur sur SQLite pour les villes et des mocks ailleurs."""
+    sqlite_postgres_manager.add_records(City, [
+        {'id': 1, 'name': 'Sydney', 'latitude': -33.87, 'longitude': 151.21},
+        {'id': 2, 'name': 'Darwin', 'latitude': -12.46, 'longitude': 130.84}])
+    mocker.patch.object(sqlite_postgres_manager, 'refresh_australian_meteorology_weather')
+    mongo = MagicMock()
+    mongo.insert_documents.side_effect = lambda collection, documents, batch_size: len(documents)
+    mocker.patch.object(data_from_Laurent, 'get_mongo_manager', return_value=mongo)
+    mocker.patch.object(data_from_Laurent, 'get_postgres_manager',
+                        return_value=sqlite_postgres_manager)
+    copy_dataframe = mocker.patch.object(
+        data_from_Laurent, 'copy_dataframe',
+        side_effect=lambda engine, rows, table, chunk_size, staging: len(rows))
+    return mongo, copy_dataframe
+
+
+def test_load_dump_in_batches(dump_dir, stores):
+    mongo, copy_dataframe = stores
+
+    assert load_dump('daily_weather', dump_dir, workers=1, batch_size=4) == (10, 10)
+
+    # Lots de 4 documents, les villes résolues en mémoire
+    assert [len(call.args[1]) for call in mongo.insert_documents.call_args_list] == [4, 4, 2]
+    assert {call.args[0] for call in mongo.insert_documents.call_args_list} == {'daily_weather'}
+    rows = copy_dataframe.call_args_list[0].args[1]
+    assert rows['city_id'].tolist() == [1, 2, 1, 2]
+    assert copy_dataframe.call_args_list[0].args[2] == 'daily_weather'
+
+
+def test_load_dump_by_byte_ranges(dump_dir, stores, mocker):
+    mongo, copy_dataframe = stores
+    # Des threads à la place des processus, pour partager les mocks
+    mocker.patch.object(data_from_Laurent, 'ProcessPoolExecutor',
+                        lambda max_workers, mp_context: ThreadPoolExecutor(max_workers))
+    load_dump_range = mocker.spy(data_from_Laurent, 'load_dump_range')
+
+    assert load_dump('timestamp_weather', dump_dir, workers=3) == (10, 10)
+
+    # Chaque plage d'octets commence au début d'une ligne
+    assert load_dump_range.call_count == 3
+    assert {call.args[2] for call in copy_dataframe.call_args_list} == {'weather'}
@@ -0,0 +1,121 @@
+from datetime import date, datetime
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from preparation import data_to_csv
+from database.models import City, DailyWeather, Weather
+from preparation.data_to_csv import STUDY_COLUMNS, add_rain_columns, export_weather_study, \
+    read_weather_study
+
+
+def study_rows(location, dates, rainfall):
+    rows = pd.DataFrame({column: np.nan for column in STUDY_COLUMNS}, index=range(len(dates)))
+    return rows.assign(date=pd.to_datetime(dates).date, location=location, rainfall=rainfall)
+
+
+@pytest.fixture
+def warehouse_rows():
+    return pd.concat([study_rows('Darwin', ['2024-01-01', '2024-01-02', '2024-01-03'],
+                                 [0.0, 5.2, 0.4]),
+                      study_rows('Sydney', ['2024-01-01', '2024-01-02'], [1.0, np.nan])],
+                     ignore_index=True)
+
+
+def test_read_weather_study_fetches_chunks():
+    engine = MagicMock()
+    connection = engine.connect.return_value.__enter__.return_value
+    result = connection.execution_options.return_value.execute.return_value
+    result.keys.return_value = ['date', 'location']
+    rows = [(date(2024, 1, day), 'Darwin') for day in range(1, 6)]
+    result.fetchmany.side_effect = [rows[:2], rows[2:4], rows[4:], []]
+
+    chunks = list(read_weather_study(engine, {'Darwin': '2023-12-31'}, chunksize=2))
+
+    # Les lignes sont lues par paquets à travers un curseur côté serveur
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert list(chunks[0].columns) == ['date', 'location']
+    connection.execution_options.assert_called_once_with(stream_results=True)
+    assert connection.execution_options.return_value.execute.call_args.args[1] == \
+        {'locations': ['Darwin'], 'dates': ['2023-12-31']}
+    result.fetchmany.assert_called_with(2)
+
+
+def test_read_weather_study_on_postgres(postgres_manager):
+    postgres_manager.add_records(City, [{'id': i + 1, 'name': name, 'latitude': -12.0 - i,
+                                         'longitude': 130.0 + i}
+                                        for i, name in enumerate(['Darwin', 'Sydney'])])
+    postgres_manager.add_records(DailyWeather, [{'date': date(2024, 1, day), 'rainfall': 1.0,
+                                                 'city_id': city_id}
+                                                for city_id in (1, 2) for day in (1, 2, 3)])
+    postgres_manager.add_records(Weather, [{'date': datetime(2024, 1, 1, 9), 'temp': 25.0,
+                                            'city_id': 1}])
+    postgres_manager.refresh_australian_meteorology_weather()
+
+    chunks = list(read_weather_study(postgres_manager.engine, {}, chunksize=4))
+    # Seules les lignes postérieures au dernier export de chaque ville sont lues
+    newer = pd.concat(read_weather_study(postgres_manager.engine,
+                                         {'Darwin': '2024-01-02', 'Sydney': '2024-01-01'}))
+
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+    assert list(chunks[0].columns) == STUDY_COLUMNS
+    assert chunks[0]['temp_9am'].iloc[0] == 25.0
+    assert pd.isna(chunks[0]['temp_9am'].iloc[1])
+    assert list(zip(newer['location'], newer['date'])) == [
+        ('Darwin', date(2024, 1, 3)), ('Sydney', date(2024, 1, 2)), ('Sydney', date(2024, 1, 3))]
+
+
+def test_add_rain_columns_carries_rows_across_chunks(warehouse_rows):
+    whole, _ = add_rain_columns(warehouse_rows)
+
+    ready, carry = [], None
+    for start in range(0, len(warehouse_rows), 2):
+        chunk_ready, carry = add_rain_columns(warehouse_rows.iloc[start:start + 2], carry)
+        ready.append(chunk_ready)
+    chunked = pd.concat(ready, ignore_index=True)
+
+    pd.testing.assert_frame_equal(chunked, whole.reset_index(drop=True))
+    # Le dernier jour de chaque ville attend le lendemain
+    assert list(zip(whole['location'], whole['rain_today'], whole['rain_tomorrow'])) == \
+        [('Darwin', 'no', 'yes'), ('Darwin', 'yes', 'no'), ('Sydney', 'yes', 'no')]
+
+
+def test_export_weather_study_appends_new_rows(warehouse_rows, tmp_path, mocker):
+    path = tmp_path / 'weather_study.csv'
+    read = mocker.patch.object(data_to_csv, 'read_weather_study',
+                               return_value=[warehouse_rows.iloc[:3], warehouse_rows.iloc[3:]])
+
+    assert export_weather_study(None, path) == 3
+    assert read.call_args.args[1] == {}
+
+    # Export incrémental : seules les lignes postérieures au fichier sont lues
+    new_rows = pd.concat([warehouse_rows.iloc[[2]], study_rows('Darwin', ['2024-01-04'], [0.0]),
+                          warehouse_rows.iloc[[4]], study_rows('Sydney', ['2024-01-03'], [2.0])],
+                         ignore_index=True)
+    read.return_value = [new_rows]
+
+    assert export_weather_study(None, path, incremental=True) == 2
+    assert read.call_args.args[1] == {'Darwin': '2024-01-02', 'Sydney': '2024-01-01'}
+
+    df = pd.read_csv(path)
+    assert list(df.columns) == STUDY_COLUMNS + ['rain_today', 'rain_tomorrow']
+    assert list(zip(df['location'], df['date'], df['rain_tomorrow'])) == [
+        ('Darwin', '2024-01-01', 'yes'), ('Darwin', '2024-01-02', 'no'),
+        ('Sydney', '2024-01-01', 'no'),
+        ('Darwin', '2024-01-03', 'no'), ('Sydney', '2024-01-02', 'yes')]
+    assert not (tmp_path / 'weather_study.csv.tmp').exists()
+
+
+def test_export_weather_study_writes_parquet_dataset(warehouse_rows, tmp_path, mocker):
+    pytest.importorskip('pyarrow')
+    from utils.parquet_functools import load_dataset
+    mocker.patch.object(data_to_csv, 'read_weather_study', return_value=[warehouse_rows])
+
+    export_weather_study(None, tmp_path / 'weather_study.csv', parquet_dir=tmp_path / 'parquet')
+
+    # Une partition par ville et par année, sans recharger le CSV
+    df = load_dataset(tmp_path / 'parquet', filters=[('location', '=', 'Darwin')])
+    assert df['rain_tomorrow'].astype(str).tolist() == ['yes', 'no']
+    assert not (tmp_path / 'parquet.tmp').exists()
@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+from database.models import City
+from utils.df_to_kaggle_format import transform_to_kaggle_format
+
+
+@pytest.fixture
+def kaggle_df():
+    return pd.DataFrame({
+        'date': ['2023-04-01', '2023-04-02', '2023-04-01'],
+        'location': ['Sydney', 'Sydney', 'Darwin'],
+        'min_temp': [16.2, 15.5, 24.0], 'max_temp': [24.1, 22.7, 32.5],
+        'rainfall': [0.0, 1.4, 0.0], 'evaporation': [4.2, None, 6.0],
+        'sunshine': [9.8, 6.1, 10.2], 'wind_gust_dir': ['NE', 'S', 'W'],
+        'wind_gust_speed': [35, 41, 30],
+        'temp_9am': [19.0, 17.8, 27.1], 'temp_3pm': [22.8, 21.4, 31.0],
+        'humidity_9am': [71, 80, 60], 'humidity_3pm': [55, 66, 40],
+        'pressure_9am': [1021.3, 1020.1, 1010.0], 'pressure_3pm': [1018.4, 1019.0, 1008.2],
+        'cloud_9am': [2, 7, 1], 'cloud_3pm': [1, 6, 3],
+        'wind_dir_9am': ['W', 'Calm', 'E'], 'wind_dir_3pm': ['NE', 'SSE', 'NW'],
+        'wind_speed_9am': [9, -1, 11], 'wind_speed_3pm': [20, 24, 15],
+    })
+
+
+@pytest.fixture
+def postgres(sqlite_postgres_manager):
+    sqlite_postgres_manager.add_records(City, [
+        {'id': 1, 'name': 'Sydney', 'latitude': -33.87, 'longitude': 151.21},
+        {'id': 2, 'name': 'Darwin', 'latitude': -12.46, 'longitude': 130.84}])
+    return sqlite_postgres_manager
+
+
+def test_transform_to_kaggle_format(kaggle_df, postgres):
+    daily_weather, weather_9am, weather_3pm = transform_to_kaggle_format(kaggle_df, postgres)
+
+    assert daily_weather['city_id'].tolist() == [1, 1, 2]
+    assert daily_weather['date'].tolist() == list(pd.to_datetime(
+        ['2023-04-01', '2023-04-02', '2023-04-01']))
+    # Les relevés de 9h et 15h sont datés à l'heure près
+    assert weather_9am['date'].tolist() == list(pd.to_datetime(
+        ['2023-04-01 09:00', '2023-04-02 09:00', '2023-04-01 09:00']))
+    assert weather_3pm['date'].iloc[0] == pd.Timestamp('2023-04-01 15:00')
+    assert weather_9am['wind_dir'].tolist() == ['W', 'Calm', 'E']
+    assert weather_3pm['temp'].tolist() == [22.8, 21.4, 31.0]
+    # Le DataFrame d'origine n'est pas modifié
+    assert 'city_id' not in kaggle_df
+
+
+def test_transform_to_kaggle_format_unknown_location(kaggle_df, postgres):
+    kaggle_df.loc[2, 'location'] = 'Atlantis'
+
+    with pytest.raises(ValueError, match="Atlantis"):
+        transform_to_kaggle_format(kaggle_df, postgres)
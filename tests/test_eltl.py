@@ -0,0 +1,160 @@
+import threading
+import time
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+
+import utils.ELTL as ELTL
+from database.models import City, DailyWeather
+from utils.ELTL import OpenWeatherAPI, OpenWeatherByCities, OpenWeatherCurrentWeather, \
+    OpenWeatherDailyAirPollution, OpenWeatherDailyWeather, SharedResource
+from utils.json_functools import load_from_json
+
+CITIES = [{'lat': -33.87, 'lon': 151.21}, {'lat': -37.81, 'lon': 144.96},
+          {'lat': -27.47, 'lon': 153.03}]
+
+
+def history_payload(lat, lon, hours=3):
+    return {'coord': {'lat': lat, 'lon': lon},
+            'list': [{'dt': 1704067200 + 3600 * hour, 'main': {'aqi': 1 + hour},
+                      'components': {'co': 200.5 + hour, 'no': 0.1, 'no2': 2.0, 'o3': 40.0,
+                                     'so2': 1.0, 'pm2_5': 1.5, 'pm10': 2.5, 'nh3': 0.2}}
+                     for hour in range(hours)]}
+
+
+@pytest.fixture
+def warehouse(sqlite_postgres_manager, monkeypatch):
+    """Fixture qui branche les extracteurs sur une base SQLite contenant trois villes."""
+    sqlite_postgres_manager.add_records(City, [
+        {'id': i + 1, 'name': f"city-{i}", 'latitude': city['lat'], 'longitude': city['lon']}
+        for i, city in enumerate(CITIES)])
+    monkeypatch.setattr(OpenWeatherAPI, 'data_warehouse_manager', sqlite_postgres_manager)
+    monkeypatch.setattr(OpenWeatherAPI, 'response_cache', None)
+    monkeypatch.setattr(OpenWeatherByCities, 'city_index', None)
+    return sqlite_postgres_manager
+
+
+def test_managers_are_created_lazily():
+    # L'import du module ne doit ouvrir aucune connexion
+    assert isinstance(OpenWeatherAPI.__dict__['datalake_manager'], SharedResource)
+    assert isinstance(OpenWeatherAPI.__dict__['data_warehouse_manager'], SharedResource)
+
+
+def test_iter_request_many_keeps_order(warehouse, monkeypatch):
+    in_flight, max_in_flight = [0], [0]
+    lock = threading.Lock()
+
+    def fake_request_api(url, cache=None):
+        with lock:
+            in_flight[0] += 1
+            max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        # Les premières requêtes répondent le plus tard
+        index = int(url.split('index=')[1])
+        time.sleep(0.01 * (10 - index))
+        with lock:
+            in_flight[0] -= 1
+        return {'index': index}
+
+    monkeypatch.setattr(ELTL, 'request_api', fake_request_api)
+    manager = OpenWeatherDailyAirPollution(0, 3600, cities=[])
+
+    responses = list(manager.iter_request_many(({'index': i} for i in range(10)),
+                                               max_workers=3))
+
+    assert [response['index'] for response in responses] == list(range(10))
+    assert max_in_flight[0] <= 3
+
+
+def test_extract_data_keeps_city_order(monkeypatch):
+    requested = []
+
+    def fake_request_api(url, cache=None):
+        # La première ville répond en dernier
+        lat = float(url.split('lat=')[1].split('&')[0])
+        time.sleep(0.05 if lat == CITIES[0]['lat'] else 0)
+        requested.append(lat)
+        return {'lat': lat}
+
+    monkeypatch.setattr(ELTL, 'request_api', fake_request_api)
+    monkeypatch.setattr(OpenWeatherAPI, 'response_cache', None)
+    manager = OpenWeatherCurrentWeather(cities=CITIES)
+
+    data = manager.extract_data()
+
+    assert [response['lat'] for response in data] == [city['lat'] for city in CITIES]
+    assert requested[-1] == CITIES[0]['lat']
+    # Chaque requête a ses propres paramètres, ceux de l'extracteur ne changent pas
+    assert 'lat' not in manager.params and 'lon' not in manager.params
+
+
+def test_transform_data_frame_matches_transform_data(warehouse):
+    manager = OpenWeatherDailyAirPollution(0, 3600, cities=[])
+    payload = history_payload(-37.81, 144.96)
+
+    frame = manager.transform_data_frame(payload)
+    expected = pd.DataFrame(manager.transform_data(payload))
+    expected['date'] = pd.to_datetime(expected['date'])
+
+    pd.testing.assert_frame_equal(frame[list(expected.columns)], expected, check_dtype=False)
+    assert (frame['city_id'] == 2).all()
+
+
+def test_daily_weather_transform_matches_table(warehouse):
+    manager = OpenWeatherDailyWeather('2024-01-01', cities=[])
+    payload = load_from_json(str(OpenWeatherAPI.root_path / 'benchmarks' / 'payloads'
+                                 / 'day_summary.json'))
+
+    row = manager.transform_data(payload)
+
+    # Chaque champ a une colonne, sinon add_record et add_records le refusent
+    assert set(row) <= set(DailyWeather.__table__.columns.keys())
+    assert row['city_id'] == 1
+
+
+def test_load_many_to_data_warehouse_copies_frames(mocker):
+    warehouse = mocker.MagicMock()
+    mocker.patch.object(OpenWeatherAPI, 'data_warehouse_manager', warehouse)
+    manager = OpenWeatherDailyAirPollution(0, 3600, cities=[])
+    frame = pd.DataFrame({'date': pd.to_datetime([1704067200], unit='s'), 'city_id': [1]})
+
+    manager.load_many_to_data_warehouse(frame, batch_size=500)
+    manager.load_many_to_data_warehouse([{'date': datetime(2024, 1, 1), 'city_id': 1}])
+
+    # Les DataFrames passent par COPY, les listes par des INSERT qui ignorent les doublons
+    warehouse.copy_frame.assert_called_once_with(manager.table_name, frame, 500)
+    warehouse.add_frame.assert_not_called()
+    assert warehouse.add_records.call_args.kwargs == {'skip_existing': True}
+
+
+def test_incremental_city_params_skip_up_to_date_cities(warehouse):
+    end = int(datetime(2024, 1, 2).timestamp())
+    manager = OpenWeatherDailyAirPollution(end - 86400, end, cities=CITIES, incremental=True)
+    endpoint = manager.endpoint
+    # La première ville est à jour, la deuxième à moitié chargée, la troisième jamais chargée
+    warehouse.update_watermarks(endpoint, {1: datetime.utcfromtimestamp(end),
+                                           2: datetime.utcfromtimestamp(end - 3600)})
+
+    params = manager.city_params()
+
+    assert [(p['lat'], p['start']) for p in params] == [(-37.81, end - 3599),
+                                                       (-27.47, end - 86400)]
+    assert set(manager.pending_watermarks) == {2, 3}
+
+
+def test_refresh_data_warehouse_recomputes_loaded_partitions(warehouse, mocker):
+    refresh = mocker.patch.object(warehouse, 'refresh_australian_meteorology_weather',
+                                  return_value=2)
+    daily_weather = OpenWeatherDailyWeather('2024-01-01', cities=[])
+    air_pollution = OpenWeatherDailyAirPollution(1704067200, 1704078000, cities=[])
+
+    daily_weather.track_partitions([{'date': '2024-01-01', 'city_id': 1},
+                                    {'date': '2024-01-01', 'city_id': 2}])
+    air_pollution.track_partitions([{'date': datetime(2024, 1, 1), 'city_id': 1}])
+
+    assert daily_weather.refresh_data_warehouse() == 2
+    refresh.assert_called_once_with({(1, date(2024, 1, 1)), (2, date(2024, 1, 1))})
+    # La pollution ne fait pas partie de la table, et rien n'est recalculé deux fois
+    assert air_pollution.refresh_data_warehouse() == 0
+    assert daily_weather.refresh_data_warehouse() == 0
+    refresh.assert_called_once()
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils.geo_functools import CityIndex, haversine_distance
+
+CITIES = [
+    SimpleNamespace(id=1, name="Canberra", latitude=-35.2975906, longitude=149.1012676),
+    SimpleNamespace(id=2, name="Sydney", latitude=-33.8698439, longitude=151.2082848),
+    SimpleNamespace(id=3, name="Darwin", latitude=-12.46044, longitude=130.8410469),
+    SimpleNamespace(id=4, name="Melbourne", latitude=-37.8142176, longitude=144.9631608),
+    SimpleNamespace(id=5, name="Brisbane City", latitude=-27.4689682, longitude=153.0234991),
+]
+
+
+def test_haversine_distance():
+    # Distance Sydney - Melbourne, environ 713 km
+    distance = haversine_distance(-33.8698439, 151.2082848, -37.8142176, 144.9631608)
+    assert distance == pytest.approx(713, abs=2)
+
+
+def test_city_index_nearest():
+    # Les coordonnées renvoyées par l'API sont arrondies
+    index = CityIndex(lambda: CITIES)
+    assert index.nearest(-33.87, 151.21) == 2
+    assert index.nearest(-12.46, 130.84) == 3
+
+
+def test_city_index_nearest_many():
+    # Recherche vectorisée pour plusieurs coordonnées à la fois
+    index = CityIndex(lambda: CITIES, chunk_size=2)
+    city_ids = index.nearest_many([-35.3, -37.81, -27.47], [149.1, 144.96, 153.02])
+    assert list(city_ids) == [1, 4, 5]
+
+
+def test_city_index_refresh():
+    # Le rechargement prend en compte les nouvelles villes
+    cities = CITIES[:1]
+    index = CityIndex(lambda: cities)
+    assert index.nearest(-33.87, 151.21) == 1
+
+    cities = CITIES
+    index.refresh()
+    assert len(index) == 5
+    assert index.nearest(-33.87, 151.21) == 2
+
+
+def test_city_index_empty():
+    index = CityIndex(lambda: [])
+    with pytest.raises(LookupError):
+        index.nearest(-33.87, 151.21)
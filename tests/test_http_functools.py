@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+import requests
+from unittest.mock import MagicMock, patch
+
+from utils.http_functools import HostThrottle, HttpClient
+
+
+def make_response(status_code, headers=None):
+    response = MagicMock(status_code=status_code)
+    response.headers = headers or {}
+    return response
+
+
+@patch('utils.http_functools.time.sleep')
+def test_http_client_retries_server_errors(mock_sleep):
+    # Une erreur 502 est retentée puis la réponse 200 est renvoyée
+    client = HttpClient(max_retries=3)
+    client.session.get = MagicMock(side_effect=[make_response(502), make_response(200)])
+
+    response = client.get("https://example.com")
+
+    assert response.status_code == 200
+    assert client.session.get.call_count == 2
+    mock_sleep.assert_called_once()
+
+
+@patch('utils.http_functools.time.sleep')
+def test_http_client_honors_retry_after(mock_sleep):
+    # Le délai demandé par le serveur est respecté
+    client = HttpClient(max_retries=3)
+    client.session.get = MagicMock(side_effect=[make_response(429, {'Retry-After': '7'}),
+                                                make_response(200)])
+
+    client.get("https://example.com")
+
+    mock_sleep.assert_called_once_with(7.0)
+
+
+@patch('utils.http_functools.time.sleep')
+def test_http_client_returns_last_response_after_retries(mock_sleep):
+    # Après le dernier essai, la réponse en erreur est renvoyée à l'appelant
+    client = HttpClient(max_retries=2)
+    client.session.get = MagicMock(return_value=make_response(503))
+
+    response = client.get("https://example.com")
+
+    assert response.status_code == 503
+    assert client.session.get.call_count == 3
+    assert mock_sleep.call_count == 2
+
+
+@patch('utils.http_functools.time.sleep')
+def test_http_client_raises_connection_errors(mock_sleep):
+    # Les erreurs de connexion sont retentées puis relevées
+    client = HttpClient(max_retries=1)
+    client.session.get = MagicMock(side_effect=requests.ConnectionError)
+
+    with pytest.raises(requests.ConnectionError):
+        client.get("https://example.com")
+    assert client.session.get.call_count == 2
+
+
+def test_http_client_passes_timeouts():
+    # Les délais de connexion et de lecture sont transmis à la session
+    client = HttpClient(connect_timeout=2, read_timeout=15)
+    client.session.get = MagicMock(return_value=make_response(200))
+
+    client.get("https://example.com")
+
+    client.session.get.assert_called_once_with("https://example.com", timeout=(2, 15))
+
+
+def test_host_throttle_limits_requests_per_host():
+    # Au plus deux requêtes simultanées par hôte, les autres hôtes ne sont pas bloqués
+    throttle = HostThrottle(max_concurrent=2)
+    in_flight = {'a.com': 0, 'b.com': 0}
+    peaks = {'a.com': 0, 'b.com': 0}
+    lock = threading.Lock()
+
+    def request(host):
+        with throttle(f"https://{host}/page"):
+            with lock:
+                in_flight[host] += 1
+                peaks[host] = max(peaks[host], in_flight[host])
+            time.sleep(0.02)
+            with lock:
+                in_flight[host] -= 1
+
+    threads = [threading.Thread(target=request, args=(host,))
+               for host in ['a.com', 'b.com'] * 5]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peaks == {'a.com': 2, 'b.com': 2}
+
+
+@patch('utils.http_functools.time.sleep')
+def test_host_throttle_spaces_requests(mock_sleep):
+    throttle = HostThrottle(max_concurrent=4, min_interval=1.0)
+
+    for _ in range(3):
+        with throttle("https://a.com/page"):
+            pass
+
+    delays = [call.args[0] for call in mock_sleep.call_args_list]
+    assert len(delays) == 2
+    assert delays[1] > delays[0] > 0.9
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from utils import jsonl_functools
+from utils.jsonl_functools import iter_batches, split_offsets
+
+
+@pytest.fixture
+def jsonl_file(tmp_path):
+    """Fixture écrivant un fichier JSON lines aux lignes de longueurs variées."""
+    path = tmp_path / 'dump.json'
+    path.write_text(''.join(json.dumps({'i': i, 'text': 'x' * (i * 7 % 50)}) + '\n'
+                            for i in range(100)))
+    return str(path)
+
+
+@pytest.mark.parametrize('parts', [1, 3, 7, 100, 500])
+def test_split_offsets_cover_each_line_once(jsonl_file, parts):
+    ranges = split_offsets(jsonl_file, parts)
+
+    assert len(ranges) <= parts
+    documents = [document for start, end in ranges
+                 for batch in iter_batches(jsonl_file, start, end, batch_size=8)
+                 for document in batch]
+    assert [document['i'] for document in documents] == list(range(100))
+
+
+def test_iter_batches(jsonl_file):
+    batches = list(iter_batches(jsonl_file, batch_size=30))
+
+    assert [len(batch) for batch in batches] == [30, 30, 30, 10]
+
+
+def test_iter_batches_without_orjson(jsonl_file, monkeypatch):
+    # Repli sur le module json de la bibliothèque standard
+    monkeypatch.setattr(jsonl_functools, 'loads', json.loads)
+
+    assert next(iter_batches(jsonl_file, batch_size=2)) == [{'i': 0, 'text': ''},
+                                                            {'i': 1, 'text': 'x' * 7}]
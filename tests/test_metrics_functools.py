@@ -0,0 +1,103 @@
+import json
+import threading
+
+import pytest
+
+from utils.metrics_functools import Histogram, MetricsRegistry
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(0.1, 1.0, 10.0))
+    for value in [0.05] * 98 + [5.0, 50.0]:
+        histogram.observe(value)
+
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.99) == 10.0
+    assert histogram.quantile(1.0) == float('inf')
+    assert Histogram().quantile(0.5) is None
+
+
+def test_histogram_since_snapshot():
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    registry.observe('stage_seconds', 5.0)
+    registry.increment('rows_total', 3)
+    snapshot = registry.snapshot()
+
+    registry.observe('stage_seconds', 0.05)
+    registry.increment('rows_total', 2)
+
+    # Seules les observations faites après la copie sont comptées
+    histogram = registry.histogram('stage_seconds').since(snapshot.histogram('stage_seconds'))
+    assert (histogram.count, histogram.counts) == (1, [1, 0, 0])
+    assert histogram.sum == pytest.approx(0.05)
+    assert histogram.quantile(0.99) == 0.1
+    assert registry.counter('rows_total') - snapshot.counter('rows_total') == 2
+    assert snapshot.histogram('stage_seconds').count == 1
+
+
+def test_registry_timer_records_failures():
+    registry = MetricsRegistry()
+
+    with pytest.raises(RuntimeError):
+        with registry.timer('stage_seconds', stage='load'):
+            raise RuntimeError("boom")
+
+    # La durée est enregistrée même quand le bloc échoue
+    assert registry.histogram('stage_seconds', stage='load').count == 1
+    assert registry.histogram('stage_seconds', stage='extract') is None
+
+
+def test_registry_to_prometheus():
+    registry = MetricsRegistry(buckets=(1.0,))
+    registry.increment('rows_total', 3, table='city')
+    registry.increment('rows_total', 2, table='city')
+    registry.set_gauge('cache_size', 42)
+    registry.observe('write_seconds', 0.5, table='city')
+
+    text = registry.to_prometheus()
+    assert '# TYPE rows_total counter' in text
+    assert 'rows_total{table="city"} 5' in text
+    assert 'cache_size 42' in text
+    assert 'write_seconds_bucket{table="city",le="1.0"} 1' in text
+    assert 'write_seconds_bucket{table="city",le="+Inf"} 1' in text
+    assert 'write_seconds_count{table="city"} 1' in text
+
+
+def test_registry_export(tmp_path):
+    registry = MetricsRegistry()
+    registry.increment('rows_total', table='city')
+
+    registry.export(tmp_path / 'metrics.prom')
+    registry.export(tmp_path / 'metrics.jsonl')
+    registry.export(tmp_path / 'metrics.jsonl')
+
+    assert 'rows_total{table="city"} 1' in (tmp_path / 'metrics.prom').read_text()
+    # Le format JSON lines ajoute les séries à la suite à chaque export
+    lines = (tmp_path / 'metrics.jsonl').read_text().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0])['labels'] == {'table': 'city'}
+
+
+def test_registry_concurrent_exports(tmp_path):
+    registry = MetricsRegistry()
+    registry.increment('rows_total', table='city')
+    errors = []
+
+    def export():
+        try:
+            for _ in range(50):
+                registry.export(tmp_path / 'metrics.prom')
+        except Exception as e:
+            errors.append(e)
+
+    # Plusieurs pipelines exportent en même temps, comme dans un backfill
+    threads = [threading.Thread(target=export) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert [path.name for path in tmp_path.iterdir()] == ['metrics.prom']
+    assert 'rows_total{table="city"} 1' in (tmp_path / 'metrics.prom').read_text()
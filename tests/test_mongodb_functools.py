@@ -0,0 +1,83 @@
+from collections import defaultdict
+
+import pytest
+from unittest.mock import MagicMock, patch
+from pymongo.errors import BulkWriteError
+
+from database.mongodb_functools import MongoDBManager
+
+
+@pytest.fixture
+def mongo_manager():
+    with patch('database.mongodb_functools.MongoClient'):
+        manager = MongoDBManager()
+        manager.db = MagicMock()
+        yield manager
+
+
+def test_mongo_insert_documents_in_batches(mongo_manager):
+    # Test de l'insertion groupée, un insert_many non ordonné par lot
+    collection = mongo_manager.db['weather']
+    collection.insert_many.side_effect = lambda batch, ordered: MagicMock(inserted_ids=batch)
+
+    inserted = mongo_manager.insert_documents('weather', ({'dt': i} for i in range(25)),
+                                              batch_size=10)
+
+    assert inserted == 25
+    assert [len(call.args[0]) for call in collection.insert_many.call_args_list] == [10, 10, 5]
+    assert all(call.kwargs['ordered'] is False for call in collection.insert_many.call_args_list)
+
+
+def test_mongo_insert_documents_skips_duplicates(mongo_manager):
+    # Les doublons sont signalés sans interrompre le chargement
+    collection = mongo_manager.db['weather']
+    collection.insert_many.side_effect = [
+        BulkWriteError({'nInserted': 1, 'writeErrors': [{'code': 11000, 'errmsg': 'dup'}]}),
+        MagicMock(inserted_ids=[3]),
+    ]
+
+    inserted = mongo_manager.insert_documents('weather', [{'_id': 1}, {'_id': 1}, {'_id': 3}],
+                                              batch_size=2)
+
+    assert inserted == 2
+
+
+def test_mongo_insert_documents_raises_other_errors(mongo_manager):
+    # Les autres erreurs d'écriture sont relevées
+    collection = mongo_manager.db['weather']
+    collection.insert_many.side_effect = BulkWriteError(
+        {'nInserted': 0, 'writeErrors': [{'code': 121, 'errmsg': 'validation'}]})
+
+    with pytest.raises(BulkWriteError):
+        mongo_manager.insert_documents('weather', [{'dt': 1}])
+
+
+def test_mongo_iter_documents_streams_with_projection(mongo_manager):
+    # Les documents sont lus par lots, triés et limités côté serveur
+    collection = mongo_manager.db['city']
+    cursor = collection.find.return_value
+    cursor.sort.return_value = cursor
+    cursor.__enter__.return_value = cursor
+    cursor.__iter__.return_value = iter([{'lat': -33.87, 'lon': 151.21}])
+
+    documents = mongo_manager.iter_documents('city', {}, projection={'_id': 0, 'lat': 1, 'lon': 1},
+                                             sort=[('name', 1)], limit=5, batch_size=100)
+
+    assert list(documents) == [{'lat': -33.87, 'lon': 151.21}]
+    collection.find.assert_called_once_with({}, {'_id': 0, 'lat': 1, 'lon': 1},
+                                            limit=5, batch_size=100)
+    cursor.sort.assert_called_once_with([('name', 1)])
+    cursor.__exit__.assert_called_once()
+
+
+def test_mongo_ensure_indexes(mongo_manager):
+    # Les index du datalake sont créés pour chaque collection
+    collections = defaultdict(MagicMock)
+    mongo_manager.db.__getitem__.side_effect = collections.__getitem__
+
+    mongo_manager.ensure_indexes()
+
+    assert set(collections) == {'city', 'weather', 'daily_weather', 'air_pollution'}
+    models = collections['weather'].create_indexes.call_args.args[0]
+    assert [model.document['name'] for model in models] == ['coord_dt', 'lat_lon_data_dt', 'dt']
+    assert dict(models[0].document['key']) == {'coord.lat': 1, 'coord.lon': 1, 'dt': 1}
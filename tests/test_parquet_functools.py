@@ -0,0 +1,50 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from utils.parquet_functools import append_to_dataset, load_dataset, replace_dataset  # noqa: E402
+
+
+@pytest.fixture
+def rows():
+    return pd.DataFrame({'date': [date(2023, 12, 31), date(2024, 1, 1), date(2024, 1, 1)],
+                         'location': ['Sydney', 'Sydney', 'Darwin'],
+                         'year': [2023, 2024, 2024],
+                         'rainfall': [0.0, 5.2, None],
+                         'wind_dir_9am': ['NE', None, 'W']})
+
+
+def test_append_to_dataset_partitions_rows(rows, tmp_path):
+    append_to_dataset(rows, tmp_path, ['location', 'year'], ['wind_dir_9am'])
+    append_to_dataset(rows.iloc[[1]], tmp_path, ['location', 'year'], ['wind_dir_9am'])
+
+    assert sorted(path.relative_to(tmp_path).parent.as_posix()
+                  for path in tmp_path.rglob('*.parquet')) == \
+        ['location=Darwin/year=2024', 'location=Sydney/year=2023',
+         'location=Sydney/year=2024', 'location=Sydney/year=2024']
+    df = load_dataset(tmp_path)
+    assert len(df) == 4
+    assert df['wind_dir_9am'].dtype == 'category'
+
+
+def test_load_dataset_reads_only_matching_partitions(rows, tmp_path):
+    append_to_dataset(rows, tmp_path, ['location', 'year'], ['wind_dir_9am'])
+
+    df = load_dataset(tmp_path, columns=['date', 'rainfall'],
+                      filters=[('location', '=', 'Sydney'), ('year', '=', 2024)])
+
+    assert list(df.columns) == ['date', 'rainfall']
+    assert df['rainfall'].tolist() == [5.2]
+
+
+def test_replace_dataset(rows, tmp_path):
+    append_to_dataset(rows, tmp_path / 'old', ['location', 'year'])
+    append_to_dataset(rows.iloc[[0]], tmp_path / 'new', ['location', 'year'])
+
+    replace_dataset(tmp_path / 'new', tmp_path / 'old')
+
+    assert not (tmp_path / 'new').exists()
+    assert len(load_dataset(tmp_path / 'old')) == 1
@@ -0,0 +1,121 @@
+import pytest
+from unittest.mock import MagicMock
+
+from data_pipeline.pipeline_manager import DataPipeline
+
+
+@pytest.fixture
+def mock_openweather_manager():
+    """Fixture pour un extracteur OpenWeather renvoyant 10 réponses de 3 lignes."""
+    manager = MagicMock()
+    raw_data = [{'city': i} for i in range(10)]
+    manager.extract_data.return_value = raw_data
+    manager.iter_extract_data.side_effect = lambda: iter(raw_data)
+    manager.transform_data.side_effect = lambda data: [{'city': data['city'], 'hour': hour}
+                                                       for hour in range(3)]
+    return manager
+
+
+def loaded_rows(manager):
+    return sorted((row['city'], row['hour'])
+                  for call in manager.load_many_to_data_warehouse.call_args_list
+                  for row in call.args[0])
+
+
+def test_pipeline_run_by_record(mock_openweather_manager):
+    DataPipeline(mock_openweather_manager).run()
+
+    assert mock_openweather_manager.load_to_data_warehouse.call_count == 30
+    assert mock_openweather_manager.load_to_datalake.call_count == 10
+    mock_openweather_manager.flush_datalake.assert_called_once()
+    mock_openweather_manager.refresh_data_warehouse.assert_called_once()
+    mock_openweather_manager.commit_watermarks.assert_called_once()
+
+
+def test_pipeline_run_batched(mock_openweather_manager):
+    DataPipeline(mock_openweather_manager, batch_size=12).run()
+
+    calls = mock_openweather_manager.load_many_to_data_warehouse.call_args_list
+    assert [len(call.args[0]) for call in calls] == [12, 12, 6]
+    assert len(loaded_rows(mock_openweather_manager)) == 30
+
+
+def test_pipeline_run_streaming(mock_openweather_manager):
+    # Toutes les lignes sont chargées, quel que soit l'ordre des threads
+    DataPipeline(mock_openweather_manager, batch_size=4, streaming=True,
+                 transform_workers=3, load_workers=2, queue_size=2).run()
+
+    assert loaded_rows(mock_openweather_manager) == [(city, hour) for city in range(10)
+                                                     for hour in range(3)]
+    assert mock_openweather_manager.load_to_datalake.call_count == 10
+    mock_openweather_manager.commit_watermarks.assert_called_once()
+
+
+def test_pipeline_run_streaming_propagates_errors(mock_openweather_manager):
+    # Une erreur dans une étape arrête le pipeline sans enregistrer les watermarks
+    mock_openweather_manager.transform_data.side_effect = ValueError("bad payload")
+
+    with pytest.raises(ValueError):
+        DataPipeline(mock_openweather_manager, streaming=True, queue_size=1).run()
+
+    mock_openweather_manager.flush_datalake.assert_called_once()
+    mock_openweather_manager.commit_watermarks.assert_not_called()
+
+
+def test_pipeline_records_stage_metrics(mock_openweather_manager, isolated_metrics, tmp_path):
+    DataPipeline(mock_openweather_manager, batch_size=12).run()
+
+    labels = {'pipeline': 'MagicMock'}
+    assert isolated_metrics.counter('pipeline_stage_records_total', stage='extract', **labels) == 10
+    assert isolated_metrics.counter('pipeline_stage_records_total', stage='transform', **labels) == 30
+    assert isolated_metrics.counter('pipeline_stage_records_total',
+                                    stage='warehouse_load', **labels) == 30
+    assert isolated_metrics.histogram('pipeline_stage_seconds', stage='warehouse_load',
+                                      **labels).count == 3
+    # Le fichier Prometheus est écrit à la fin du run
+    assert 'pipeline_stage_seconds_bucket' in (tmp_path / 'pipeline_metrics.prom').read_text()
+
+
+def test_pipeline_streaming_extract_metrics(mock_openweather_manager, isolated_metrics):
+    DataPipeline(mock_openweather_manager, batch_size=12, streaming=True).run()
+
+    # La fin du flux n'est compté ni comme une ligne ni comme un échec
+    labels = {'pipeline': 'MagicMock', 'stage': 'extract'}
+    assert isolated_metrics.counter('pipeline_stage_records_total', **labels) == 10
+    assert isolated_metrics.counter('pipeline_stage_failures_total', **labels) == 0
+    assert isolated_metrics.histogram('pipeline_stage_seconds', **labels).count == 10
+
+
+def test_pipeline_counts_stage_failures(mock_openweather_manager, isolated_metrics):
+    mock_openweather_manager.transform_data.side_effect = ValueError("boom")
+
+    with pytest.raises(ValueError):
+        DataPipeline(mock_openweather_manager).run()
+
+    assert isolated_metrics.counter('pipeline_stage_failures_total',
+                                    pipeline='MagicMock', stage='transform') == 1
+    mock_openweather_manager.commit_watermarks.assert_not_called()
+
+
+def test_pipeline_metrics_export_failure_does_not_fail_run(mock_openweather_manager, tmp_path,
+                                                           monkeypatch, capsys):
+    # Le dossier des métriques est un fichier : l'export échoue après le chargement
+    (tmp_path / 'metrics').write_text('')
+    monkeypatch.setenv('PIPELINE_METRICS_FILE', str(tmp_path / 'metrics' / 'pipeline.prom'))
+
+    DataPipeline(mock_openweather_manager, batch_size=12).run()
+
+    mock_openweather_manager.commit_watermarks.assert_called_once()
+    assert "Could not write the metrics" in capsys.readouterr().out
+
+
+def test_pipeline_summary_reports_the_run_only(mock_openweather_manager, capsys):
+    DataPipeline(mock_openweather_manager, batch_size=12).run()
+    capsys.readouterr()
+
+    DataPipeline(mock_openweather_manager, batch_size=12).run()
+
+    # Le registre est partagé par le processus, le résumé ne compte que ce run
+    summary = capsys.readouterr().out
+    assert "  extract: 10 records" in summary
+    assert "  warehouse_load: 30 records" in summary
@@ -0,0 +1,226 @@
+import threading
+from datetime import date, datetime
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from database.postgresql_functools import City, AirPollution, AustralianMeteorologyWeather, \
+    DailyWeather, PostgresManager, Weather, weather_partitions
+
+
+def test_postgres_add_records_in_batches(sqlite_postgres_manager):
+    # Test de l'insertion groupée de plusieurs lignes
+    rows = [{'name': f"City {i}", 'country': "AU", 'latitude': -30.0 - i, 'longitude': 150.0 + i}
+            for i in range(25)]
+
+    inserted = sqlite_postgres_manager.add_records(City, rows, batch_size=10)
+
+    assert inserted == 25
+    cities = sqlite_postgres_manager.fetch_all_records(City)
+    assert [city.name for city in cities] == [row['name'] for row in rows]
+
+
+def test_postgres_add_records_accepts_generators(sqlite_postgres_manager):
+    # Test de l'insertion groupée à partir d'un générateur
+    rows = ({'date': datetime(2024, 1, 1, hour), 'air_quality_index': 1, 'city_id': 1}
+            for hour in range(24))
+
+    inserted = sqlite_postgres_manager.add_records(AirPollution, rows, batch_size=1000)
+
+    assert inserted == 24
+
+
+def test_postgres_add_records_rejects_unknown_columns(sqlite_postgres_manager):
+    # Comme add_record, une clé sans colonne est refusée au lieu d'être ignorée
+    rows = [{'date': date(2024, 1, 1), 'min_temp': 19.6, 'cloud': 40.0, 'city_id': 1}]
+
+    with pytest.raises(TypeError, match="'cloud'"):
+        sqlite_postgres_manager.add_records(DailyWeather, rows)
+
+    assert sqlite_postgres_manager.fetch_all_records(DailyWeather) == []
+
+
+def test_postgres_add_records_rejects_unknown_columns_in_later_rows(sqlite_postgres_manager):
+    # Toutes les lignes du lot sont vérifiées, pas seulement la première
+    rows = [{'date': date(2024, 1, 1), 'min_temp': 19.6, 'city_id': 1},
+            {'date': date(2024, 1, 2), 'min_temp': 18.2, 'humidity': 71.0, 'city_id': 1}]
+
+    with pytest.raises(TypeError, match="'humidity'"):
+        sqlite_postgres_manager.add_records(DailyWeather, rows)
+
+    assert sqlite_postgres_manager.fetch_all_records(DailyWeather) == []
+
+
+def test_postgres_add_records_skip_existing(sqlite_postgres_manager):
+    # Recharger les mêmes lignes après un échec n'insère que les nouvelles
+    rows = [{'date': datetime(2024, 1, 1, hour), 'air_quality_index': 1, 'city_id': 1}
+            for hour in range(24)]
+    sqlite_postgres_manager.add_records(AirPollution, rows[:10], skip_existing=True)
+
+    inserted = sqlite_postgres_manager.add_records(AirPollution, rows, batch_size=5,
+                                                   skip_existing=True)
+
+    assert inserted == 14
+    assert len(sqlite_postgres_manager.fetch_all_records(AirPollution)) == 24
+
+
+def test_postgres_add_records_skip_existing_on_postgres(postgres_manager):
+    postgres_manager.add_records(City, [{'id': 1, 'name': "Sydney", 'latitude': -33.87,
+                                         'longitude': 151.21}])
+    rows = [{'date': datetime(2024, 1, 1, hour), 'air_quality_index': 1, 'city_id': 1}
+            for hour in range(24)]
+    postgres_manager.add_records(AirPollution, rows[:10], skip_existing=True)
+
+    assert postgres_manager.add_records(AirPollution, rows, skip_existing=True) == 14
+    assert len(postgres_manager.fetch_all_records(AirPollution)) == 24
+
+
+def test_postgres_update_watermarks_only_moves_forward(sqlite_postgres_manager):
+    # Les watermarks ne reculent jamais
+    endpoint = 'data/2.5/air_pollution/history'
+    sqlite_postgres_manager.update_watermarks(endpoint, {1: datetime(2024, 1, 1),
+                                                         2: datetime(2024, 1, 1)})
+    sqlite_postgres_manager.update_watermarks(endpoint, {1: datetime(2023, 1, 1),
+                                                         2: datetime(2024, 6, 1)})
+
+    watermarks = sqlite_postgres_manager.fetch_watermarks(endpoint)
+
+    assert watermarks == {1: datetime(2024, 1, 1), 2: datetime(2024, 6, 1)}
+    assert sqlite_postgres_manager.fetch_watermarks('data/2.5/weather') == {}
+
+
+def test_postgres_add_frame_stores_missing_values_as_null(sqlite_postgres_manager):
+    # Les valeurs manquantes d'un DataFrame sont insérées comme NULL
+    frame = pd.DataFrame({'date': pd.to_datetime([1704067200, 1704070800], unit='s'),
+                          'air_quality_index': [1, 2],
+                          'co_concentration': [201.94, np.nan],
+                          'city_id': [1, 1]})
+
+    inserted = sqlite_postgres_manager.add_frame(AirPollution, frame)
+
+    assert inserted == 2
+    records = sqlite_postgres_manager.fetch_all_records(AirPollution)
+    assert records[0].date == datetime(2024, 1, 1, 0, 0)
+    assert [record.co_concentration for record in records] == [201.94, None]
+
+
+def test_postgres_copy_frame_skips_existing_rows(postgres_manager):
+    postgres_manager.add_records(City, [{'id': 1, 'name': "Sydney", 'latitude': -33.87,
+                                         'longitude': 151.21}])
+    frame = pd.DataFrame({'date': pd.to_datetime(1704067200 + 3600 * np.arange(24), unit='s'),
+                          'air_quality_index': 1,
+                          'co_concentration': [np.nan] + [201.94] * 23,
+                          'city_id': 1})
+    postgres_manager.copy_frame(AirPollution, frame.iloc[:10])
+
+    assert postgres_manager.copy_frame(AirPollution, frame, batch_size=5) == 14
+    records = postgres_manager.fetch_all_records(AirPollution)
+    assert len(records) == 24
+    assert sorted(records, key=lambda record: record.date)[0].co_concentration is None
+
+
+def test_weather_partitions_are_days_per_city():
+    rows = [{'date': '2023-04-01 09:00:00', 'city_id': 1},
+            {'date': '2023-04-01 15:00:00', 'city_id': 1},
+            {'date': '2023-04-01 09:00:00', 'city_id': 2}]
+
+    assert weather_partitions(rows) == {(1, date(2023, 4, 1)), (2, date(2023, 4, 1))}
+    assert weather_partitions(pd.DataFrame(rows)) == weather_partitions(rows)
+    assert weather_partitions([]) == set()
+
+
+def test_refresh_australian_meteorology_weather_only_affected_partitions():
+    engine = MagicMock()
+    connection = engine.begin.return_value.__enter__.return_value
+    connection.execute.return_value.rowcount = 2
+    manager = PostgresManager(engine=engine)
+
+    inserted = manager.refresh_australian_meteorology_weather(
+        [(2, date(2023, 4, 1)), (1, date(2023, 4, 2)), (2, date(2023, 4, 1))])
+
+    assert inserted == 2
+    [(insert, insert_params)] = [call.args for call in connection.execute.call_args_list]
+    # Les partitions sont recalculées par un upsert, dans une seule transaction
+    assert str(insert).startswith("WITH affected AS (SELECT * FROM unnest(")
+    assert "ON CONFLICT (city_id, date) DO UPDATE" in str(insert)
+    assert insert_params == {'city_ids': [1, 2], 'dates': [date(2023, 4, 2), date(2023, 4, 1)]}
+    # Les jointures comparent les dates brutes à des intervalles
+    assert 'EXTRACT' not in str(insert)
+    engine.begin.assert_called_once()
+
+
+def test_refresh_australian_meteorology_weather_without_partitions():
+    engine = MagicMock()
+    manager = PostgresManager(engine=engine)
+
+    assert manager.refresh_australian_meteorology_weather([]) == 0
+    engine.begin.assert_not_called()
+
+    manager.refresh_australian_meteorology_weather()
+    connection = engine.begin.return_value.__enter__.return_value
+    delete = connection.execute.call_args_list[0].args[0]
+    assert str(delete) == "DELETE FROM australian_meteorology_weather"
+
+
+@pytest.fixture
+def meteorology_sources(postgres_manager):
+    """Fixture pour une ville avec deux jours de relevés, l'après-midi du 2 avril manquant."""
+    postgres_manager.add_records(City, [{'id': 1, 'name': "Sydney", 'latitude': -33.87,
+                                         'longitude': 151.21}])
+    postgres_manager.add_records(DailyWeather, [
+        {'date': date(2023, 4, day), 'min_temp': 15.0 + day, 'max_temp': 25.0, 'rainfall': 0.2,
+         'wind_gust_dir': 'NE', 'wind_gust_speed': 30.0, 'city_id': 1} for day in (1, 2)])
+    postgres_manager.add_records(Weather, [
+        {'date': datetime(2023, 4, 1, 9, 30), 'temp': 18.0, 'humidity': 80.0, 'city_id': 1},
+        {'date': datetime(2023, 4, 1, 15), 'temp': 24.0, 'humidity': 50.0, 'city_id': 1},
+        {'date': datetime(2023, 4, 2, 9), 'temp': 19.0, 'humidity': 75.0, 'city_id': 1}])
+    return postgres_manager
+
+
+def meteorology_rows(manager):
+    records = manager.fetch_all_records(AustralianMeteorologyWeather)
+    return sorted((record.date, record.location, record.min_temp, record.temp_9am,
+                   record.temp_3pm) for record in records)
+
+
+def test_refresh_australian_meteorology_weather_on_postgres(meteorology_sources):
+    manager = meteorology_sources
+
+    assert manager.refresh_australian_meteorology_weather([(1, date(2023, 4, 1))]) == 1
+    assert meteorology_rows(manager) == [(date(2023, 4, 1), "Sydney", 16.0, 18.0, 24.0)]
+
+    # Un relevé arrivé plus tard met à jour la ligne existante
+    manager.add_records(Weather, [{'date': datetime(2023, 4, 2, 15), 'temp': 23.0,
+                                   'city_id': 1}])
+    manager.refresh_australian_meteorology_weather([(1, date(2023, 4, 1)),
+                                                    (1, date(2023, 4, 2))])
+    assert meteorology_rows(manager) == [(date(2023, 4, 1), "Sydney", 16.0, 18.0, 24.0),
+                                         (date(2023, 4, 2), "Sydney", 17.0, 19.0, 23.0)]
+
+    assert manager.refresh_australian_meteorology_weather() == 2
+    assert len(meteorology_rows(manager)) == 2
+
+
+def test_concurrent_refreshes_on_postgres(meteorology_sources):
+    manager = meteorology_sources
+    partitions = [(1, date(2023, 4, 1)), (1, date(2023, 4, 2))]
+    errors = []
+
+    def refresh():
+        try:
+            for _ in range(10):
+                manager.refresh_australian_meteorology_weather(partitions)
+        except Exception as e:
+            errors.append(e)
+
+    # Plusieurs processus de chargement recalculent les mêmes jours en même temps
+    threads = [threading.Thread(target=refresh) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(meteorology_rows(manager)) == 2
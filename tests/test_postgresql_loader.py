@@ -0,0 +1,69 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from database.postgresql_loader import copy_dataframe
+
+
+@pytest.fixture
+def engine():
+    """Fixture pour un engine dont la connexion psycopg2 enregistre les COPY."""
+    engine = MagicMock()
+    engine.dialect = postgresql.dialect()
+    cursor = engine.raw_connection.return_value.cursor.return_value.__enter__.return_value
+    cursor.copies = []
+    cursor.copy_expert.side_effect = lambda sql, file: cursor.copies.append((sql, file.read()))
+    cursor.rowcount = 1
+    return engine
+
+
+def get_cursor(engine):
+    return engine.raw_connection.return_value.cursor.return_value.__enter__.return_value
+
+
+def test_copy_dataframe_in_chunks(engine):
+    frame = pd.DataFrame({'date': pd.to_datetime(['2023-04-01 09:00', '2023-04-02 09:00',
+                                                  '2023-04-03 09:00']),
+                          'city_id': [1, 1, 2],
+                          'temp': [19.0, np.nan, 16.1],
+                          'wind_dir': ['W', None, 'SW']})
+
+    inserted = copy_dataframe(engine, frame, 'weather', chunk_size=2)
+
+    copies = get_cursor(engine).copies
+    assert inserted == 3
+    assert [sql for sql, _ in copies] == [
+        "COPY weather (date, city_id, temp, wind_dir) FROM STDIN WITH (FORMAT csv, NULL '')"] * 2
+    # Les valeurs manquantes deviennent des champs vides, lus comme NULL
+    assert copies[0][1] == "2023-04-01 09:00:00,1,19.0,W\n2023-04-02 09:00:00,1,,\n"
+    assert engine.raw_connection.return_value.commit.call_count == 2
+    engine.raw_connection.return_value.close.assert_called_once()
+
+
+def test_copy_dataframe_through_staging_table(engine):
+    frames = [pd.DataFrame({'city_id': [1], 'temp': [19.0]}),
+              pd.DataFrame({'city_id': [2], 'temp': [16.1]})]
+
+    inserted = copy_dataframe(engine, frames, 'weather', staging=True)
+
+    cursor = get_cursor(engine)
+    statements = [call.args[0] for call in cursor.execute.call_args_list]
+    assert inserted == 2
+    assert statements[0].startswith("CREATE TEMP TABLE copy_staging ON COMMIT DROP")
+    assert statements[1] == ("INSERT INTO weather (city_id, temp) SELECT city_id, temp "
+                             "FROM copy_staging ON CONFLICT DO NOTHING")
+    assert cursor.copies[0][0].startswith("COPY copy_staging (city_id, temp) FROM STDIN")
+
+
+def test_copy_dataframe_rolls_back_on_error(engine):
+    get_cursor(engine).copy_expert.side_effect = RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        copy_dataframe(engine, pd.DataFrame({'city_id': [1]}), 'weather')
+
+    connection = engine.raw_connection.return_value
+    connection.rollback.assert_called_once()
+    connection.close.assert_called_once()
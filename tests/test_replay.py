@@ -0,0 +1,170 @@
+import json
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+from bson import ObjectId
+
+from benchmarks.fake_openweather import PAYLOADS_DIR
+from data_pipeline import replay
+from data_pipeline.replay import ReplayPartition, build_manager, partitions, replay_partition
+from database.models import City, Weather
+from preparation import data_from_Laurent
+from utils.ELTL import OpenWeatherAPI, OpenWeatherByCities, OpenWeatherCurrentWeather, \
+    OpenWeatherDailyAirPollution, OpenWeatherDailyWeather, OpenWeatherTimestampWeather
+
+
+def payload(name):
+    return json.loads((PAYLOADS_DIR / name).read_text(encoding='utf-8'))
+
+
+@pytest.fixture
+def datalake(mocker):
+    """Fixture pour un datalake contenant un document de chaque forme."""
+    datalake = MagicMock()
+    documents = {'weather': [payload('current_weather.json'), payload('timemachine.json')],
+                 'daily_weather': [payload('day_summary.json')],
+                 'air_pollution': [payload('air_pollution.json')] * 3 + [{'_id': 'other'}]}
+    datalake.iter_documents.side_effect = \
+        lambda collection, query, batch_size: iter(documents[collection])
+    mocker.patch.object(OpenWeatherAPI, 'datalake_manager', datalake)
+    return datalake
+
+
+@pytest.fixture
+def copies(sqlite_postgres_manager, monkeypatch, mocker):
+    """Fixture qui enregistre les DataFrames copiés dans l'entrepôt, par table."""
+    sqlite_postgres_manager.add_records(City, [{'id': 1, 'name': 'Sydney', 'latitude': -33.87,
+                                                'longitude': 151.21}])
+    monkeypatch.setattr(OpenWeatherAPI, 'data_warehouse_manager', sqlite_postgres_manager)
+    monkeypatch.setattr(OpenWeatherByCities, 'city_index', None)
+    copies = []
+
+    def copy_dataframe(engine, frame, table, chunk_size, staging):
+        copies.append((table, frame))
+        # Les doublons sont ignorés par la table de transit
+        return len(frame.drop_duplicates())
+
+    mocker.patch.object(replay, 'copy_dataframe', side_effect=copy_dataframe)
+    return copies
+
+
+def test_build_manager_from_document_shape():
+    assert isinstance(build_manager('weather', payload('current_weather.json')),
+                      OpenWeatherCurrentWeather)
+    assert isinstance(build_manager('weather', payload('timemachine.json')),
+                      OpenWeatherTimestampWeather)
+    assert isinstance(build_manager('air_pollution', payload('air_pollution.json')),
+                      OpenWeatherDailyAirPollution)
+    # Les résumés journaliers de data_from_Laurent sont dans la collection weather
+    assert isinstance(build_manager('weather', payload('day_summary.json')),
+                      OpenWeatherDailyWeather)
+    with pytest.raises(ValueError):
+        build_manager('weather', {'_id': 1})
+
+
+def test_replay_partition_copies_transformed_documents(datalake, copies):
+    start, end = datetime(2024, 1, 1), datetime(2024, 1, 2)
+
+    assert replay_partition(ReplayPartition('weather', start, end), batch_size=10) == 2
+    assert replay_partition(ReplayPartition('daily_weather', start, end)) == 1
+
+    # Seuls les documents insérés dans l'intervalle sont relus
+    query = datalake.iter_documents.call_args_list[0].args[1]
+    assert query == {'_id': {'$gte': ObjectId.from_datetime(start),
+                             '$lt': ObjectId.from_datetime(end)}}
+    assert [(table, len(frame)) for table, frame in copies] == \
+        [('weather', 1), ('weather', 1), ('daily_weather', 1)]
+    assert all(frame['city_id'].tolist() == [1] for _, frame in copies)
+
+
+def test_replay_partition_routes_day_summaries_in_weather(datalake, copies):
+    datalake.iter_documents.side_effect = lambda collection, query, batch_size: \
+        iter([payload('timemachine.json'), payload('day_summary.json')])
+
+    assert replay_partition(ReplayPartition('weather')) == 2
+
+    # Chaque forme de document est chargée dans sa propre table
+    assert [(table, len(frame)) for table, frame in copies] == \
+        [('weather', 1), ('daily_weather', 1)]
+
+
+def test_replay_partition_skips_unknown_documents(datalake, copies, isolated_metrics, capsys):
+    assert replay_partition(ReplayPartition('air_pollution'), batch_size=2) == 2
+
+    # Le document inconnu est compté sans arrêter la partition
+    assert datalake.iter_documents.call_args.args[1] == {}
+    assert [table for table, _ in copies] == ['air_pollution', 'air_pollution']
+    assert isolated_metrics.counter('replay_documents_skipped_total',
+                                    collection='air_pollution') == 1
+    assert "1 air_pollution documents" in capsys.readouterr().out
+
+
+@pytest.fixture
+def laurent_documents(tmp_path, mocker):
+    """Fixture qui charge un export timemachine avec data_from_Laurent et garde ses documents."""
+    (tmp_path / 'data' / 'json').mkdir(parents=True)
+    (tmp_path / 'data' / 'json' / 'dataWeatherTimeStamp.json').write_text(
+        json.dumps(payload('timemachine.json')) + '\n')
+    documents = []
+    mongo = MagicMock()
+    mongo.insert_documents.side_effect = \
+        lambda collection, batch, batch_size: documents.extend(batch) or len(batch)
+    mocker.patch.object(data_from_Laurent, 'get_mongo_manager', return_value=mongo)
+
+    def load(postgres):
+        mocker.patch.object(data_from_Laurent, 'get_postgres_manager', return_value=postgres)
+        size = (tmp_path / 'data' / 'json' / 'dataWeatherTimeStamp.json').stat().st_size
+        data_from_Laurent.load_dump_range('timestamp_weather', str(tmp_path), 0, size)
+        return documents
+    return load
+
+
+def test_replay_partition_matches_laurent_rows(laurent_documents, datalake, copies,
+                                               sqlite_postgres_manager, mocker):
+    mocker.patch.object(sqlite_postgres_manager, 'refresh_australian_meteorology_weather')
+    mocker.patch.object(data_from_Laurent, 'copy_dataframe',
+                        side_effect=lambda engine, rows, table, chunk_size, staging:
+                        copies.append((table, rows)) or len(rows))
+    documents = laurent_documents(sqlite_postgres_manager)
+    datalake.iter_documents.side_effect = lambda collection, query, batch_size: iter(documents)
+
+    replay_partition(ReplayPartition('weather'))
+
+    # Les lignes rejouées sont identiques à celles du chargement d'origine
+    (_, loaded), (_, replayed) = copies
+    pd.testing.assert_frame_equal(replayed, loaded)
+
+
+def test_replay_after_laurent_load_adds_no_rows(laurent_documents, postgres_manager,
+                                                monkeypatch, mocker):
+    postgres_manager.add_records(City, [{'id': 1, 'name': 'Sydney', 'latitude': -33.87,
+                                         'longitude': 151.21}])
+    documents = laurent_documents(postgres_manager)
+    datalake = MagicMock()
+    datalake.iter_documents.side_effect = lambda collection, query, batch_size: iter(documents)
+    mocker.patch.object(OpenWeatherAPI, 'datalake_manager', datalake)
+    monkeypatch.setattr(OpenWeatherAPI, 'data_warehouse_manager', postgres_manager)
+    monkeypatch.setattr(OpenWeatherByCities, 'city_index', None)
+
+    # Les heures déjà chargées par data_from_Laurent ne sont pas dupliquées
+    assert replay_partition(ReplayPartition('weather')) == 0
+    assert len(postgres_manager.fetch_all_records(Weather)) == 1
+
+
+def test_partitions_split_insertion_range(mocker):
+    first = datetime(2024, 1, 1)
+    datalake = MagicMock()
+    datalake.find_documents.side_effect = lambda collection, query, projection, sort, limit: \
+        [] if collection == 'air_pollution' else \
+        [{'_id': ObjectId.from_datetime(first + timedelta(hours=0 if sort[0][1] > 0 else 4))}]
+    mocker.patch.object(OpenWeatherAPI, 'datalake_manager', datalake)
+
+    result = partitions(['weather', 'air_pollution'], 4)
+
+    # Une collection vide ne donne aucune partition
+    assert [partition.collection for partition in result] == ['weather'] * 4
+    assert result[0].start == first
+    assert result[-1].end == first + timedelta(hours=4, seconds=1)
+    assert all(a.end == b.start for a, b in zip(result, result[1:]))
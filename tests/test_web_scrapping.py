@@ -0,0 +1,176 @@
+from datetime import date
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+from bs4 import BeautifulSoup
+
+import preparation.data_from_web_scrapping as scrapping
+from utils.cache_functools import PageCache
+
+PAGE = (Path(__file__).parent / 'data' / 'IDCJDW2124.202304.shtml').read_bytes()
+MONTHS = {'202304': b'April 2023', '202306': b'June 2023'}
+
+
+@pytest.fixture
+def fake_pages(monkeypatch):
+    """Fixture qui remplace le site du BOM : la page de mai est introuvable."""
+    def fake_fetch(url, throttle=None, cache=None, offline=False):
+        month = url.split('/')[-3]
+        with throttle(url):
+            return PAGE.replace(b'April 2023', MONTHS[month]) if month in MONTHS else None
+    monkeypatch.setattr(scrapping, 'fetch_page_bytes', fake_fetch)
+
+
+@pytest.mark.parametrize('parse_workers', [0, 2])
+def test_aggregate_weather_data(fake_pages, parse_workers):
+    urls = scrapping.generate_urls(['202304', '202305', '202306'], ['2124', '3033'])
+
+    df = scrapping.aggregate_weather_data(urls, max_workers=4, parse_workers=parse_workers)
+
+    # Trois jours par page trouvée, dans l'ordre des URLs
+    assert len(df) == 4 * 3
+    assert list(df['date'][::3]) == list(pd.to_datetime(['2023-04-01', '2023-04-01',
+                                                         '2023-06-01', '2023-06-01']))
+    assert df.index.tolist() == list(range(12))
+
+
+def test_aggregate_weather_data_spawns_parsers(fake_pages, monkeypatch):
+    contexts = []
+
+    def fake_pool(max_workers=None, mp_context=None):
+        contexts.append(mp_context.get_start_method())
+        return scrapping.ThreadPoolExecutor(max_workers=1)
+
+    monkeypatch.setattr(scrapping, 'ProcessPoolExecutor', fake_pool)
+    urls = scrapping.generate_urls(['202304'], ['2124'])
+
+    # Les parseurs démarrent pendant les téléchargements, ils ne doivent pas être forkés
+    assert len(scrapping.aggregate_weather_data(urls, parse_workers=2)) == 3
+    assert contexts == ['spawn']
+
+
+def test_aggregate_weather_data_without_pages(monkeypatch):
+    monkeypatch.setattr(scrapping, 'fetch_page_bytes', lambda url, *args: None)
+
+    assert scrapping.aggregate_weather_data(['https://example.com'], parse_workers=0).empty
+
+
+# Une ligne tronquée de ses trois dernières cellules, et un tableau sans ligne
+RAGGED_PAGE = PAGE.replace(b'<td>20</td><td>1018.4</td></tr>', b'</tr>', 1)
+EMPTY_PAGE = PAGE[:PAGE.index(b'<tbody>') + 7] + PAGE[PAGE.index(b'</tbody>'):]
+
+
+@pytest.mark.parametrize('page', [PAGE, RAGGED_PAGE, EMPTY_PAGE])
+def test_lxml_parser_matches_beautifulsoup_parser(page):
+    # Le parseur lxml doit produire exactement le même résultat que l'ancien parseur
+    expected = scrapping.parse_html_content(BeautifulSoup(page, 'lxml'))
+
+    pd.testing.assert_frame_equal(scrapping.parse_html_bytes(page), expected)
+
+
+def test_lxml_parser_pads_short_rows():
+    df = scrapping.parse_html_bytes(RAGGED_PAGE, typed=True)
+
+    # Seules les cellules manquantes de la ligne tronquée sont vides
+    assert df.columns.tolist() == scrapping.WEATHER_COLUMNS[1:8] + \
+        scrapping.WEATHER_COLUMNS[9:] + ['date', 'location']
+    assert df['pressure_3pm'].isna().tolist() == [True, False, False]
+    assert df.loc[0, 'cloud_3pm'] == 1
+    assert scrapping.parse_html_bytes(EMPTY_PAGE, typed=True).shape == (0, 21)
+
+
+def test_lxml_parser_reads_calm_cells():
+    df = scrapping.parse_html_bytes(PAGE)
+
+    # Les cellules Calm sur deux colonnes donnent une vitesse de -1
+    assert df.loc[1, ['wind_dir_9am', 'wind_speed_9am']].tolist() == ['Calm', -1]
+    assert df.loc[2, ['wind_dir_3pm', 'wind_speed_3pm']].tolist() == ['Calm', -1]
+    assert df['location'].unique().tolist() == ['Sydney (Observatory Hill)']
+
+
+def test_parse_html_bytes_typed_columns():
+    df = scrapping.parse_html_bytes(PAGE, typed=True)
+
+    assert (df[scrapping.NUMERIC_WEATHER_COLUMNS].dtypes == np.float64).all()
+    assert df['date'].tolist() == list(pd.to_datetime(['2023-04-01', '2023-04-02', '2023-04-03']))
+    assert np.isnan(df.loc[1, 'evaporation'])
+    assert df.loc[0, 'pressure_3pm'] == 1018.4
+
+
+def make_response(status_code, content=b'', headers=None):
+    response = MagicMock(status_code=status_code, content=content)
+    response.headers = headers or {}
+    return response
+
+
+@pytest.fixture
+def http_client(monkeypatch):
+    """Fixture qui remplace le client HTTP partagé."""
+    client = MagicMock()
+    monkeypatch.setattr(scrapping, 'get_http_client', lambda: client)
+    return client
+
+
+def test_month_is_final():
+    assert scrapping.month_is_final('202304', today=date(2023, 5, 3))
+    # Les corrections tardives restent possibles les premiers jours du mois suivant
+    assert not scrapping.month_is_final('202304', today=date(2023, 5, 1))
+    assert not scrapping.month_is_final('202312', today=date(2023, 12, 20))
+    assert scrapping.month_is_final('202312', today=date(2024, 1, 3))
+
+
+def test_fetch_page_bytes_past_month_served_from_cache(tmp_path, http_client):
+    cache = PageCache(tmp_path)
+    url = scrapping.generate_urls(['202304'], ['2124'])[0]
+    http_client.get.return_value = make_response(200, PAGE, {'ETag': '"v1"'})
+
+    assert scrapping.fetch_page_bytes(url, cache=cache) == PAGE
+    assert scrapping.fetch_page_bytes(url, cache=cache) == PAGE
+
+    # Un mois terminé n'est plus jamais redemandé
+    http_client.get.assert_called_once_with(url, headers={})
+    assert cache.get(url)[1]['permanent']
+
+
+def test_fetch_page_bytes_current_month_revalidated(tmp_path, http_client):
+    cache = PageCache(tmp_path)
+    url = scrapping.generate_urls([date.today().strftime('%Y%m')], ['2124'])[0]
+    http_client.get.side_effect = [
+        make_response(200, PAGE, {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 May 2023 00:00:00 GMT'}),
+        make_response(304)]
+
+    scrapping.fetch_page_bytes(url, cache=cache)
+    content = scrapping.fetch_page_bytes(url, cache=cache)
+
+    assert content == PAGE
+    assert http_client.get.call_args.kwargs['headers'] == {
+        'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 01 May 2023 00:00:00 GMT'}
+    assert not cache.get(url)[1]['permanent']
+
+
+def test_fetch_page_bytes_offline(tmp_path, http_client):
+    cache = PageCache(tmp_path)
+    current_url, missing_url = scrapping.generate_urls([date.today().strftime('%Y%m')],
+                                                       ['2124', '3033'])
+    cache.put(current_url, PAGE, etag='"v1"')
+
+    assert scrapping.fetch_page_bytes(current_url, cache=cache, offline=True) == PAGE
+    assert scrapping.fetch_page_bytes(missing_url, cache=cache, offline=True) is None
+    http_client.get.assert_not_called()
+
+
+def test_fetch_page_bytes_serves_stale_page_on_error(tmp_path, http_client, isolated_metrics):
+    cache = PageCache(tmp_path)
+    current_url, missing_url = scrapping.generate_urls([date.today().strftime('%Y%m')],
+                                                       ['2124', '3033'])
+    cache.put(current_url, PAGE, etag='"v1"')
+    http_client.get.side_effect = requests.ConnectionError("Connection reset")
+
+    # Une erreur passagère renvoie la copie du cache, sinon rien
+    assert scrapping.fetch_page_bytes(current_url, cache=cache) == PAGE
+    assert scrapping.fetch_page_bytes(missing_url, cache=cache) is None
+    assert isolated_metrics.counter('page_cache_total', result='stale') == 1
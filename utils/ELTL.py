@@ -1,48 +1,127 @@
 import os
+import threading
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import partial
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, Optional, List, Union
+from typing import Dict, Iterable, Iterator, Optional, List, Set, Tuple, Union
 
+import numpy as np
+import pandas as pd
 from dotenv import load_dotenv
 
-from database.mongodb_functools import MongoDBManager
-from database.postgresql_functools import PostgresManager, Base, City, Weather, DailyWeather, \
-    AirPollution
+from database.mongodb_functools import get_mongo_manager
+from database.postgresql_functools import get_postgres_manager, weather_partitions, \
+    MATERIALIZED_SOURCES, Base, City, Weather, DailyWeather, AirPollution
+from utils.cache_functools import get_response_cache
+from utils.geo_functools import CityIndex
 from utils.json_functools import load_from_json
 from utils.openweather_functools import request_api, extract_lat_lon, build_date_timestamp, \
     get_rain_info, deg_to_cardinal
 
 
+class SharedResource:
+    """
+    Class attribute resolving to a process-wide resource on first access,
+    so that importing this module opens no connection. Assigning the
+    attribute on a class replaces the shared resource, e.g. in tests.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __get__(self, instance, owner):
+        return self.factory()
+
+
 class OpenWeatherAPI(ABC):
     root_path = Path(__file__).parents[1]
 
     load_dotenv(dotenv_path=root_path / '.env')
     api_key = os.getenv("OPENWEATHER_API_KEY")
+    base_url = os.getenv("OPENWEATHER_BASE_URL", 'https://api.openweathermap.org/')
+    max_workers = int(os.getenv("OPENWEATHER_MAX_WORKERS", "8"))
+    datalake_batch_size = int(os.getenv("DATALAKE_BATCH_SIZE", "1000"))
+    response_cache = SharedResource(get_response_cache)
 
-    datalake_manager = MongoDBManager()
-    data_warehouse_manager = PostgresManager()
+    datalake_manager = SharedResource(get_mongo_manager)
+    data_warehouse_manager = SharedResource(get_postgres_manager)
 
     @abstractmethod
     def __init__(self):
-        self.base_url: str = 'https://api.openweathermap.org/'
+        self.base_url: str = OpenWeatherAPI.base_url
         self.endpoint: str = ''
         self.params: Dict[str, Optional[str, int]] = {
             'appid': self.api_key, 'lang': 'en'
         }
         self.collection_name: str = ''
         self.table_name = Base
+        self.datalake_buffer: List[Dict] = []
+        self.datalake_lock = threading.Lock()
+        # australian_meteorology_weather rows to recompute after the loads
+        self.refresh_partitions: Set[Tuple[int, date]] = set()
+        self.refresh_lock = threading.Lock()
 
-    def url_builder(self) -> str:
+    def url_builder(self, params: Optional[Dict] = None) -> str:
         """
         Constructs a URL with given base URL, endpoint, and parameters.
 
+        :param params: The query parameters to use. Defaults to self.params.
         :return: The complete URL with parameters.
         """
+        if params is None:
+            params = self.params
         url = f"{self.base_url}{self.endpoint}?"
         param_str = "&".join(
-            [f"{key}={value}" for key, value in self.params.items() if value is not None])
+            [f"{key}={value}" for key, value in params.items() if value is not None])
         return url + param_str
 
+    def iter_request_many(self, params_list: Iterable[Dict],
+                          max_workers: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Requests the API once per parameter set, running up to
+        max_workers requests at the same time. Responses are yielded as
+        soon as they are ready, and at most max_workers are held at once.
+
+        :param params_list: One dictionary of query parameters per request.
+        :param max_workers: The concurrency limit. Defaults to self.max_workers.
+        :return: An iterator over the responses, in the same order as params_list.
+        """
+        request = partial(request_api, cache=self.response_cache)
+        max_workers = max_workers or self.max_workers
+        if max_workers <= 1:
+            for params in params_list:
+                yield request(self.url_builder(params))
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            try:
+                for params in params_list:
+                    pending.append(executor.submit(request, self.url_builder(params)))
+                    if len(pending) >= max_workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # Do not wait for requests nobody will read, if the consumer stopped early
+                for future in pending:
+                    future.cancel()
+
+    def request_many(self, params_list: List[Dict],
+                     max_workers: Optional[int] = None) -> List[Dict]:
+        """
+        Requests the API once per parameter set, running up to
+        max_workers requests at the same time.
+
+        :param params_list: One dictionary of query parameters per request.
+        :param max_workers: The concurrency limit. Defaults to self.max_workers.
+        :return: The responses, in the same order as params_list.
+        """
+        return list(self.iter_request_many(params_list, max_workers))
+
     @abstractmethod
     def extract_data(self) -> Union[Dict, List[Dict]]:
         """
@@ -51,6 +130,14 @@ class OpenWeatherAPI(ABC):
         :return: The raw data fetched from the API.
         """
 
+    def iter_extract_data(self) -> Iterator[Dict]:
+        """
+        Fetches the raw data from the API, one response at a time.
+
+        :return: An iterator over the raw data fetched from the API.
+        """
+        yield from self.extract_data()
+
     @abstractmethod
     def transform_data(self, data: Dict) -> Union[Dict, List[Dict]]:
         """
@@ -62,11 +149,55 @@ class OpenWeatherAPI(ABC):
 
     def load_to_datalake(self, data: Dict):
         """
-        Loads the structured data to the MongoDB datalake.
+        Loads the structured data to the MongoDB datalake. Documents are
+        buffered and written in bulk, call flush_datalake once done.
 
         :param data: The structured data to be loaded.
         """
-        self.datalake_manager.insert_document(self.collection_name, data)
+        self.buffer_to_datalake([data])
+
+    def buffer_to_datalake(self, documents: List[Dict]):
+        """
+        Adds documents to the datalake buffer, flushing it once it is full.
+
+        :param documents: The documents to be loaded.
+        """
+        with self.datalake_lock:
+            self.datalake_buffer.extend(documents)
+            if len(self.datalake_buffer) < self.datalake_batch_size:
+                return
+            documents, self.datalake_buffer = self.datalake_buffer, []
+        self.datalake_manager.insert_documents(self.collection_name, documents,
+                                               self.datalake_batch_size)
+
+    def flush_datalake(self):
+        """
+        Writes the buffered documents to the MongoDB datalake.
+        """
+        with self.datalake_lock:
+            documents, self.datalake_buffer = self.datalake_buffer, []
+        if documents:
+            self.datalake_manager.insert_documents(self.collection_name, documents,
+                                                   self.datalake_batch_size)
+
+    def commit_watermarks(self):
+        """
+        Records the data loaded by a successful run, for the incremental
+        mode. Extractors without an incremental mode have nothing to record.
+        """
+
+    def transform_data_frame(self, data: Dict) -> pd.DataFrame:
+        """
+        Structures the raw data into columns that can be bulk-loaded to the
+        data warehouse. Defaults to a frame built from transform_data.
+
+        :param data: The raw data fetched from the API.
+        :return: The structured data, one row per record.
+        """
+        structured_data = self.transform_data(data)
+        if isinstance(structured_data, dict):
+            structured_data = [structured_data]
+        return pd.DataFrame(structured_data)
 
     def load_to_data_warehouse(self, data: Dict):
         """
@@ -75,6 +206,50 @@ class OpenWeatherAPI(ABC):
         :param data: The structured data to be loaded.
         """
         self.data_warehouse_manager.add_record(self.table_name(**data))
+        self.track_partitions([data])
+
+    def load_many_to_data_warehouse(self, data: Union[List[Dict], pd.DataFrame],
+                                    batch_size: int = 1000):
+        """
+        Loads many structured records to the PostgresSQL data warehouse,
+        committing once per batch instead of once per record. Records
+        already loaded are skipped, so that a failed run can be run again.
+
+        :param data: The structured records to be loaded, as dictionaries or a DataFrame.
+        :param batch_size: The number of records inserted per transaction.
+        """
+        if isinstance(data, pd.DataFrame):
+            self.data_warehouse_manager.copy_frame(self.table_name, data, batch_size)
+        else:
+            self.data_warehouse_manager.add_records(self.table_name, data, batch_size,
+                                                    skip_existing=True)
+        self.track_partitions(data)
+
+    def track_partitions(self, data: Union[List[Dict], pd.DataFrame]):
+        """
+        Records the australian_meteorology_weather rows affected by the
+        records loaded, if they feed that table.
+
+        :param data: The structured records loaded.
+        """
+        if getattr(self.table_name, '__tablename__', None) not in MATERIALIZED_SOURCES:
+            return
+        partitions = weather_partitions(data)
+        with self.refresh_lock:
+            self.refresh_partitions |= partitions
+
+    def refresh_data_warehouse(self) -> int:
+        """
+        Recomputes the australian_meteorology_weather rows affected by the
+        records loaded since the last refresh.
+
+        :return: The number of rows written.
+        """
+        with self.refresh_lock:
+            partitions, self.refresh_partitions = self.refresh_partitions, set()
+        if not partitions:
+            return 0
+        return self.data_warehouse_manager.refresh_australian_meteorology_weather(partitions)
 
 
 class OpenWeatherCity(OpenWeatherAPI):
@@ -91,11 +266,12 @@ class OpenWeatherCity(OpenWeatherAPI):
         self.table_name = City
 
     def extract_data(self) -> List[Dict]:
-        data = []
-        for city in self.locations:
-            self.params['q'] = f"{city},{self.country_code}"
-            data.append(request_api(self.url_builder())[0])
-        return data
+        return list(self.iter_extract_data())
+
+    def iter_extract_data(self) -> Iterator[Dict]:
+        params_list = [{**self.params, 'q': f"{city},{self.country_code}"}
+                       for city in self.locations]
+        return (data[0] for data in self.iter_request_many(params_list))
 
     def transform_data(self, data: Dict) -> Dict:
         return {
@@ -107,33 +283,121 @@ class OpenWeatherCity(OpenWeatherAPI):
 
 
 class OpenWeatherByCities(OpenWeatherAPI):
-    def __init__(self):
+    # Nearest-city index shared by all the extractors, built on first use
+    city_index: Optional[CityIndex] = None
+    city_index_lock = threading.Lock()
+
+    def __init__(self, cities: Optional[List[Dict]] = None, incremental: bool = False):
+        """
+        :param cities: The cities to request, as documents with lat and lon
+            keys. Defaults to every city stored in the datalake.
+        :param incremental: Whether to request only the data missing from
+            the data warehouse, based on the watermark of each city.
+        """
         super().__init__()
         self.endpoint = 'data/'
         self.params['units'] = 'metric'
+        self.incremental = incremental
+        self.pending_watermarks: Dict[int, datetime] = {}
+
+        if cities is None:
+            # Only the coordinates, not the whole geocoding payloads
+            cities = self.datalake_manager.find_documents(
+                'city', {}, projection={'_id': 0, 'lat': 1, 'lon': 1})
+        self.latitudes, self.longitudes = extract_lat_lon(cities)
+
+    def city_params(self) -> List[Dict]:
+        """
+        Builds a separate set of query parameters for each city. In
+        incremental mode, the parameters are narrowed down to the data
+        missing from the data warehouse, and cities already up to date are skipped.
+
+        :return: A list of parameter dictionaries, in city order.
+        """
+        params_list = [{**self.params, 'lat': lat, 'lon': lon}
+                       for lat, lon in zip(self.latitudes, self.longitudes)]
+        if not self.incremental or self.watermark(self.params) is None:
+            return params_list
+
+        watermarks = self.data_warehouse_manager.fetch_watermarks(self.endpoint)
+        missing_params = []
+        for params in params_list:
+            city_id = self.get_city_id(params['lat'], params['lon'])
+            if city_id in watermarks:
+                params = self.apply_watermark(params, watermarks[city_id])
+                if params is None:
+                    continue
+            self.pending_watermarks[city_id] = self.watermark(params)
+            missing_params.append(params)
+        return missing_params
+
+    def watermark(self, params: Dict) -> Optional[datetime]:
+        """
+        Gives the point in time up to which a request loads the data.
+
+        :param params: The query parameters of the request.
+        :return: The watermark of the request, or None if the
+            endpoint does not support the incremental mode.
+        """
+        return None
+
+    def apply_watermark(self, params: Dict, watermark: datetime) -> Optional[Dict]:
+        """
+        Narrows down a request to the data newer than the watermark.
+
+        :param params: The query parameters of the request.
+        :param watermark: The latest data already loaded for the city.
+        :return: The narrowed parameters, or None if nothing is missing.
+        """
+        if self.watermark(params) <= watermark:
+            return None
+        return params
 
-        cities_info = self.datalake_manager.find_documents('city', {})
-        self.latitudes, self.longitudes = extract_lat_lon(cities_info)
+    def commit_watermarks(self):
+        if self.pending_watermarks:
+            self.data_warehouse_manager.update_watermarks(self.endpoint,
+                                                          self.pending_watermarks)
+            self.pending_watermarks = {}
 
     def extract_data(self) -> List[Dict]:
-        data = []
-        for lat, lon in zip(self.latitudes, self.longitudes):
-            self.params['lat'] = lat
-            self.params['lon'] = lon
-            data.append(request_api(self.url_builder()))
-        return data
+        return self.request_many(self.city_params())
+
+    def iter_extract_data(self) -> Iterator[Dict]:
+        return self.iter_request_many(self.city_params())
+
+    @classmethod
+    def get_city_index(cls) -> CityIndex:
+        """
+        Returns the in-memory index of the city table, loading it on first use.
+
+        :return: The shared CityIndex.
+        """
+        with cls.city_index_lock:
+            if OpenWeatherByCities.city_index is None:
+                OpenWeatherByCities.city_index = CityIndex(
+                    lambda: cls.data_warehouse_manager.fetch_all_records(City))
+            return OpenWeatherByCities.city_index
+
+    @classmethod
+    def refresh_city_index(cls):
+        """
+        Reloads the city index, to be called once new cities are loaded.
+        """
+        if OpenWeatherByCities.city_index is None:
+            cls.get_city_index()
+        else:
+            OpenWeatherByCities.city_index.refresh()
 
     def get_city_id(self, latitude: float, longitude: float) -> int:
         """
-        Fetches the city ID from the PostgreSQL database based on the
-        provided latitude and longitude coordinates.
+        Finds the ID of the city nearest to the provided latitude and
+        longitude coordinates, using the in-memory city index.
 
         :param latitude: The latitude of the location.
         :param longitude: The longitude of the location.
         :return: The city ID corresponding to the provided coordinates.
         """
-        city_id = self.data_warehouse_manager.fetch_city_record_by_coord(latitude, longitude).id
-        return city_id
+        return self.get_city_index().nearest(latitude, longitude)
 
     @abstractmethod
     def transform_data(self, data: Dict) -> Union[Dict, List[Dict]]:
@@ -141,8 +405,8 @@ class OpenWeatherByCities(OpenWeatherAPI):
 
 
 class OpenWeatherCurrentWeather(OpenWeatherByCities):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
         self.endpoint = self.endpoint + '2.5/weather'
         self.collection_name = 'weather'
         self.table_name = Weather
@@ -169,13 +433,16 @@ class OpenWeatherCurrentWeather(OpenWeatherByCities):
 
 
 class OpenWeatherDailyWeather(OpenWeatherByCities):
-    def __init__(self, date: str):
-        super().__init__()
+    def __init__(self, date: str, **kwargs):
+        super().__init__(**kwargs)
         self.endpoint = self.endpoint + '3.0/onecall/day_summary'
         self.params['date'] = date
         self.collection_name = 'daily_weather'
         self.table_name = DailyWeather
 
+    def watermark(self, params: Dict) -> datetime:
+        return datetime.strptime(params['date'], '%Y-%m-%d')
+
     def transform_data(self, data: Dict) -> Dict:
         return {
             'date': data['date'],
@@ -184,21 +451,22 @@ class OpenWeatherDailyWeather(OpenWeatherByCities):
             'rainfall': data['precipitation']['total'],
             'wind_gust_dir': deg_to_cardinal(data['wind']['max']['direction']),
             'wind_gust_speed': data['wind']['max']['speed'],
-            'cloud': data['cloud_cover']['afternoon'],
-            'humidity': data['humidity']['afternoon'],
-            'pressure': data['pressure']['afternoon'],
+            # The cloud, humidity and pressure come from the 9am and 3pm weather rows
             'city_id': self.get_city_id(data['lat'], data['lon'])
         }
 
 
 class OpenWeatherTimestampWeather(OpenWeatherByCities):
-    def __init__(self, timestamp: int):
-        super().__init__()
+    def __init__(self, timestamp: int, **kwargs):
+        super().__init__(**kwargs)
         self.endpoint = self.endpoint + '3.0/onecall/timemachine'
         self.params['dt'] = timestamp
         self.collection_name = 'weather'
         self.table_name = Weather
 
+    def watermark(self, params: Dict) -> datetime:
+        return datetime.utcfromtimestamp(params['dt'])
+
     def transform_data(self, data: Dict) -> Dict:
         return {
             'date': build_date_timestamp(timestamp=data['data'][0]['dt'],
@@ -221,8 +489,8 @@ class OpenWeatherTimestampWeather(OpenWeatherByCities):
 
 
 class OpenWeatherCurrentAirPollution(OpenWeatherByCities):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
         self.endpoint = self.endpoint + '2.5/air_pollution'
         self.collection_name = 'air_pollution'
         self.table_name = AirPollution
@@ -245,15 +513,38 @@ class OpenWeatherCurrentAirPollution(OpenWeatherByCities):
 
 
 class OpenWeatherDailyAirPollution(OpenWeatherByCities):
-    def __init__(self, start: int, end: int):
-        super().__init__()
+    # Data warehouse columns and the matching keys of the 'components' payload
+    component_columns = {
+        'co_concentration': 'co',
+        'no_concentration': 'no',
+        'no2_concentration': 'no2',
+        'o3_concentration': 'o3',
+        'so2_concentration': 'so2',
+        'pm25_concentration': 'pm2_5',
+        'pm10_concentration': 'pm10',
+        'nh3_concentration': 'nh3',
+    }
+
+    def __init__(self, start: int, end: int, **kwargs):
+        super().__init__(**kwargs)
         self.endpoint = self.endpoint + '2.5/air_pollution/history'
         self.params['start'] = start
         self.params['end'] = end
         self.collection_name = 'air_pollution'
         self.table_name = AirPollution
 
+    def watermark(self, params: Dict) -> datetime:
+        return datetime.utcfromtimestamp(params['end'])
+
+    def apply_watermark(self, params: Dict, watermark: datetime) -> Optional[Dict]:
+        # Only request the hours after the watermark
+        start = int((watermark - datetime(1970, 1, 1)).total_seconds()) + 1
+        if start >= params['end']:
+            return None
+        return {**params, 'start': max(params['start'], start)}
+
     def transform_data(self, data: Dict) -> List[Dict]:
+        city_id = self.get_city_id(data['coord']['lat'], data['coord']['lon'])
         structured_data = []
         for i in range(len(data['list'])):
             structured_data.append({
@@ -268,10 +559,23 @@ class OpenWeatherDailyAirPollution(OpenWeatherByCities):
                 'pm25_concentration': data['list'][i]['components']['pm2_5'],
                 'pm10_concentration': data['list'][i]['components']['pm10'],
                 'nh3_concentration': data['list'][i]['components']['nh3'],
-                'city_id': self.get_city_id(data['coord']['lat'], data['coord']['lon'])
+                'city_id': city_id
             })
         return structured_data
 
+    def transform_data_frame(self, data: Dict) -> pd.DataFrame:
+        # Read every hourly entry once into a (hours x fields) array
+        components = itemgetter(*self.component_columns.values())
+        values = np.array([(entry['dt'], entry['main']['aqi'], *components(entry['components']))
+                           for entry in data['list']],
+                          dtype=np.float64).reshape(-1, 2 + len(self.component_columns))
+
+        frame = pd.DataFrame(values[:, 2:], columns=list(self.component_columns))
+        frame.insert(0, 'date', pd.to_datetime(values[:, 0].astype(np.int64), unit='s'))
+        frame.insert(1, 'air_quality_index', values[:, 1].astype(np.int64))
+        frame['city_id'] = self.get_city_id(data['coord']['lat'], data['coord']['lon'])
+        return frame
+
     @staticmethod
     def transform_data_to_multiple_dicts(data):
         """
@@ -319,6 +623,4 @@ class OpenWeatherDailyAirPollution(OpenWeatherByCities):
 
         :param data: The structured data to be loaded.
         """
-        formatted_datas = self.transform_data_to_multiple_dicts(data)
-        for formatted_data in formatted_datas:
-            self.datalake_manager.insert_document(self.collection_name, formatted_data)
+        self.buffer_to_datalake(self.transform_data_to_multiple_dicts(data))
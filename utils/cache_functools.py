@@ -0,0 +1,268 @@
+"""
+This module contains on-disk caches for API responses and scraped pages.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Time to live in seconds per endpoint, None meaning the response never expires.
+# Endpoints missing from the mapping are not cached.
+DEFAULT_TTLS: Dict[str, Optional[float]] = {
+    'onecall/day_summary': None,
+    'onecall/timemachine': None,
+    'air_pollution/history': None,
+    'geo/1.0/direct': 30 * 24 * 3600,
+    '2.5/weather': 10 * 60,
+    '2.5/air_pollution': 10 * 60,
+}
+
+
+class ResponseCache:
+    """ Compressed on-disk cache of JSON responses with LRU eviction """
+    def __init__(self, directory: Union[str, Path],
+                 ttls: Optional[Dict[str, Optional[float]]] = None,
+                 max_size: int = 512 * 1024 ** 2, ignored_params=('appid',)):
+        """
+        :param directory: The directory where the responses are stored.
+        :param ttls: The time to live per endpoint. Defaults to DEFAULT_TTLS.
+        :param max_size: The maximum size of the cache in bytes.
+        :param ignored_params: The query parameters left out of the cache key.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.max_size = max_size
+        self.ignored_params = set(ignored_params)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.size = sum(path.stat().st_size for path in self.directory.glob('*.json.gz'))
+
+    def normalize_url(self, url: str) -> str:
+        """
+        Normalizes a URL by sorting its query parameters and
+        removing the ignored ones, such as the API key.
+
+        :param url: The URL to normalize.
+        :return: The normalized URL.
+        """
+        parts = urlsplit(url)
+        query = sorted((key, value) for key, value in parse_qsl(parts.query)
+                       if key not in self.ignored_params)
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+
+    def ttl(self, url: str) -> Optional[float]:
+        """
+        Finds the time to live of a URL from the longest matching endpoint.
+
+        :param url: The URL requested.
+        :return: The time to live in seconds, None if it never expires,
+            or 0 if the endpoint is not cached.
+        """
+        path = urlsplit(url).path
+        endpoints = [endpoint for endpoint in self.ttls if path.endswith(endpoint)]
+        if not endpoints:
+            return 0
+        return self.ttls[max(endpoints, key=len)]
+
+    def path(self, url: str) -> Path:
+        """
+        :param url: The URL requested.
+        :return: The file storing the response of the URL.
+        """
+        key = hashlib.sha256(self.normalize_url(url).encode('utf-8')).hexdigest()
+        return self.directory / f"{key}.json.gz"
+
+    def get(self, url: str):
+        """
+        Returns the cached response of a URL.
+
+        :param url: The URL requested.
+        :return: The cached data, or None if it is missing or expired.
+        """
+        ttl = self.ttl(url)
+        path = self.path(url)
+        entry = None
+        if ttl != 0:
+            try:
+                with gzip.open(path, 'rt', encoding='utf-8') as file:
+                    entry = json.load(file)
+            except (OSError, ValueError):
+                entry = None
+        if entry is None or (ttl is not None and time.time() - entry['stored_at'] > ttl):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Touch the file so that the eviction keeps the recently used entries
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry['data']
+
+    def put(self, url: str, data):
+        """
+        Stores the response of a URL, evicting the least recently used
+        entries if the cache grows over its maximum size.
+
+        :param url: The URL requested.
+        :param data: The JSON-serializable response.
+        """
+        if self.ttl(url) == 0:
+            return
+        path = self.path(url)
+        entry = {'url': self.normalize_url(url), 'stored_at': time.time(), 'data': data}
+        # Write to a temporary file first so that readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as file:
+            json.dump(entry, file)
+        size = os.path.getsize(tmp_path)
+        previous_size = path.stat().st_size if path.exists() else 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.size += size - previous_size
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache
+        is back under 90% of its maximum size.
+        """
+        entries = []
+        for path in self.directory.glob('*.json.gz'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.size <= 0.9 * self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: The hit, miss and eviction counters and the cache size in bytes.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': self.size}
+
+
+class PageCache:
+    """
+    On-disk cache of raw pages with their ETag and Last-Modified validators.
+    Permanent pages are served without any request, the others are
+    revalidated with conditional requests.
+    """
+    def __init__(self, directory: Union[str, Path]):
+        """
+        :param directory: The directory where the pages are stored.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, url: str) -> Path:
+        """
+        :param url: The URL of the page.
+        :return: The file storing the page, next to a '.json' file holding its metadata.
+        """
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return self.directory / f"{key}.html.gz"
+
+    def get(self, url: str) -> Optional[Tuple[bytes, Dict]]:
+        """
+        Returns a cached page.
+
+        :param url: The URL of the page.
+        :return: The raw content and the metadata of the page, or None if it is missing.
+        """
+        path = self.path(url)
+        try:
+            metadata = json.loads(path.with_suffix('.json').read_text(encoding='utf-8'))
+            with gzip.open(path, 'rb') as file:
+                return file.read(), metadata
+        except (OSError, ValueError):
+            return None
+
+    def validators(self, metadata: Dict) -> Dict[str, str]:
+        """
+        Builds the headers of a conditional request for a cached page.
+
+        :param metadata: The metadata of the cached page.
+        :return: The If-None-Match and If-Modified-Since headers available.
+        """
+        headers = {}
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+        return headers
+
+    def put(self, url: str, content: bytes, etag: Optional[str] = None,
+            last_modified: Optional[str] = None, permanent: bool = False):
+        """
+        Stores a page. The content is written before its metadata, and both
+        through temporary files, so that readers never see partial entries.
+
+        :param url: The URL of the page.
+        :param content: The raw content of the page.
+        :param etag: The ETag header of the response.
+        :param last_modified: The Last-Modified header of the response.
+        :param permanent: Whether the page never changes and needs no revalidation.
+        """
+        path = self.path(url)
+        metadata = {'url': url, 'etag': etag, 'last_modified': last_modified,
+                    'permanent': permanent, 'stored_at': time.time()}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wb') as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(metadata, file)
+        os.replace(tmp_path, path.with_suffix('.json'))
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Returns the process-wide response cache, creating it on first use.
+    The settings are read from the OPENWEATHER_CACHE_* environment variables.
+
+    :return: The shared ResponseCache, or None if the cache is disabled.
+    """
+    global _cache
+    if os.getenv('OPENWEATHER_CACHE_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            default_directory = Path(__file__).parents[1] / '.cache' / 'openweather'
+            _cache = ResponseCache(
+                os.getenv('OPENWEATHER_CACHE_DIR', str(default_directory)),
+                max_size=int(os.getenv('OPENWEATHER_CACHE_MAX_MB', '512')) * 1024 ** 2,
+            )
+        return _cache
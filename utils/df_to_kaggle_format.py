@@ -1,34 +1,47 @@
 import pandas as pd
 
-from database.postgresql_functools import City
+WEATHER_COLUMNS = ['date', 'city_id', 'wind_dir', 'wind_speed', 'humidity', 'pressure',
+                   'cloud', 'temp']
 
 
 def transform_to_kaggle_format(df, postgres):
-    df['date'] = pd.to_datetime(df['date'])
-    df['city_id'] = df['location'].apply(
-        lambda name: postgres.fetch_record(City, {'name': name}).id)
+    """
+    Splits daily observations in the Kaggle format into the daily_weather
+    rows and the 9am and 3pm weather rows.
+
+    :param df: DataFrame with a location and a date column, and the Kaggle measures.
+    :param postgres: The PostgresManager used to look up the city IDs.
+    :return: The daily_weather, 9am weather and 3pm weather DataFrames.
+    :raises ValueError: If a location does not match any city.
+    """
+    # One query for the whole frame instead of one per row
+    city_ids = postgres.fetch_city_ids()
+    unknown = set(df['location'].unique()) - set(city_ids)
+    if unknown:
+        raise ValueError(f"Unknown locations: {', '.join(sorted(map(str, unknown)))}")
+
+    dates = pd.to_datetime(df['date']).dt.normalize()
+    df = df.assign(date=dates, city_id=df['location'].map(city_ids))
 
     daily_weather = df[['date', 'city_id', 'min_temp', 'max_temp', 'rainfall',
                         'evaporation', 'sunshine', 'wind_gust_dir', 'wind_gust_speed']]
 
-    weather_9am = df.assign(date=lambda x: x['date'].apply(
-        lambda date: f"{date.strftime('%Y-%m-%d')} 09:00:00")) \
+    weather_9am = df.assign(date=dates + pd.Timedelta(hours=9)) \
         .rename(columns={'wind_dir_9am': 'wind_dir',
                          'wind_speed_9am': 'wind_speed',
                          'humidity_9am': 'humidity',
                          'pressure_9am': 'pressure',
                          'cloud_9am': 'cloud',
                          'temp_9am': 'temp'}) \
-        [['date', 'city_id', 'wind_dir', 'wind_speed', 'humidity', 'pressure', 'cloud', 'temp']]
+        [WEATHER_COLUMNS]
 
-    weather_3pm = df.assign(date=lambda x: x['date'].apply(
-        lambda date: f"{date.strftime('%Y-%m-%d')} 15:00:00")) \
+    weather_3pm = df.assign(date=dates + pd.Timedelta(hours=15)) \
         .rename(columns={'wind_dir_3pm': 'wind_dir',
                          'wind_speed_3pm': 'wind_speed',
                          'humidity_3pm': 'humidity',
                          'pressure_3pm': 'pressure',
                          'cloud_3pm': 'cloud',
                          'temp_3pm': 'temp'}) \
-        [['date', 'city_id', 'wind_dir', 'wind_speed', 'humidity', 'pressure', 'cloud', 'temp']]
+        [WEATHER_COLUMNS]
 
     return daily_weather, weather_9am, weather_3pm
@@ -0,0 +1,103 @@
+"""
+This module contains functions to match coordinates to the nearest known city.
+"""
+from typing import Callable, Dict, Iterable, Sequence, Tuple
+
+import numpy as np
+
+# Mean Earth radius in kilometers
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_distance(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Computes the great-circle distance between two sets of coordinates.
+    Inputs can be scalars or arrays and are broadcast together.
+
+    :param lat1: Latitude(s) of the first point(s), in degrees.
+    :param lon1: Longitude(s) of the first point(s), in degrees.
+    :param lat2: Latitude(s) of the second point(s), in degrees.
+    :param lon2: Longitude(s) of the second point(s), in degrees.
+    :return: The distance(s) in kilometers.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class CityIndex:
+    """ In-memory nearest-city index over the city table """
+    def __init__(self, loader: Callable[[], Iterable], chunk_size: int = 4096):
+        """
+        :param loader: A callable returning the city records, each
+            with id, latitude and longitude attributes.
+        :param chunk_size: The number of coordinates matched at once by nearest_many.
+        """
+        self.loader = loader
+        self.chunk_size = chunk_size
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reloads the cities from the loader and clears the lookup cache.
+        """
+        cities = list(self.loader())
+        ids = np.array([city.id for city in cities], dtype=np.int64)
+        latitudes = np.radians(np.array([city.latitude for city in cities], dtype=float))
+        longitudes = np.radians(np.array([city.longitude for city in cities], dtype=float))
+        # Replace the arrays in one assignment so concurrent lookups never mix two loads
+        self.cities = (ids, latitudes, longitudes, np.cos(latitudes))
+        self.cache: Dict[Tuple[float, float], int] = {}
+
+    def __len__(self) -> int:
+        return len(self.cities[0])
+
+    @staticmethod
+    def _nearest_positions(cities, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+        # The haversine term grows with the distance, so its argmin is the nearest city
+        _, city_latitudes, city_longitudes, city_cos_latitudes = cities
+        latitudes = np.radians(latitudes)[:, np.newaxis]
+        longitudes = np.radians(longitudes)[:, np.newaxis]
+        a = (np.sin((city_latitudes - latitudes) / 2) ** 2
+             + np.cos(latitudes) * city_cos_latitudes
+             * np.sin((city_longitudes - longitudes) / 2) ** 2)
+        return np.argmin(a, axis=1)
+
+    def nearest(self, latitude: float, longitude: float) -> int:
+        """
+        Finds the city closest to the given coordinates.
+
+        :param latitude: The latitude of the location.
+        :param longitude: The longitude of the location.
+        :return: The ID of the nearest city.
+        :raises LookupError: If the index holds no city.
+        """
+        key = (latitude, longitude)
+        city_id = self.cache.get(key)
+        if city_id is None:
+            city_id = int(self.nearest_many([latitude], [longitude])[0])
+            self.cache[key] = city_id
+        return city_id
+
+    def nearest_many(self, latitudes: Sequence[float],
+                     longitudes: Sequence[float]) -> np.ndarray:
+        """
+        Finds the city closest to each pair of coordinates.
+
+        :param latitudes: The latitudes of the locations.
+        :param longitudes: The longitudes of the locations.
+        :return: An array with the ID of the nearest city for each location.
+        :raises LookupError: If the index holds no city.
+        """
+        cities = self.cities
+        if not len(cities[0]):
+            raise LookupError("The city index is empty")
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        positions = np.empty(len(latitudes), dtype=np.int64)
+        for start in range(0, len(latitudes), self.chunk_size):
+            end = start + self.chunk_size
+            positions[start:end] = self._nearest_positions(cities, latitudes[start:end],
+                                                           longitudes[start:end])
+        return cities[0][positions]
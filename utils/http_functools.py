@@ -0,0 +1,162 @@
+"""
+This module contains a pooled HTTP client with retries, shared by the API callers.
+"""
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.metrics_functools import metrics
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+class HttpClient:
+    """ Pooled HTTP client with keep-alive, timeouts and retries """
+    def __init__(self, max_retries: int = 5, backoff_factor: float = 0.5,
+                 backoff_max: float = 60.0, connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0, pool_maxsize: int = 32):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        Computes the delay before the next attempt, using exponential
+        backoff with full jitter.
+
+        :param attempt: The number of the attempt that just failed, starting at 0.
+        :return: The delay in seconds.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * 2 ** attempt))
+
+    def retry_after(self, response: requests.Response) -> Optional[float]:
+        """
+        Reads the delay requested by the server in the Retry-After header.
+
+        :param response: The response to inspect.
+        :return: The delay in seconds, or None if the header is missing or invalid.
+        """
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                retry_date = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            delay = (retry_date - datetime.now(timezone.utc)).total_seconds()
+        return min(max(delay, 0.0), self.backoff_max)
+
+    def get(self, url: str, timeout: Optional[Union[float, Tuple[float, float]]] = None,
+            **kwargs) -> requests.Response:
+        """
+        Sends a GET request, retrying connection errors, timeouts and
+        retryable status codes.
+
+        :param url: The URL to request.
+        :param timeout: The (connect, read) timeouts in seconds. Defaults to the client's.
+        :return: The last response received.
+        :raises requests.RequestException: If the last attempt fails to connect.
+        """
+        timeout = timeout or self.timeout
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            try:
+                with metrics.timer('http_request_seconds', host=host):
+                    response = self.session.get(url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.increment('http_errors_total', host=host, error=type(e).__name__)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+            else:
+                metrics.increment('http_responses_total', host=host, status=response.status_code)
+                if response.status_code not in RETRY_STATUS_CODES \
+                        or attempt >= self.max_retries:
+                    return response
+                delay = self.retry_after(response)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+            metrics.increment('http_retries_total', host=host)
+            time.sleep(delay)
+            attempt += 1
+
+
+class HostThrottle:
+    """ Politeness limit: bounded concurrency and spacing of the requests per host """
+    def __init__(self, max_concurrent: int = 2, min_interval: float = 0.0):
+        """
+        :param max_concurrent: The maximum number of requests in flight per host.
+        :param min_interval: The minimum delay in seconds between two
+            requests starting on the same host.
+        """
+        self.max_concurrent = max_concurrent
+        self.min_interval = min_interval
+        self.semaphores: Dict[str, threading.BoundedSemaphore] = defaultdict(
+            lambda: threading.BoundedSemaphore(max_concurrent))
+        self.next_start: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, url: str) -> Iterator[None]:
+        """
+        Waits for the host of the URL to accept one more request, and holds
+        one of its slots for the duration of the enclosed block.
+
+        :param url: The URL about to be requested.
+        """
+        host = urlsplit(url).netloc
+        with self._lock:
+            semaphore = self.semaphores[host]
+        with semaphore:
+            if self.min_interval:
+                with self._lock:
+                    now = time.monotonic()
+                    start = max(now, self.next_start[host])
+                    self.next_start[host] = start + self.min_interval
+                if start > now:
+                    time.sleep(start - now)
+            yield
+
+
+_client: Optional[HttpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    """
+    Returns the process-wide HTTP client, creating it on first use.
+    The settings are read from the HTTP_* environment variables.
+
+    :return: The shared HttpClient.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(
+                max_retries=int(os.getenv('HTTP_MAX_RETRIES', '5')),
+                backoff_factor=float(os.getenv('HTTP_BACKOFF_FACTOR', '0.5')),
+                connect_timeout=float(os.getenv('HTTP_CONNECT_TIMEOUT', '5')),
+                read_timeout=float(os.getenv('HTTP_READ_TIMEOUT', '30')),
+            )
+        return _client
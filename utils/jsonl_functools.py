@@ -0,0 +1,69 @@
+"""
+This module contains functions to read large JSON lines files in batches,
+and to split them into byte ranges read by separate processes.
+"""
+
+import json
+import os
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    # Several times faster than the standard library on large payloads
+    import orjson
+    loads: Callable[[bytes], Dict] = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+def split_offsets(filename: str, parts: int) -> List[Tuple[int, int]]:
+    """
+    Splits a JSON lines file into byte ranges of about the same size,
+    each starting at the beginning of a line.
+
+    :param filename: The name of the file.
+    :param parts: The number of ranges wanted.
+    :return: The (start, end) offsets of the ranges, covering each line once.
+    """
+    size = os.path.getsize(filename)
+    boundaries = [0]
+    with open(filename, 'rb') as file:
+        for part in range(1, parts):
+            offset = max(size * part // parts, boundaries[-1])
+            if offset:
+                # Move to the start of the first line beginning at or after offset
+                file.seek(offset - 1)
+                file.readline()
+                offset = file.tell()
+            boundaries.append(min(offset, size))
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def iter_batches(filename: str, start: int = 0, end: Optional[int] = None,
+                 batch_size: int = 10000) -> Iterator[List[Dict]]:
+    """
+    Reads the JSON documents of the lines starting in a byte range.
+
+    :param filename: The name of the file.
+    :param start: The offset of the first line, as returned by split_offsets.
+    :param end: The offset where the range ends, the end of the file by default.
+    :param batch_size: The number of documents per batch.
+    :return: An iterator over lists of documents.
+    """
+    end = os.path.getsize(filename) if end is None else end
+    batch = []
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        position = start
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.strip():
+                batch.append(loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,259 @@
+"""
+This module contains counters and latency histograms for instrumenting the
+pipelines, and exporters to the Prometheus text format and JSON lines.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """ Cumulative latency histogram with fixed buckets """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def copy(self) -> 'Histogram':
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+        return histogram
+
+    def since(self, previous: Optional['Histogram']) -> 'Histogram':
+        """
+        :param previous: A copy of this histogram taken earlier, or None.
+        :return: The observations recorded after the copy was taken.
+        """
+        histogram = self.copy()
+        if previous is not None:
+            histogram.counts = [count - before for count, before in zip(self.counts,
+                                                                        previous.counts)]
+            histogram.count -= previous.count
+            histogram.sum -= previous.sum
+        return histogram
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimates a quantile as the upper bound of the bucket holding it.
+
+        :param q: The quantile, between 0 and 1.
+        :return: The estimated value, or None if nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class MetricsRegistry:
+    """ Thread-safe registry of counters, gauges and histograms """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """
+        Adds a value to a counter.
+
+        :param name: The name of the counter.
+        :param value: The value to add.
+        :param labels: The labels of the series.
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """
+        Sets the current value of a gauge.
+
+        :param name: The name of the gauge.
+        :param value: The value.
+        :param labels: The labels of the series.
+        """
+        with self._lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Records a value, usually a duration in seconds, in a histogram.
+
+        :param name: The name of the histogram.
+        :param value: The value observed.
+        :param labels: The labels of the series.
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """
+        Times the enclosed block and records its duration in a histogram,
+        whether it succeeds or not.
+
+        :param name: The name of the histogram.
+        :param labels: The labels of the series.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name: str, **labels) -> float:
+        """
+        :return: The current value of a counter, 0 if it was never incremented.
+        """
+        with self._lock:
+            return self.counters.get((name, _labels(labels)), 0)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        """
+        :return: A histogram, or None if nothing was observed.
+        """
+        with self._lock:
+            return self.histograms.get((name, _labels(labels)))
+
+    def snapshot(self) -> 'MetricsRegistry':
+        """
+        :return: A copy of every series, e.g. to report what a run added with
+            Histogram.since and the difference of the counters.
+        """
+        registry = MetricsRegistry(self.buckets)
+        with self._lock:
+            registry.counters = dict(self.counters)
+            registry.gauges = dict(self.gauges)
+            registry.histograms = {key: histogram.copy()
+                                   for key, histogram in self.histograms.items()}
+        return registry
+
+    def reset(self):
+        """ Forgets every series """
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def to_prometheus(self) -> str:
+        """
+        :return: Every series in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (series_name, labels), value in sorted(series.items()):
+                        if series_name == name:
+                            lines.append(f"{name}{_format_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (series_name, labels), histogram in sorted(self.histograms.items(),
+                                                               key=lambda item: item[0]):
+                    if series_name != name:
+                        continue
+                    cumulative = 0
+                    bounds = [str(bound) for bound in histogram.buckets] + ['+Inf']
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', bound))} "
+                                     f"{cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def to_json_lines(self) -> str:
+        """
+        :return: Every series as one JSON document per line, with a timestamp.
+        """
+        timestamp = time.time()
+        records: List[Dict] = []
+        with self._lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                for (name, labels), value in sorted(series.items()):
+                    records.append({'timestamp': timestamp, 'name': name, 'type': kind,
+                                    'labels': dict(labels), 'value': value})
+            for (name, labels), histogram in sorted(self.histograms.items(),
+                                                    key=lambda item: item[0]):
+                records.append({'timestamp': timestamp, 'name': name, 'type': 'histogram',
+                                'labels': dict(labels), 'count': histogram.count,
+                                'sum': histogram.sum, 'p50': histogram.quantile(0.5),
+                                'p99': histogram.quantile(0.99)})
+        return ''.join(json.dumps(record) + '\n' for record in records)
+
+    def export(self, path: Union[str, Path]):
+        """
+        Writes the metrics to a file: a '.prom' file is replaced with the
+        Prometheus text format, any other file gets JSON lines appended.
+        Pipelines running in several threads can export at the same time.
+
+        :param path: The file to write.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._export_lock:
+            if path.suffix == '.prom':
+                # A temporary file per export, so that a reader never sees a partial file
+                descriptor, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name,
+                                                        suffix='.tmp')
+                try:
+                    with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+                        file.write(self.to_prometheus())
+                    # mkstemp creates the file readable by its owner only
+                    os.chmod(tmp_path, 0o644)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+            else:
+                with open(path, 'a', encoding='utf-8') as file:
+                    file.write(self.to_json_lines())
+
+
+# Registry shared by the whole process
+metrics = MetricsRegistry()
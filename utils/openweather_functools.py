@@ -2,24 +2,44 @@
 This module contains utility functions for fetching and processing data
 """
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Union
+from urllib.parse import urlsplit
 
-import requests
+from utils.cache_functools import ResponseCache
+from utils.http_functools import get_http_client
+from utils.metrics_functools import metrics
 
 
-def request_api(url: str) -> Dict:
+def request_api(url: str,
+                timeout: Optional[Union[float, Tuple[float, float]]] = None,
+                cache: Optional[ResponseCache] = None) -> Dict:
     """
     Requests data from the specified URL and returns the response as a dictionary.
-    Raises an exception for non-200 responses.
+    Transient failures are retried by the shared HTTP client, and an
+    exception is raised for non-200 responses left after the retries.
 
     :param url: The URL from which to fetch the data.
+    :param timeout: The (connect, read) timeouts in seconds. Defaults to the client's.
+    :param cache: An optional response cache, checked before calling the API.
     :return: The data retrieved from the API, parsed into a dictionary.
     :raises ConnectionError: If the API response status code is not 200.
     """
-    response = requests.get(url, timeout=10)
+    endpoint = urlsplit(url).path
+    if cache is not None:
+        data = cache.get(url)
+        if data is not None:
+            metrics.increment('api_cache_hits_total', endpoint=endpoint)
+            return data
+
+    with metrics.timer('api_request_seconds', endpoint=endpoint):
+        response = get_http_client().get(url, timeout=timeout)
+    metrics.increment('api_response_bytes_total', len(response.content), endpoint=endpoint)
     if response.status_code == 200:
         data = response.json()
+        if cache is not None:
+            cache.put(url, data)
         return data
+    metrics.increment('api_failures_total', endpoint=endpoint, status=response.status_code)
     raise ConnectionError(f"Web server response: {response.status_code}")
 
 
@@ -0,0 +1,83 @@
+"""
+This module contains functions to write and read partitioned Parquet datasets.
+"""
+
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# A predicate on a column, e.g. ('location', '=', 'Sydney') or ('year', '>=', 2023)
+Filter = Tuple[str, str, object]
+
+
+def to_table(df: pd.DataFrame, categorical_columns: Sequence[str] = ()) -> pa.Table:
+    """
+    Converts a DataFrame to an Arrow table, dictionary-encoding the given
+    columns so that every file of a dataset shares the same schema.
+
+    :param df: The DataFrame to convert.
+    :param categorical_columns: The text columns with few distinct values.
+    :return: The Arrow table.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for column in categorical_columns:
+        index = table.schema.get_field_index(column)
+        encoded = pc.dictionary_encode(table[column].cast(pa.string()))
+        table = table.set_column(index, column, encoded)
+    return table
+
+
+def append_to_dataset(df: pd.DataFrame, directory: Union[str, Path],
+                      partition_cols: Sequence[str],
+                      categorical_columns: Sequence[str] = ()) -> None:
+    """
+    Appends rows to a Parquet dataset partitioned in <column>=<value>
+    directories, with column statistics so that readers can skip row groups.
+
+    :param df: The rows to append.
+    :param directory: The root directory of the dataset.
+    :param partition_cols: The columns to partition the dataset by.
+    :param categorical_columns: The text columns with few distinct values.
+    """
+    if df.empty:
+        return
+    # A new file name per call, so that appends never overwrite earlier files
+    pq.write_to_dataset(to_table(df, categorical_columns), str(directory),
+                        partition_cols=list(partition_cols),
+                        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+                        existing_data_behavior='overwrite_or_ignore',
+                        write_statistics=True)
+
+
+def replace_dataset(source: Union[str, Path], target: Union[str, Path]) -> None:
+    """
+    Replaces a dataset by one written to another directory.
+
+    :param source: The directory of the new dataset.
+    :param target: The directory of the dataset to replace.
+    """
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.replace(source, target)
+
+
+def load_dataset(directory: Union[str, Path], columns: Optional[List[str]] = None,
+                 filters: Optional[List[Filter]] = None) -> pd.DataFrame:
+    """
+    Loads a partitioned Parquet dataset. Only the columns asked for are
+    read, filters on partition columns skip whole directories and filters
+    on other columns skip the row groups their statistics rule out.
+
+    :param directory: The root directory of the dataset.
+    :param columns: The columns to read, all of them by default.
+    :param filters: The predicates the rows must match, all of them.
+    :return: The matching rows, dictionary-encoded columns as categoricals.
+    """
+    return pq.read_table(str(directory), columns=columns, filters=filters or None).to_pandas()